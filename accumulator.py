@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+'''
+Mergeable tweets statistics.
+
+Raw sums and counters are kept apart from derived values (averages, top
+words), so stats of different runs/files can be merged and extended with
+new tweets without recomputing them from scratch.
+'''
+from __future__ import division
+
+import threading
+
+from collections import Counter
+from itertools import islice
+
+import metrics
+from hll import HyperLogLog
+from tokenizer import tokenize
+from topk import SpaceSaving
+from topk import TopK
+from vocab import CompactCounter
+
+
+numpy = False    # Not imported yet (see _numpy)
+
+
+def _numpy():
+    '''
+    numpy if installed, None otherwise. Imported on the first batch, not
+    at start (slow import).
+    '''
+    global numpy
+    if numpy is False:
+        try:
+            import numpy as module
+        except ImportError:    # Optional: word length histogram by bincount
+            module = None
+        numpy = module
+    return numpy
+
+
+def _lazy_counter(name):
+    '''
+    Property of counter which can be loaded on demand (see from_dict).
+    '''
+    attr = '_{}'.format(name)
+
+    def getter(self):
+        if name in self._pending:
+            self._load(name)
+        return getattr(self, attr)
+
+    def setter(self, value):
+        self._pending.pop(name, None)
+        setattr(self, attr, value)
+
+    return property(getter, setter)
+
+
+class StatsAccumulator(object):
+    '''
+    Raw sums and counters of tweets statistics.
+    Derived values are computed by views() and never stored back.
+    Counters may be loaded lazily, on the first access.
+
+    top - number of the most frequent words (unique_most, sentence)
+    capacity - max size of uniques (SpaceSaving heavy-hitters instead of
+               exact Counter), None - unbounded
+    compact - uniques and origin as vocab.CompactCounter (interned tokens,
+              array columns): several times less memory, slower updates
+    distinct - keep HyperLogLog sketch of words (self.distinct): mergeable
+               distinct count in constant memory, unique_words_count of
+               capacity bounded uniques
+    '''
+    BIAS = 20    # Max word len bias
+    TOP = 30    # Words in unique_most
+
+    COUNTERS = ('uniques', 'letters_per_word', 'origin')
+    SUMS = ('tweets_count', 'global_retweets', 'global_length',
+            'global_words_count', 'global_sentences')
+
+    uniques = _lazy_counter('uniques')
+    letters_per_word = _lazy_counter('letters_per_word')
+    origin = _lazy_counter('origin')
+
+    def __init__(self, top=TOP, capacity=None, compact=False, distinct=False):
+        self.capacity = capacity
+        self.compact = compact
+        self.distinct = HyperLogLog() if distinct else None
+        self.top = TopK(top)
+        self._pending = {}    # Counters to load: {name: loader(name)}
+        self._load_lock = threading.Lock()
+        self._sizes = {}    # Sizes of pending counters
+        self.uniques = self._counter('uniques')
+        self.letters_per_word = self._counter('letters_per_word')
+        self.origin = self._counter('origin')
+        self.tweets_count = 0
+        self.global_retweets = 0
+        self.global_length = 0
+        self.global_words_count = 0
+        self.global_sentences = 0
+        self.since_id = None    # Newest tweet id counted
+        self.gaps = []    # Id ranges below since_id not fetched yet
+
+    def add(self, tweet, words):
+        '''
+        Adds single tweet.
+        words - words extracted from tweet text
+        '''
+        text = tweet[u'text']
+        # Unique words
+        uniques = self.uniques
+        uniques.update(words)
+        offer = self.top.offer
+        distinct = set(words)
+        for word in distinct:
+            offer(word, uniques[word])
+        if self.distinct is not None:
+            self.distinct.update(distinct)
+        # words count by length (letters per word)
+        self.letters_per_word.update([len(word) for word in words])
+        # time zones - origin of tweet
+        self.origin[tweet[u'user'][u'time_zone']] += 1
+        # Global sum of all retweets
+        self.global_retweets += int(tweet[u'retweet_count'])
+        # Global tweets length (chars)
+        self.global_length += len(text)
+        # Global words count
+        self.global_words_count += len(words)
+        # Global sentences count
+        self.global_sentences += text.count('.')
+
+        self.tweets_count += 1
+        if tweet[u'id'] > self.since_id:    # None is less than any id
+            self.since_id = tweet[u'id']
+
+    def add_batch(self, tweets, words=None):
+        '''
+        Adds chunk of tweets (e.g. a page of search results) with one bulk
+        update of every counter. Same result as add() of each tweet.
+        words - words of all tweets in one list, if tokenized already
+        '''
+        tweets = list(tweets)
+        if not tweets:
+            return
+        texts = [tweet[u'text'] for tweet in tweets]
+        if words is None:
+            with metrics.registry.timer('tokenize_seconds'):
+                # Tokens never span white space: one pass over all texts
+                # gives the words of every tweet in a single list
+                words = tokenize(u'\n'.join(texts))
+
+        # Unique words
+        uniques = self.uniques
+        uniques.update(words)
+        offer = self.top.offer
+        distinct = set(words)
+        for word in distinct:
+            offer(word, uniques[word])
+        if self.distinct is not None:
+            self.distinct.update(distinct)
+        # words count by length (letters per word)
+        numpy = _numpy()
+        if numpy is not None:
+            lengths = numpy.bincount(numpy.fromiter(
+                (len(word) for word in words), numpy.int64, len(words)))
+            for length in numpy.flatnonzero(lengths):
+                self.letters_per_word[int(length)] += int(lengths[length])
+        else:
+            self.letters_per_word.update([len(word) for word in words])
+        # time zones - origin of tweet
+        self.origin.update([tweet[u'user'][u'time_zone'] for tweet in tweets])
+        # Global sums
+        self.global_retweets += sum(int(tweet[u'retweet_count'])
+                                    for tweet in tweets)
+        self.global_length += sum(len(text) for text in texts)
+        self.global_words_count += len(words)
+        self.global_sentences += sum(text.count('.') for text in texts)
+
+        self.tweets_count += len(tweets)
+        self.since_id = max(self.since_id,
+                            max(tweet[u'id'] for tweet in tweets))
+
+    def merge(self, other):
+        '''
+        Adds sums and counters of other accumulator to this one.
+        '''
+        for name in self.COUNTERS:
+            getattr(self, name).update(getattr(other, name))
+        for word in other.uniques:
+            self.top.offer(word, self.uniques[word])
+        if self.distinct is not None:
+            if other.distinct is not None:
+                self.distinct.merge(other.distinct)
+            else:    # Exact words of other (e.g. corpus workers)
+                self.distinct.update(other.uniques)
+        for name in self.SUMS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.since_id = max(self.since_id, other.since_id)
+        return self
+
+    def views(self):
+        '''
+        Derived stats: sums, averages and top words (no counters).
+        '''
+        tweets_count = max(self.tweets_count, 1)
+
+        view = dict((name, getattr(self, name)) for name in self.SUMS)
+        # avg retweets per tweet
+        view['avg_retweets'] = self.global_retweets / tweets_count
+        # avg length (chars per tweet)
+        view['avg_length'] = self.global_length / tweets_count
+        # avg words per tweet
+        view['avg_words_count'] = self.global_words_count / tweets_count
+        # avg sentences per tweet
+        view['avg_sentences'] = self.global_sentences / tweets_count
+        # unique words count (bounded uniques hold only a part of words)
+        if self.capacity and (self.distinct is not None):
+            view['unique_words_count'] = int(round(self.distinct.count()))
+        else:
+            view['unique_words_count'] = self.size('uniques')
+        # unique words count % of all words
+        view['unique_words_count_per'] = \
+            view['unique_words_count'] / max(self.global_words_count, 1)
+        #view['avg_word_len'] = IMPLEMENT (like: 4.56 letters per word)
+        view['avg_words_per_sentence'] = \
+            self.global_words_count / max(self.global_sentences, 1)
+        view['unique_most'] = self.top.words()
+        return view
+
+    def size(self, name):
+        '''
+        Number of keys in counter (without loading it).
+        '''
+        if name in self._pending:
+            return self._sizes.get(name, 0)
+        return len(getattr(self, name))
+
+    def letters_view(self):
+        '''
+        letters_per_word without too big words
+        '''
+        return {k:v for k,v in self.letters_per_word.items() if k < self.BIAS}
+
+    def to_dict(self):
+        '''
+        Raw data as JSON serializable dict
+        '''
+        data = dict((name, getattr(self, name)) for name in self.SUMS)
+        for name in self.COUNTERS:
+            data[name] = dict(getattr(self, name).items())
+        data['since_id'] = self.since_id
+        data['gaps'] = self.gaps
+        data['sizes'] = dict((name, self.size(name)) for name in self.COUNTERS)
+        data['top'] = self.top.items()
+        if self.distinct is not None:
+            data['distinct'] = self.distinct.to_dict()
+        return data
+
+    @classmethod
+    def from_dict(cls, data, loader=None, **kwargs):
+        '''
+        Reconstructs accumulator from to_dict() result or from the old
+        _stats dict (no tweets_count there, averages are used to restore it).
+
+        loader - loader(name) returns counter missing in data, called on the
+                 first access to the counter
+        kwargs - see StatsAccumulator
+        '''
+        acc = cls(**kwargs)
+        for name in cls.COUNTERS:
+            if name in data:
+                setattr(acc, name, acc._counter(name, data[name]))
+            elif loader is not None:
+                acc._pending[name] = loader
+        acc._sizes = data.get('sizes', {})
+
+        for name in cls.SUMS:
+            setattr(acc, name, data.get(name, 0))
+        acc.since_id = data.get('since_id')
+        acc.gaps = data.get('gaps', [])
+
+        if acc.distinct is not None:
+            sketch = data.get('distinct')
+            if (sketch is None) and (loader is not None):
+                sketch = loader('distinct')
+            if sketch:
+                acc.distinct = HyperLogLog.from_dict(sketch)
+            else:    # Saved without sketch: words of uniques
+                acc.distinct.update(acc.uniques)
+
+        top = data.get('top')
+        if (top is not None) and ((len(top) >= acc.top.k) or
+                                  (len(top) >= acc.size('uniques'))):
+            acc.top.load(top)
+        else:
+            acc.top.rebuild(acc.uniques)
+
+        if 'tweets_count' not in data:    # Old format
+            acc.tweets_count = cls._legacy_tweets_count(data)
+            # global_words_count used to start from 1
+            acc.global_words_count = max(acc.global_words_count - 1, 0)
+        return acc
+
+    def _counter(self, name, data=None):
+        if name == 'uniques' and self.capacity:
+            counter = SpaceSaving(self.capacity, on_evict=self.top.discard)
+        elif self.compact and name != 'letters_per_word':
+            counter = CompactCounter()
+        else:
+            counter = Counter()
+        if data:
+            if name == 'letters_per_word':    # JSON turns int keys into strings
+                data = {int(k):v for k,v in data.items()}
+            elif name == 'origin' and u'null' in data:    # And None too
+                data = dict(data)
+                data[None] = data.get(None, 0) + data.pop(u'null')
+            counter.update(data)
+        return counter
+
+    def _load(self, name):
+        with self._load_lock:    # Other threads wait for the same section
+            loader = self._pending.get(name)
+            if loader is None:    # Loaded while waiting
+                return
+            with metrics.registry.timer('load_seconds', section=name):
+                counter = self._counter(name, loader(name))
+            # Pending till the counter is there: readers not taking the
+            # lock never get the empty placeholder
+            setattr(self, '_{}'.format(name), counter)
+            del self._pending[name]
+
+    @staticmethod
+    def _legacy_tweets_count(data):
+        for total, avg in (('global_length', 'avg_length'),
+                           ('global_retweets', 'avg_retweets'),
+                           ('global_words_count', 'avg_words_count')):
+            if data.get(avg):
+                return int(round(data.get(total, 0) / data[avg]))
+        return 0
+
+
+def batches(iterable, size):
+    '''
+    Splits iterable (generator of tweets) into lists of size items.
+    '''
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+'''
+Local HTTP API serving saved stats as JSON (read only, no API requests).
+
+GET /stats/<word>[?k=30] - stats of keyword: sentence and averages; top
+                           words and origins for 'user' and 'admin' too
+                           (k - at most top_k of Stats)
+GET /keywords            - keywords kept in LRU cache
+
+Credentials are checked by HTTP Basic auth against the user file (see User),
+requests without them are served as guest. Loaded Stats are kept in an LRU
+cache and reloaded only when their stats file changes.
+
+Usage:
+python api.py [port] [cache size]
+'''
+
+import json
+import os
+import sys
+import threading
+import time
+
+from base64 import b64decode
+from BaseHTTPServer import BaseHTTPRequestHandler
+from BaseHTTPServer import HTTPServer
+from collections import OrderedDict
+from SocketServer import ThreadingMixIn
+from urllib import unquote
+from urlparse import parse_qs
+from urlparse import urlparse
+
+from twitter_stats import Stats
+from twitter_stats import User
+
+
+PORT = 8080
+CACHE_SIZE = 64    # Stats kept loaded
+TOP = 30    # Default number of top words and origins
+
+AVERAGES = ('tweets_count', 'avg_retweets', 'avg_length', 'avg_words_count',
+            'avg_sentences', 'avg_words_per_sentence', 'unique_words_count',
+            'unique_words_count_per')
+
+
+class StatsCache(object):
+    '''
+    LRU cache of loaded Stats by word (thread safe).
+
+    size - number of Stats kept, the least recently used are evicted
+    stats_kwargs - see Stats (storage, top_k, ...)
+    '''
+
+    def __init__(self, size=CACHE_SIZE, **stats_kwargs):
+        self.size = size
+        stats_kwargs.setdefault('storage', Stats.default_storage())
+        self.stats_kwargs = stats_kwargs
+        self._entries = OrderedDict()    # word: [stamp, Stats, {key: body}]
+        self._lock = threading.Lock()
+
+    def keywords(self):
+        with self._lock:
+            return list(self._entries)
+
+    def entry(self, word):
+        '''
+        [stamp, Stats, rendered bodies] of word, None if there are no stats.
+        Loads stats only if they are not cached or their file changed.
+        Sections the views use are loaded before request threads share them.
+        '''
+        stamp = self._stamp(word)
+        if stamp is None:
+            return None
+        with self._lock:
+            entry = self._entries.pop(word, None)
+            if entry is not None:
+                self._entries[word] = entry    # The most recently used
+                if entry[0] == stamp:
+                    return entry
+
+        stats = Stats(word, **self.stats_kwargs)
+        try:
+            stats._load_file()    # Not load(): no fetching if file is gone
+            stats.origin    # Lazy sections of views, before stats are shared
+        except IOError:    # Removed (maybe saved anew) since _stamp
+            if self._stamp(word) not in (None, stamp):
+                return self.entry(word)    # Load the new file
+            return None
+        entry = [stamp, stats, {}]
+        with self._lock:
+            self._entries.pop(word, None)
+            self._entries[word] = entry
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)    # Evict
+        return entry
+
+    def render(self, word, access, top=TOP):
+        '''
+        JSON body of stats of word for access ('admin', 'user', None - guest)
+        None if there are no stats.
+        '''
+        entry = self.entry(word)
+        if entry is None:
+            return None
+        # No more words are kept than top_k: cached bodies stay few
+        top = min(top, entry[1].top_k)
+        key = (access, top)
+        body = entry[2].get(key)    # Dashboards poll the same views
+        if body is None:
+            body = json.dumps(stats_view(entry[1], access, top))
+            entry[2][key] = body
+        return body
+
+    def _stamp(self, word):
+        storage = self.stats_kwargs['storage']
+        try:
+            info = os.stat(storage.path(word))
+        except OSError:
+            return None
+        if not storage.exists(word):
+            return None
+        return info.st_mtime, info.st_size
+
+
+def stats_view(stats, access, top=TOP):
+    '''
+    Dict of stats to show with access rights (guest: sentence and averages)
+    '''
+    view = dict((name, stats._stats[name]) for name in AVERAGES)
+    view['word'] = stats.word
+    view['sentence'] = stats.sentence
+    if access in ('admin', 'user'):
+        view['uniques'] = stats._acc.top.items()[:top]
+        view['origin'] = sorted(stats.origin.items(),
+                                key=lambda x: (x[1], x[0]), reverse=True)[:top]
+    return view
+
+
+class StatsHandler(BaseHTTPRequestHandler):
+    '''
+    Serves GET requests by server.cache (StatsCache)
+    '''
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [unquote(part) for part in url.path.split('/') if part]
+        access, valid = self._access()
+        if not valid:
+            return self._send(401, {'error': 'wrong credentials'},
+                              {'WWW-Authenticate': 'Basic realm="stats"'})
+
+        if parts == ['keywords']:
+            return self._send(200, self.server.cache.keywords())
+        if (len(parts) != 2) or (parts[0] != 'stats'):
+            return self._send(404, {'error': 'no such resource'})
+
+        word = parts[1]
+        if word.startswith('.') or ('/' in word) or ('\\' in word):
+            return self._send(400, {'error': 'wrong keyword'})
+        try:
+            top = int(parse_qs(url.query).get('k', [TOP])[0])
+        except ValueError:
+            top = -1
+        if top < 0:
+            return self._send(400, {'error': 'k must be non-negative integer'})
+
+        body = self.server.cache.render(word, access, top)
+        if body is None:
+            return self._send(404, {'error': 'no stats of {}'.format(word)})
+        self._send(200, body=body)
+
+    def _access(self):
+        '''
+        (access, credentials valid) by Basic auth, no credentials - guest
+        '''
+        header = self.headers.get('Authorization')
+        if not header:
+            return None, True
+        try:
+            scheme, credentials = header.split(None, 1)
+            user, pwd = b64decode(credentials).split(':', 1)
+        except (ValueError, TypeError):
+            return None, False
+        if scheme.lower() != 'basic':
+            return None, False
+        access = User(user, pwd).access
+        return access, access is not None
+
+    def _send(self, code, data=None, headers=None, body=None):
+        if body is None:
+            body = json.dumps(data)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        sys.stderr.write('{} {}\n'.format(time.strftime('%Y-%m-%d %H:%M:%S'),
+                                          format % args))
+
+
+class StatsServer(ThreadingMixIn, HTTPServer):
+    '''
+    HTTP server handling each request in a thread, with shared StatsCache
+    '''
+    daemon_threads = True
+
+    def __init__(self, address, cache=None):
+        HTTPServer.__init__(self, address, StatsHandler)
+        self.cache = cache or StatsCache()
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else PORT
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else CACHE_SIZE
+    server = StatsServer(('', port), StatsCache(size))
+    print('serving stats on port {}'.format(port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+'''
+Raw tweets archive.
+
+Fetched tweets are appended to gzipped JSON-lines files of the keyword,
+rotated by size, and can be replayed into Stats without hitting the API:
+<directory>/<word>/<word>.000000.jsonl.gz, <word>.000001.jsonl.gz, ...
+Fetched tweets are slim records (parsing.Tweet): only the fields stats use
+are archived.
+'''
+
+import gzip
+import json
+import os
+
+from corpus import read_tweets
+from parsing import Tweet
+
+
+MAX_BYTES = 16 * 1024 * 1024    # Compressed size of file before rotation
+
+
+class TweetArchive(object):
+    '''
+    Rotating JSON-lines archive of one keyword.
+
+    directory - root of archives (one subfolder per keyword)
+    max_bytes - compressed file size to start the next file
+    '''
+
+    def __init__(self, word, directory=None, max_bytes=MAX_BYTES):
+        self.word = word
+        self.directory = directory or '{}/archive'.format(os.getcwd())
+        self.path = '{}/{}'.format(self.directory, word)
+        self.max_bytes = max_bytes
+        self._file = None
+
+    def files(self):
+        '''
+        Archive files from the oldest
+        '''
+        if not os.path.isdir(self.path):
+            return []
+        prefix = '{}.'.format(self.word)
+        return ['{}/{}'.format(self.path, name)
+                for name in sorted(os.listdir(self.path))
+                if name.startswith(prefix) and name.endswith('.jsonl.gz')]
+
+    def append(self, tweet):
+        if self._file is None:
+            self._open()
+        if isinstance(tweet, Tweet):    # Slim record: its fields only
+            tweet = tweet.to_dict()
+        self._file.write(json.dumps(tweet))
+        self._file.write('\n')
+        if self._file.fileobj.tell() >= self.max_bytes:    # Rotate
+            self.close()
+
+    def tee(self, tweets):
+        '''
+        Generator: archives tweets while passing them through.
+        '''
+        try:
+            for tweet in tweets:
+                self.append(tweet)
+                yield tweet
+        finally:
+            self.close()
+
+    def replay(self):
+        '''
+        Generator of archived tweets, file by file (bounded memory).
+        '''
+        for path in self.files():
+            for tweet in read_tweets(path):
+                yield tweet
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _open(self):
+        '''
+        Appends to the last file (new gzip member) or starts a new one.
+        '''
+        if not os.path.exists(self.path):    # Create FOLDER if not exist
+            os.makedirs(self.path)
+        files = self.files()
+        index = len(files)
+        if files and os.path.getsize(files[-1]) < self.max_bytes:
+            index -= 1
+        self._file = gzip.open('{}/{}.{:06d}.jsonl.gz'.format(
+            self.path, self.word, index), 'ab')
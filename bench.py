@@ -0,0 +1,489 @@
+# -*- coding: utf-8 -*-
+'''
+Benchmarks of stats pipeline hot paths (offline, synthetic tweets).
+
+Every stage runs in its own child process on the same deterministic
+tweets (see synthetic), and is measured by throughput, latency percentiles
+and peak memory. Results can be written as JSON and compared with results
+of another commit:
+
+python bench.py [tweets] [--json new.json] [--compare old.json]
+python bench.py --reference    # Current hot paths vs the original ones
+'''
+from __future__ import division
+
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from multiprocessing import Pipe
+from multiprocessing import Process
+from timeit import default_timer as timer
+
+try:
+    import resource
+except ImportError:    # Windows: no memory measurement
+    resource = None
+
+from base64 import b64encode
+from base64 import b64decode
+
+from accumulator import StatsAccumulator
+from accumulator import batches
+from exclude import EXCLUDE_SET
+from storage import BinaryStorage
+from storage import LegacyStorage
+from storage import Storage
+from storage import caesar_decrypt
+from storage import caesar_encrypt
+from synthetic import TweetGenerator
+from tokenizer import tokenize
+
+
+def legacy_extract_words(s):
+    '''
+    Stats.extract_words before tokenizer (reference).
+    '''
+    EXCLUDE_CHR = '1234567890!%^&*$()_+=-[]{}|,:;\'\"?'
+    result = filter( lambda x: not x.count('http'),\
+        map( lambda x: x.strip(EXCLUDE_CHR), s.split(' ') ))
+
+    return [word for word in result if not word in EXCLUDE_SET]
+
+
+class PerCharStorage(Storage):
+    '''
+    Stats.save/load before storage module (reference): JSON + base64 +
+    Caesar cipher char by char.
+    '''
+    CODE = 5
+
+    def dumps(self, data):
+        c_encode = lambda c: chr( (((ord(c)-48) + self.CODE) % 75) + 48)
+        return ''.join([c_encode(c) for c in b64encode(json.dumps(data))])
+
+    def loads(self, raw):
+        c_decode = lambda c: chr( (((ord(c)-48) - self.CODE) % 75) + 48)
+        return json.loads(b64decode(''.join([c_decode(c) for c in raw])))
+
+
+def bench_tokenizer(texts, repeat=3):
+    '''
+    Tokens per second of legacy and current tokenizer (best of repeat).
+    '''
+    results = {}
+    for name, func in (('legacy', legacy_extract_words),
+                       ('tokenizer', tokenize)):
+        best = None
+        for _ in range(repeat):
+            start = time.time()
+            tokens = 0
+            for text in texts:
+                tokens += len(func(text.lower()))
+            spent = time.time() - start
+            best = spent if best is None else min(best, spent)
+        results[name] = {'tokens': tokens, 'seconds': best,
+                         'tokens_per_sec': tokens / best,
+                         'tweets_per_sec': len(texts) / best}
+    return results
+
+
+def bench_aggregate(tweets, batch_size=100, repeat=3):
+    '''
+    Tweets per second of per-tweet and batched aggregation (best of repeat).
+    Both have to give the same stats.
+    '''
+    def per_tweet():
+        acc = StatsAccumulator()
+        for tweet in tweets:
+            acc.add(tweet, tokenize(tweet[u'text']))
+        return acc
+
+    def batched():
+        acc = StatsAccumulator()
+        for start in range(0, len(tweets), batch_size):
+            acc.add_batch(tweets[start:start + batch_size])
+        return acc
+
+    results = {}
+    data = {}
+    for name, func in (('per_tweet', per_tweet), ('batch', batched)):
+        best = None
+        for _ in range(repeat):
+            start = time.time()
+            acc = func()
+            spent = time.time() - start
+            best = spent if best is None else min(best, spent)
+        data[name] = (acc.to_dict(), acc.views())
+        results[name] = {'tokens': acc.global_words_count, 'seconds': best,
+                         'tokens_per_sec': acc.global_words_count / best,
+                         'tweets_per_sec': len(tweets) / best}
+    if data['per_tweet'] != data['batch']:
+        raise AssertionError('batch aggregation differs from per-tweet one')
+    return results
+
+
+def sample_accumulator(vocabulary, seed=1):
+    '''
+    Accumulator with vocabulary unique words (Zipf-like counts).
+    '''
+    rnd = random.Random(seed)
+    acc = StatsAccumulator()
+    acc.uniques.update(dict((u'w{:x}'.format(rnd.getrandbits(40)),
+                             max(int(vocabulary / (rank + 1)), 1))
+                            for rank in range(vocabulary)))
+    acc.letters_per_word.update(dict((i, rnd.randint(1, 10 ** 6))
+                                     for i in range(1, 40)))
+    acc.origin.update({u'Kyiv': 10, u'London': 20, u'Pacific Time (US & Canada)': 30})
+    acc.tweets_count = vocabulary
+    acc.since_id = 600000000000000000
+    acc.top.rebuild(acc.uniques)
+    return acc
+
+
+def bench_storage(acc, repeat=3):
+    '''
+    Save/load seconds and file size of storage backends (best of repeat).
+    '''
+    directory = tempfile.mkdtemp()
+    data = acc.to_dict()
+    results = {}
+    try:
+        for name, storage in (('per_char', PerCharStorage(directory)),
+                              ('legacy', LegacyStorage(directory)),
+                              ('binary', BinaryStorage(directory))):
+            word = 'bench_{}'.format(name)
+            save = load = header = None
+            for _ in range(repeat):
+                start = time.time()
+                storage.save(word, data)
+                spent = time.time() - start
+                save = spent if save is None else min(save, spent)
+
+                start = time.time()
+                loaded = storage.load(word)
+                spent = time.time() - start
+                load = spent if load is None else min(load, spent)
+
+                start = time.time()    # Scalars and top words only
+                storage.open(word)
+                spent = time.time() - start
+                header = spent if header is None else min(header, spent)
+            loaded = StatsAccumulator.from_dict(loaded).to_dict()
+            if json.loads(json.dumps(loaded)) != json.loads(json.dumps(data)):
+                raise AssertionError('{} storage changes data'.format(name))
+            results[name] = {'save_seconds': save, 'load_seconds': load,
+                             'header_seconds': header,
+                             'bytes': os.path.getsize(storage.path(word))}
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def report(title, results):
+    print('\n[{}]'.format(title))
+    for name, result in sorted(results.items()):
+        if 'bytes' in result:
+            print('{:<12} save {:.3f} sec, load {:.3f} sec, '
+                  'header {:.4f} sec, {} bytes'.format(
+                name, result['save_seconds'], result['load_seconds'],
+                result['header_seconds'], result['bytes']))
+            continue
+        print('{:<12} {:>10.0f} tokens/sec {:>10.0f} tweets/sec '
+              '({} tokens, {:.3f} sec)'.format(
+            name, result['tokens_per_sec'], result['tweets_per_sec'],
+            result['tokens'], result['seconds']))
+
+
+### Stage harness ###
+
+def _accumulated(tweets, batch_size):
+    acc = StatsAccumulator()
+    for batch in batches(tweets, batch_size):
+        acc.add_batch(batch)
+    return acc
+
+
+def stage_tokenize(tweets, options):
+    '''
+    Stats.extract_words of every tweet
+    '''
+    latencies = []
+    for tweet in tweets:
+        start = timer()
+        tokenize(tweet[u'text'])
+        latencies.append(timer() - start)
+    return len(tweets), 'tweets', latencies
+
+
+def stage_aggregate(tweets, options):
+    '''
+    Stats._gen_stats: batches of tweets into StatsAccumulator, views
+    '''
+    latencies = []
+    acc = StatsAccumulator(compact=options.compact)
+    for batch in batches(tweets, options.batch_size):
+        start = timer()
+        acc.add_batch(batch)
+        latencies.append(timer() - start)
+    start = timer()
+    acc.views()
+    latencies.append(timer() - start)
+    return len(tweets), 'tweets', latencies
+
+
+def stage_encrypt(tweets, options):
+    '''
+    Stats._encrypt of JSON of stats
+    '''
+    raw = json.dumps(_accumulated(tweets, options.batch_size).to_dict())
+    latencies = []
+    for _ in range(options.repeat):
+        start = timer()
+        caesar_encrypt(raw)
+        latencies.append(timer() - start)
+    return len(raw) * options.repeat, 'bytes', latencies
+
+
+def stage_decrypt(tweets, options):
+    '''
+    Stats._decrypt of encrypted JSON of stats
+    '''
+    raw = caesar_encrypt(json.dumps(
+        _accumulated(tweets, options.batch_size).to_dict()))
+    latencies = []
+    for _ in range(options.repeat):
+        start = timer()
+        caesar_decrypt(raw)
+        latencies.append(timer() - start)
+    return len(raw) * options.repeat, 'bytes', latencies
+
+
+def _storage_stage(tweets, options, operation):
+    data = _accumulated(tweets, options.batch_size).to_dict()
+    directory = tempfile.mkdtemp()
+    storage = BinaryStorage(directory)
+    latencies = []
+    try:
+        storage.save('bench', data)
+        for _ in range(options.repeat):
+            start = timer()
+            operation(storage, data)
+            latencies.append(timer() - start)
+    finally:
+        shutil.rmtree(directory)
+    return options.repeat, 'files', latencies
+
+
+def stage_save(tweets, options):
+    '''
+    Stats.save (default storage)
+    '''
+    return _storage_stage(tweets, options,
+                          lambda storage, data: storage.save('bench', data))
+
+
+def stage_load(tweets, options):
+    '''
+    Stats.load with all counters
+    '''
+    return _storage_stage(tweets, options,
+                          lambda storage, data: storage.load('bench'))
+
+
+def stage_open(tweets, options):
+    '''
+    Stats.load without counters (lazy sections)
+    '''
+    return _storage_stage(tweets, options,
+                          lambda storage, data: storage.open('bench'))
+
+
+STAGES = [('tokenize', stage_tokenize), ('aggregate', stage_aggregate),
+          ('encrypt', stage_encrypt), ('decrypt', stage_decrypt),
+          ('save', stage_save), ('load', stage_load), ('open', stage_open)]
+
+
+def peak_rss():
+    '''
+    Peak resident memory of the process (KB), None if unknown
+    '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak    # Bytes on OS X
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    if not values:
+        return None
+    index = int(round(percent / 100 * (len(values) - 1)))
+    return values[index]
+
+
+def measure(name, options):
+    '''
+    Result dict of stage: throughput (by timed operations only), latency
+    (ms) percentiles, peak memory (with stage setup). Input tweets are
+    generated before the measurement.
+    '''
+    stage = dict(STAGES)[name]
+    generator = TweetGenerator(options.vocabulary, options.skew, options.seed)
+    tweets = list(generator.tweets(options.tweets))
+    base_rss = peak_rss()
+
+    start = timer()
+    items, unit, latencies = stage(tweets, options)
+    wall_seconds = timer() - start
+    seconds = sum(latencies)
+
+    rss = peak_rss()
+    return {'items': items, 'unit': unit, 'seconds': seconds,
+            'wall_seconds': wall_seconds,
+            'per_sec': items / seconds if seconds else None,
+            'latency_ms': dict(('p{}'.format(p),
+                                percentile(latencies, p) * 1000)
+                               for p in (50, 90, 99, 100)),
+            'peak_rss_kb': rss,
+            'rss_growth_kb': (rss - base_rss) if rss is not None else None}
+
+
+def _child(name, options, conn):
+    try:
+        conn.send(measure(name, options))
+    except Exception as e:
+        conn.send({'error': repr(e)})
+    conn.close()
+
+
+def run(options):
+    '''
+    Results dict: meta (commit, params) and stages, each stage measured in
+    a new process (own peak memory)
+    '''
+    stages = {}
+    for name in options.stages:
+        parent, child = Pipe(duplex=False)
+        process = Process(target=_child, args=(name, options, child))
+        process.start()
+        stages[name] = parent.recv()
+        process.join()
+        report_stage(name, stages[name])
+    params = dict((key, getattr(options, key)) for key in
+                  ('tweets', 'vocabulary', 'skew', 'seed', 'batch_size',
+                   'repeat', 'compact'))
+    return {'meta': {'commit': git_commit(), 'python': sys.version.split()[0],
+                     'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                     'params': params},
+            'stages': stages}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=open(os.devnull, 'w')).strip().decode('ascii')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report_stage(name, result):
+    if 'error' in result:
+        print('{:<10} failed: {}'.format(name, result['error']))
+        return
+    latency = result['latency_ms']
+    print('{:<10} {:>12.0f} {}/sec  p50 {:.3f} p90 {:.3f} p99 {:.3f} '
+          'max {:.3f} ms  peak {} KB (+{} KB)'.format(
+        name, result['per_sec'], result['unit'], latency['p50'],
+        latency['p90'], latency['p99'], latency['p100'],
+        result['peak_rss_kb'], result['rss_growth_kb']))
+
+
+def compare(old, new):
+    '''
+    Prints changes of throughput, p99 latency and peak memory of stages
+    '''
+    def change(before, after):
+        if not before or after is None:
+            return '      n/a'
+        return '{:+8.1f}%'.format((after - before) / before * 100)
+
+    print('\n[{} -> {}]'.format(old['meta'].get('commit'),
+                                new['meta'].get('commit')))
+    if old['meta'].get('params') != new['meta'].get('params'):
+        print('WARNING: different params {} and {}'.format(
+            old['meta'].get('params'), new['meta'].get('params')))
+    print('{:<10} {:>9} {:>9} {:>9}'.format('stage', 'speed', 'p99', 'memory'))
+    for name, result in sorted(new['stages'].items()):
+        before = old['stages'].get(name)
+        if (before is None) or ('error' in before) or ('error' in result):
+            continue
+        print('{:<10} {} {} {}'.format(
+            name, change(before['per_sec'], result['per_sec']),
+            change(before['latency_ms']['p99'], result['latency_ms']['p99']),
+            change(before['peak_rss_kb'], result['peak_rss_kb'])))
+
+
+def reference(options):
+    '''
+    Current tokenizer, aggregation and storage vs the original ones (on
+    tweets of synthetic.TweetGenerator)
+    '''
+    count = options.tweets
+    generator = TweetGenerator(options.vocabulary, options.skew, options.seed)
+    tweets = list(generator.tweets(count))
+    report('tokenize {} tweets'.format(count),
+           bench_tokenizer([tweet[u'text'] for tweet in tweets]))
+    report('aggregate {} tweets'.format(count), bench_aggregate(tweets))
+    report('storage of {} unique words'.format(count * 10),
+           bench_storage(sample_accumulator(count * 10, options.seed)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Stats pipeline benchmarks')
+    parser.add_argument('tweets', nargs='?', type=int, default=20000)
+    parser.add_argument('--vocabulary', type=int, default=50000)
+    parser.add_argument('--skew', type=float, default=1.1,
+                        help='Zipf exponent of word frequencies')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='runs of whole-stats stages (encrypt, save...)')
+    parser.add_argument('--compact', action='store_true',
+                        help='uniques and origin as vocab.CompactCounter')
+    parser.add_argument('--stages', default=','.join(name for name, _ in STAGES))
+    parser.add_argument('--json', help='write results to file')
+    parser.add_argument('--compare', help='results file to compare with')
+    parser.add_argument('--reference', action='store_true',
+                        help='compare with the original implementations')
+    options = parser.parse_args(argv)
+
+    if options.reference:
+        reference(options)
+        return
+    options.stages = [name for name in options.stages.split(',') if name]
+    unknown = set(options.stages) - set(dict(STAGES))
+    if unknown:
+        parser.error('unknown stages: {}'.format(', '.join(sorted(unknown))))
+
+    print('{} tweets, vocabulary {}, skew {}'.format(
+        options.tweets, options.vocabulary, options.skew))
+    results = run(options)
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if options.compare:
+        with open(options.compare, 'r') as f:
+            compare(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+'''
+Offline checks of the stats internals against plain references: no
+network, no keys needed (stub server checks of the clients are in
+stubs.py).
+
+Usage:
+python checks.py [check ...]    # All checks by default (see CHECKS)
+'''
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from collections import Counter
+
+import stubs
+
+from accumulator import StatsAccumulator
+from accumulator import batches
+from corpus import corpus_stats
+from dedup import BloomFilter
+from dedup import IdSet
+from dedup import load_ids
+from dedup import save_ids
+from fetcher import SEARCH_DEPTH
+from fetcher import id_from_time
+from hll import HyperLogLog
+from hll import union
+from sqlstore import SQLiteStorage
+from storage import BinaryStorage
+from storage import LegacyStorage
+from storage import caesar_encrypt
+from stubs import expect
+from synthetic import TweetGenerator
+from tokenizer import tokenize
+from vocab import COUNT_MAX
+from vocab import CompactCounter
+from vocab import Vocabulary
+from twitter_stats import Stats
+from windows import BucketedStats
+
+
+def same_stats(acc, other, name):
+    '''
+    Sums, counters and top words of acc and other are equal
+    '''
+    for key in StatsAccumulator.SUMS + ('since_id',):
+        expect(getattr(acc, key) == getattr(other, key), '{}: {} {} != {}',
+               name, key, getattr(acc, key), getattr(other, key))
+    for key in StatsAccumulator.COUNTERS:
+        expect(dict(getattr(acc, key).items()) ==
+               dict(getattr(other, key).items()), '{}: {} differ', name, key)
+    expect(sorted(count for _, count in acc.top.items()) ==
+           sorted(count for _, count in other.top.items()),
+           '{}: top words differ', name)
+
+
+def aggregated(tweets, **kwargs):
+    acc = StatsAccumulator(**kwargs)
+    for batch in batches(iter(tweets), 100):
+        acc.add_batch(batch)
+    return acc
+
+
+def check_paths():
+    '''
+    Per-tweet, batched, Stats with time buckets and corpus (process pool)
+    aggregation give the same stats
+    '''
+    tweets = list(TweetGenerator(vocabulary=2000).tweets(3000))
+    single = StatsAccumulator()
+    for tweet in tweets:
+        single.add(tweet, tokenize(tweet[u'text']))
+    same_stats(single, aggregated(tweets), 'batch')
+
+    stats = Stats('python', storage=BinaryStorage(tempfile.gettempdir()),
+                  windows=BucketedStats('minute', 60))
+    stats._gen_stats(iter(tweets))
+    same_stats(single, stats._acc, 'stats')
+    same_stats(single, stats.windows.window(0, float('inf')), 'windows')
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'corpus.jsonl')
+        with open(path, 'w') as f:
+            for tweet in tweets:
+                f.write(json.dumps(tweet) + '\n')
+        pooled = corpus_stats([path], processes=2, chunk_bytes=50000)
+    finally:
+        shutil.rmtree(directory)
+    same_stats(single, pooled, 'corpus')
+
+
+def check_storage():
+    '''
+    Stats saved by every storage load back the same (whole and lazily),
+    original .data files (Caesar, averages instead of tweets_count) too;
+    lazy sections come from the file opened even if it is saved again
+    '''
+    tweets = list(TweetGenerator(vocabulary=2000).tweets(1000))
+    acc = aggregated(tweets)
+    directory = tempfile.mkdtemp()
+    try:
+        for storage in (BinaryStorage(directory), LegacyStorage(directory),
+                        SQLiteStorage(directory)):
+            name = type(storage).__name__
+            storage.save('python', acc.to_dict())
+            same_stats(acc, StatsAccumulator.from_dict(
+                storage.load('python')), name)
+            same_stats(acc, StatsAccumulator.from_dict(
+                *storage.open('python')), name + ' lazy')
+
+        storage = BinaryStorage(directory)
+        data = acc.to_dict()
+        old = dict((name, data[name]) for name in StatsAccumulator.COUNTERS)
+        old.update((name, data[name]) for name in StatsAccumulator.SUMS
+                   if name != 'tweets_count')
+        old['global_words_count'] += 1    # Counted from 1 then
+        old['avg_length'] = acc.global_length / acc.tweets_count
+        with open(storage.path('java'), 'w') as f:
+            f.write(caesar_encrypt(json.dumps(old)))
+        stats = Stats('java', storage=storage)
+        stats.load()
+        expect(stats._acc.tweets_count == acc.tweets_count,
+               'legacy file: {} tweets of {}', stats._acc.tweets_count,
+               acc.tweets_count)
+        expect(dict(stats.uniques.items()) == dict(acc.uniques.items()),
+               'legacy file: uniques differ')
+
+        storage.save('python', acc.to_dict())
+        opened = Stats('python', storage=storage)
+        opened._load_file()
+        storage.save('python', aggregated(tweets[:10]).to_dict())
+        expect(dict(opened.uniques.items()) == dict(acc.uniques.items()),
+               'sections of the file saved after open')
+    finally:
+        shutil.rmtree(directory)
+
+
+def check_compact():
+    '''
+    CompactCounter against Counter: random updates, sets, deletions (merges
+    of pending ids and dropped keys) and counts over the 32-bit limit
+    '''
+    rnd = random.Random(1)
+    vocab = Vocabulary()
+    tokens = [u'w{}'.format(number) for number in range(8000)]
+    compact = CompactCounter(vocab=vocab)
+    reference = Counter()
+    for step in range(20000):
+        op = rnd.random()
+        token = rnd.choice(tokens)
+        if op < 0.4:
+            words = [rnd.choice(tokens) for _ in range(rnd.randrange(1, 20))]
+            compact.update(words)
+            reference.update(words)
+        elif op < 0.5:
+            counts = dict((rnd.choice(tokens), rnd.randrange(1, 5))
+                          for _ in range(rnd.randrange(1, 50)))
+            compact.update(counts)
+            reference.update(counts)
+        elif op < 0.6:
+            count = rnd.randrange(3)    # 0 deletes
+            compact[token] = count
+            reference[token] = count
+            if not count:
+                del reference[token]
+        elif op < 0.85:
+            del compact[token]
+            del reference[token]
+        elif op < 0.9:
+            other = CompactCounter([token] * 3, vocab=vocab)
+            compact.update(other)
+            reference.update([token] * 3)
+        elif op < 0.905:
+            compact.items()    # Flush: as saving does
+        elif op < 0.91:
+            compact[token] = COUNT_MAX - 1
+            compact.update([token] * 3)
+            reference[token] = COUNT_MAX + 2
+        else:
+            expect(compact[token] == reference[token], 'step {}: {} {} != {}',
+                   step, token, compact[token], reference[token])
+        if step % 2000 == 1999:
+            expect(len(compact) == len(reference), 'step {}: {} keys of {}',
+                   step, len(compact), len(reference))
+            expect(dict(compact.items()) == dict(reference), 'step {}: '
+                   'counts differ', step)
+    expect(max(compact.values()) > COUNT_MAX, 'no count over 32 bits left')
+    expect([count for _, count in compact.most_common(20)] ==
+           [count for _, count in reference.most_common(20)],
+           'most_common differ')
+
+
+def check_ids():
+    '''
+    IdSet and BloomFilter over six weeks of daily runs pruned like
+    Stats.save does: no id of the prune window is missed, Bloom false
+    positives stay near error_rate, both load back the same from files
+    '''
+    rnd = random.Random(1)
+    start = time.time() - 42 * 86400
+    exact = IdSet(pending=500)
+    bloom = BloomFilter(capacity=20000, error_rate=0.01)
+    days = []
+    for day in range(42):
+        now = start + day * 86400
+        ids = [id_from_time(now + rnd.random() * 86400) + rnd.randrange(4096)
+               for _ in range(1000)]
+        for ids_set in (exact, bloom):
+            for tweet_id in ids:
+                ids_set.add(tweet_id)
+            ids_set.prune(id_from_time(now - 2 * SEARCH_DEPTH))
+        days.append(ids)
+        if day % 7 != 6:
+            continue
+        window = [tweet_id for ids in days[-14:] for tweet_id in ids]
+        for ids_set in (exact, bloom):
+            missed = sum(tweet_id not in ids_set for tweet_id in window)
+            expect(not missed, '{}: {} ids missed on day {}',
+                   type(ids_set).__name__, missed, day)
+    expect(len(exact) < 16000, 'IdSet not pruned: {} ids', len(exact))
+    expect(bloom.count < 30000, 'BloomFilter not pruned: {} ids',
+           bloom.count)
+    expect(sum(tweet_id in exact for tweet_id in days[0]) == 0,
+           'IdSet kept ids of the first day')
+
+    fresh = [id_from_time(time.time() + 86400) + number
+             for number in range(20000)]
+    rate = sum(tweet_id in bloom for tweet_id in fresh) / len(fresh)
+    expect(rate < 2 * bloom.error_rate, 'false positives {:.4f} of {}',
+           rate, bloom.error_rate)
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'python.ids')
+        for ids_set in (exact, bloom):
+            save_ids(ids_set, path)
+            loaded = load_ids(path)
+            name = type(ids_set).__name__
+            expect(type(loaded) is type(ids_set), '{} loaded as {}', name,
+                   type(loaded).__name__)
+            expect(len(loaded) == len(ids_set), '{}: {} ids loaded of {}',
+                   name, len(loaded), len(ids_set))
+            expect(all(tweet_id in loaded for tweet_id in window),
+                   '{}: ids missed after load', name)
+            expect([tweet_id in loaded for tweet_id in fresh[:1000]] ==
+                   [tweet_id in ids_set for tweet_id in fresh[:1000]],
+                   '{}: other answers after load', name)
+    finally:
+        shutil.rmtree(directory)
+
+
+def check_distinct():
+    '''
+    HyperLogLog: counts within 3 standard errors at every scale, merge is
+    the sketch of the union, sketches saved with stats count distinct words
+    over keywords
+    '''
+    for p in (10, 14):
+        for size in (50, 1000, 20000, 200000):
+            sketch = HyperLogLog(p)
+            sketch.update(u'w{}'.format(number) for number in range(size))
+            error = abs(sketch.count() - size) / size
+            expect(error <= 3 * sketch.error(), 'p {}, {} items: error {:.4f}',
+                   p, size, error)
+
+    first, second, both = HyperLogLog(), HyperLogLog(), HyperLogLog()
+    first.update(u'w{}'.format(number) for number in range(60000))
+    second.update(u'w{}'.format(number) for number in range(40000, 100000))
+    both.update(u'w{}'.format(number) for number in range(100000))
+    registers = bytearray(first.registers)
+    merged = union([first, second])
+    expect(merged.registers == both.registers, 'merge is not the union')
+    expect(first.registers == registers, 'union() changed the first sketch')
+    loaded = HyperLogLog.from_dict(json.loads(json.dumps(merged.to_dict())))
+    expect(loaded.registers == both.registers, 'to_dict round trip differs')
+
+    directory = tempfile.mkdtemp()
+    try:
+        storage = BinaryStorage(directory)
+        words = set()
+        for seed, word in ((1, 'python'), (2, 'java')):
+            stats = Stats(word, storage=storage, distinct=True)
+            stats._gen_stats(TweetGenerator(vocabulary=20000, seed=seed)
+                             .tweets(3000))
+            stats.save()
+            words.update(stats.uniques)
+        sketch = storage.distinct(['python', 'java', 'missing'])
+        error = abs(sketch.count() - len(words)) / len(words)
+        expect(error <= 3 * sketch.error(), '{} distinct words of {}',
+               sketch.count(), len(words))
+    finally:
+        shutil.rmtree(directory)
+
+
+CHECKS = [('paths', check_paths),
+          ('storage', check_storage),
+          ('compact', check_compact),
+          ('ids', check_ids),
+          ('distinct', check_distinct)]
+
+
+if __name__ == '__main__':
+    sys.exit(stubs.main(checks=CHECKS))
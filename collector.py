@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+'''
+Batch collection: one fetch loop serving many Stats instances.
+
+All keywords share one pool of fetch workers (clients) and one rate-limit
+budget. Keywords may be combined into OR queries, results are split back by
+keyword by their tokens and aggregated by the Stats of every keyword while
+fetching goes on.
+'''
+
+import threading
+
+from Queue import Queue
+
+import metrics
+
+from fetcher import Fetcher
+from fetcher import QueryPlan
+from fetcher import search_params
+from fetcher import unwalked
+from tokenizer import tokenize
+
+
+MAX_QUERY_LEN = 500    # Search API query length limit
+
+
+class BatchCollector(object):
+    '''
+    Routes tweets of shared fetch loop into the stats of each Stats.
+
+    stats_list - Stats instances (one per keyword)
+    combine - max keywords per OR query (1 - one query per keyword)
+    client_factory - see fetcher.Fetcher (Stats.set_client by default)
+    limiter - RateLimiter to share with other collectors
+    '''
+
+    def __init__(self, stats_list, combine=1, workers=4, client_factory=None,
+                 limiter=None, **fetcher_kwargs):
+        self.stats_list = list(stats_list)
+        self.combine = max(combine, 1)
+        self.fetcher = Fetcher(client_factory or self.stats_list[0].set_client,
+                               limiter=limiter, workers=workers,
+                               **fetcher_kwargs)
+        self.unmatched = 0    # Tweets of OR queries matching no keyword
+        self._terms = dict((stats, self.terms(stats))
+                           for stats in self.stats_list)
+
+    def collect(self, time_interval=30, since_ids=None):
+        '''
+        Fetches tweets for all keywords during time_interval (sec) and adds
+        them to stats of every Stats instance (saved stats are loaded
+        first, like Stats.refresh does). Tweets of a keyword are aggregated
+        by Stats._gen_stats as they come (see Feed). Gaps left by previous
+        runs (deadline) are fetched too, see fetcher.unwalked.
+        DIDN'T SAVE THE RESULTS! (save() of every Stats - required)
+        since_ids - {word: since_id}, get only tweets newer than since_id
+                    (since_id of every Stats by default)
+        '''
+        for stats in self.stats_list:
+            stats._load_saved()
+        if since_ids is None:
+            since_ids = dict((stats.word, stats.since_id)
+                             for stats in self.stats_list)
+        # Ids counted by previous runs (this run only if dedup is off)
+        seen = {}
+        for stats in self.stats_list:
+            ids = stats._seen_ids()
+            seen[stats] = set() if ids is None else ids
+
+        plans = [QueryPlan(search_params(self.query(group), lang,
+                                         self.fetcher.count),
+                           since_id=self._since_id(group, since_ids),
+                           tag=group,
+                           slice_seconds=self.fetcher.slice_seconds)
+                 for lang, group in self.groups()]
+        group_plan = dict((stats, plan) for plan in plans
+                          for stats in plan.tag)
+        # Gaps left by previous runs: one query per keyword and gap
+        gap_plans = dict((stats, [self.fetcher.query(stats.word, stats.lang,
+                                                     lower, upper,
+                                                     tag=[stats])
+                                  for lower, upper in stats._acc.gaps])
+                         for stats in self.stats_list)
+        newest = dict((stats, since_ids.get(stats.word))
+                      for stats in self.stats_list)
+        unmatched = self.unmatched
+
+        feeds = dict((stats, Feed(stats)) for stats in self.stats_list)
+        try:
+            for plan, tweet in self.fetcher.run(
+                    plans + sum(gap_plans.values(), []), time_interval):
+                for stats in self.route(plan.tag, tweet):
+                    if (plan is group_plan[stats]) and \
+                            (tweet['id'] <= (since_ids.get(stats.word) or 0)):
+                        continue    # Seen by this keyword already
+                    ids = seen[stats]
+                    if tweet['id'] in ids:    # Counted already
+                        continue
+                    ids.add(tweet['id'])
+                    newest[stats] = max(newest[stats], tweet['id'])
+                    feeds[stats].put(tweet)
+        finally:
+            errors = [feed.close() for feed in feeds.values()]
+
+        for stats in self.stats_list:
+            # Ranges the walk did not reach are fetched by the next run
+            stats._acc.gaps = sorted(
+                unwalked([group_plan[stats]], newest[stats],
+                         since_ids.get(stats.word)) +
+                unwalked(gap_plans[stats], newest[stats]))
+        if self.unmatched > unmatched:
+            print('{} tweets matched no keyword (screen names, URLs)'.format(
+                self.unmatched - unmatched))
+        for error in errors:
+            if error is not None:
+                raise error
+
+    def groups(self):
+        '''
+        Splits keywords into (lang, [Stats, ...]) groups for OR queries.
+        '''
+        by_lang = {}
+        for stats in self.stats_list:
+            by_lang.setdefault(stats.lang, []).append(stats)
+
+        for lang, stats_list in sorted(by_lang.items()):
+            group = []
+            for stats in stats_list:
+                if group and ((len(group) >= self.combine) or
+                        (len(self.query(group + [stats])) > MAX_QUERY_LEN)):
+                    yield lang, group
+                    group = []
+                group.append(stats)
+            if group:
+                yield lang, group
+
+    def route(self, group, tweet):
+        '''
+        Stats instances the tweet belongs to: keyword tokens come in a row
+        in the tweet tokens (a word matches #word and @word too). Search
+        matches screen names and URLs as well, such tweets are counted in
+        unmatched.
+        '''
+        if len(group) == 1:
+            return group
+        tokens = [(token, token.lstrip(u'#@'))
+                  for token in tokenize(tweet[u'text'], exclude=())]
+        matched = [stats for stats in group
+                   if self._matches(self._terms[stats], tokens)]
+        if not matched:
+            self.unmatched += 1
+            metrics.registry.inc('tweets_unmatched_total')
+        return matched
+
+    @classmethod
+    def terms(cls, stats):
+        '''
+        Tokens of keyword to route tweets by
+        '''
+        return tokenize(cls._unicode(stats.word), exclude=())
+
+    @staticmethod
+    def _matches(terms, tokens):
+        if not terms:
+            return False
+        for start in range(len(tokens) - len(terms) + 1):
+            if all(term in tokens[start + number]
+                   for number, term in enumerate(terms)):
+                return True
+        return False
+
+    @classmethod
+    def query(cls, group):
+        '''
+        OR query of group keywords
+        '''
+        terms = []
+        for stats in group:
+            word = cls._unicode(stats.word)
+            terms.append(u'"{}"'.format(word) if u' ' in word else word)
+        return u' OR '.join(terms)
+
+    @staticmethod
+    def _unicode(word):
+        if isinstance(word, str):    # raw_input gives utf-8 bytes
+            return word.decode('utf-8')
+        return word
+
+    @staticmethod
+    def _since_id(group, since_ids):
+        ids = [since_ids.get(stats.word) for stats in group]
+        if None in ids:    # At least one keyword needs the whole depth
+            return None
+        return min(ids)
+
+
+class Feed(object):
+    '''
+    Tweets of one Stats, aggregated by Stats._gen_stats in a thread as they
+    are routed. The queue holds two batches: the fetch loop waits for slow
+    aggregation instead of buffering the whole run.
+    '''
+
+    def __init__(self, stats):
+        self.queue = Queue(maxsize=2 * max(stats.batch_size, 1))
+        self.error = None
+        self.thread = threading.Thread(target=self._aggregate, args=(stats,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, tweet):
+        self.queue.put(tweet)
+
+    def close(self):
+        '''
+        Waits for tweets put so far to be aggregated. Returns the exception
+        aggregation failed with (None - ok).
+        '''
+        self.queue.put(None)
+        self.thread.join()
+        return self.error
+
+    def _aggregate(self, stats):
+        try:
+            # Archive, batches and metrics as in Stats.refresh
+            stats._gen_stats(stats._downloaded(iter(self.queue.get, None)))
+        except Exception as e:
+            self.error = e
+            while self.queue.get() is not None:    # put() must not block
+                pass
+
+
+def collect(stats_list, time_interval=30, combine=1, workers=4, **kwargs):
+    '''
+    Shortcut: BatchCollector(...).collect(time_interval)
+    '''
+    collector = BatchCollector(stats_list, combine=combine, workers=workers,
+                               **kwargs)
+    collector.collect(time_interval)
+    return collector
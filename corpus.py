@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+'''
+Statistics of offline tweet corpora by a pool of processes.
+
+Corpus - JSON-lines files of tweet objects (the same shape Stats._get_tweets
+yields). Files are split into byte ranges, every worker builds partial
+counters and sums, partials are merged into one StatsAccumulator.
+
+Usage:
+python corpus.py <word> <file> [<file> ...]
+'''
+
+import gzip
+import os
+import sys
+
+from accumulator import StatsAccumulator
+from accumulator import batches
+from parsing import parse_tweet
+
+
+CHUNK_BYTES = 32 * 1024 * 1024    # Size of one worker job
+BATCH_SIZE = 1000    # Tweets aggregated at once by a worker
+
+
+def read_tweets(path, start=0, end=None):
+    '''
+    Generator of tweets from lines starting in byte range [start, end).
+    Gzipped files are read whole.
+    '''
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    yield parse_tweet(line)
+        return
+
+    with open(path, 'rb') as f:
+        if start:
+            f.seek(start - 1)
+            f.readline()    # Line started before the range is not ours
+        while True:
+            if (end is not None) and (f.tell() >= end):
+                break
+            line = f.readline()
+            if not line:
+                break
+            if line.strip():
+                yield parse_tweet(line)
+
+
+def split_ranges(path, chunk_bytes=CHUNK_BYTES):
+    '''
+    [(path, start, end), ...] - jobs of about chunk_bytes each
+    '''
+    if path.endswith('.gz'):
+        return [(path, 0, None)]
+    size = os.path.getsize(path)
+    return [(path, start, min(start + chunk_bytes, size))
+            for start in range(0, size, chunk_bytes)] or [(path, 0, None)]
+
+
+def partial_stats(job):
+    '''
+    Worker: raw stats (StatsAccumulator.to_dict) of one byte range.
+    '''
+    path, start, end = job
+    acc = StatsAccumulator()
+    for batch in batches(read_tweets(path, start, end), BATCH_SIZE):
+        acc.add_batch(batch)
+    return acc.to_dict()
+
+
+def corpus_stats(paths, processes=None, chunk_bytes=CHUNK_BYTES, **kwargs):
+    '''
+    StatsAccumulator of all tweets in paths.
+
+    processes - size of the pool (number of CPUs by default)
+    kwargs - see StatsAccumulator (top, capacity)
+    Result is identical to serial processing (but for capacity bounded
+    uniques, which are approximate anyway).
+    '''
+    jobs = []
+    for path in paths:
+        jobs.extend(split_ranges(path, chunk_bytes))
+
+    # Imported on use: read_tweets (archive) is imported at start
+    from multiprocessing import Pool
+    acc = StatsAccumulator(**kwargs)
+    pool = Pool(processes)
+    try:
+        for data in pool.imap_unordered(partial_stats, jobs):
+            acc.merge(StatsAccumulator.from_dict(data, **kwargs))
+    finally:
+        pool.close()
+        pool.join()
+    acc.top.rebuild(acc.uniques)
+    return acc
+
+
+if __name__ == '__main__':
+    from twitter_stats import Stats
+
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(1)
+    stats = Stats(sys.argv[1])
+    stats.add_corpus(sys.argv[2:])
+    stats.save()
+    stats.view()
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+'''
+Headless collection daemon (to run under a process supervisor).
+
+Every keyword is a periodic job: Stats.refresh() fetches tweets newer than
+the saved ones and checkpoints them with Stats.save() (a fresh Stats per
+run: stats of idle keywords are not kept in memory). Jobs run concurrently
+in threads and share one rate-limit budget (fetcher.RateLimiter); when more
+jobs are due than there are free workers, the most important go first.
+SIGTERM/SIGINT stop scheduling and wait for running jobs to save.
+Keywords with "windows" (windows.BucketedStats resolution and buckets)
+keep time-bucketed stats of the tweets collected while the daemon runs and
+log trending words of the last "trending" seconds after every run.
+
+Usage:
+python daemon.py [-c config.json] [-w workers] [-e seconds] [word ...]
+                 [-p profile_dir [--profiler cprofile|sample]]
+
+config.json:
+{"workers": 2,
+ "reserve": 20,
+ "keywords": ["python",
+              {"word": "java", "every": 600, "priority": 0,
+               "time_interval": 60, "tweet_language": "en",
+               "windows": ["minute", 120], "trending": 3600}]}
+'''
+
+import argparse
+import json
+import signal
+import sys
+import threading
+import time
+
+import profiling
+from fetcher import RateLimiter
+
+
+EVERY = 900    # Seconds between runs of a keyword
+RETRY = 30    # First retry delay of a failed job (doubles, up to every)
+MAX_WAIT = 60    # Longest sleep of the scheduler
+TRENDING = 3600    # Seconds compared to the previous ones by trending words
+TRENDING_WORDS = 10
+
+
+def log(message):
+    print('{} {}'.format(time.strftime('%Y-%m-%d %H:%M:%S'), message))
+    sys.stdout.flush()
+
+
+class CollectionJob(object):
+    '''
+    Periodic refresh of one keyword.
+
+    every - seconds between starts of runs
+    priority - lower runs first when several jobs are due (0 - the highest)
+    windows - [resolution, buckets] of windows.BucketedStats (Stats.trending)
+              of the tweets collected by the job, None - no time windows
+    trending - seconds of trending words logged after every run (windows)
+    stats_kwargs - see Stats (time_interval, tweet_language, ...)
+    '''
+
+    def __init__(self, word, every=EVERY, priority=1, windows=None,
+                 trending=TRENDING, **stats_kwargs):
+        self.word = word
+        self.every = every
+        self.priority = priority
+        self.windows = windows
+        self.trending = trending
+        self.stats_kwargs = stats_kwargs
+        self.next_run = 0    # Due at once
+        self.failures = 0
+        self.buckets = None    # windows.BucketedStats, kept between runs
+
+    def run(self, limiter):
+        '''
+        One refresh of the keyword by a fresh Stats: counters are loaded
+        from the file and dropped with it after the checkpoint, only the
+        time buckets stay in memory between runs.
+        '''
+        from twitter_stats import Stats
+        if (self.buckets is None) and self.windows:
+            from windows import BucketedStats
+            self.buckets = BucketedStats(*self.windows)
+        stats = Stats(self.word, limiter=limiter, windows=self.buckets,
+                      **self.stats_kwargs)
+        stats.refresh()    # Saves the results (checkpoint)
+        log('{}: {} new tweets, {} in total'.format(
+            self.word, stats.tweets_count, stats._stats['tweets_count']))
+        if self.buckets is not None:
+            trending = self.buckets.trending(self.trending, TRENDING_WORDS)
+            log(u'{}: trending {}'.format(
+                self.word, u', '.join(u'{} {}/{}'.format(*item)
+                                      for item in trending)).encode('utf-8'))
+
+    def schedule(self, started):
+        '''
+        Sets next_run: every seconds after the start of the last run,
+        sooner (with backoff) after a failure.
+        '''
+        if self.failures:
+            self.next_run = time.time() + \
+                min(RETRY * 2 ** (self.failures - 1), self.every)
+        else:
+            self.next_run = started + self.every
+
+
+class Scheduler(object):
+    '''
+    Runs due jobs in up to workers threads, by priority.
+
+    limiter - RateLimiter shared by all jobs
+    reserve - requests of the budget kept for priority 0 jobs: other jobs
+              wait while less is remaining
+    '''
+
+    def __init__(self, workers=2, limiter=None, reserve=0):
+        self.workers = workers
+        self.limiter = limiter or RateLimiter()
+        self.reserve = reserve
+        self.jobs = []
+        self.running = []
+        self._stop = threading.Event()
+        self._cond = threading.Condition()    # RLock: safe in signal handler
+
+    def add(self, job):
+        with self._cond:
+            self.jobs.append(job)
+            self._cond.notify()
+
+    def stop(self, *args):
+        '''
+        Stops scheduling new runs (usable as signal handler).
+        '''
+        with self._cond:
+            self._stop.set()
+            self._cond.notify()
+
+    def run(self):
+        '''
+        Blocks till stop(); then waits for running jobs to finish.
+        '''
+        with self._cond:
+            while not self._stop.is_set():
+                job = self._next_job()
+                if job is None:
+                    self._cond.wait(self._sleep())
+                    continue
+                self.running.append(job)
+                thread = threading.Thread(target=self._execute, args=(job,))
+                thread.daemon = True
+                thread.start()
+
+            if self.running:
+                log('waiting for {} to finish'.format(
+                    ', '.join(job.word for job in self.running)))
+            while self.running:
+                self._cond.wait(MAX_WAIT)
+
+    def _next_job(self):
+        '''
+        The most important due job, None if none can start now.
+        '''
+        if len(self.running) >= self.workers:
+            return None
+        now = time.time()
+        due = [job for job in self.jobs
+               if (job.next_run <= now) and (job not in self.running)]
+        if self.limiter.remaining < self.reserve:
+            due = [job for job in due if job.priority <= 0]
+        if not due:
+            return None
+        return min(due, key=lambda job: (job.priority, job.next_run))
+
+    def _sleep(self):
+        '''
+        Seconds till the next job is due (or budget window resets)
+        '''
+        now = time.time()
+        waiting = [job.next_run for job in self.jobs
+                   if job not in self.running]
+        if self.limiter.remaining < self.reserve:
+            waiting.append(self.limiter.reset)
+        if not waiting:
+            return MAX_WAIT
+        return min(max(min(waiting) - now, 0.1), MAX_WAIT)
+
+    def _execute(self, job):
+        started = time.time()
+        log('{}: collecting'.format(job.word))
+        try:
+            job.run(self.limiter)
+            job.failures = 0
+        except Exception as e:    # Daemon keeps other jobs running
+            job.failures += 1
+            log('{}: failed ({}): {!r}'.format(job.word, job.failures, e))
+        finally:
+            with self._cond:
+                job.schedule(started)
+                self.running.remove(job)
+                self._cond.notify()
+
+
+def load_config(path):
+    '''
+    (options, [CollectionJob kwargs, ...]) from JSON config file
+    '''
+    with open(path, 'r') as f:
+        config = json.load(f)
+    keywords = []
+    for item in config.pop('keywords', []):
+        if not isinstance(item, dict):
+            item = {'word': item}
+        keywords.append(dict((str(k), v) for k, v in item.items()))
+    return config, keywords
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Twitter stats collection daemon')
+    parser.add_argument('words', nargs='*', help='keywords to collect')
+    parser.add_argument('-c', '--config', help='JSON config file')
+    parser.add_argument('-w', '--workers', type=int,
+                        help='jobs running at once (2)')
+    parser.add_argument('-e', '--every', type=int, default=EVERY,
+                        help='seconds between runs of keyword ({})'.format(EVERY))
+    parser.add_argument('-r', '--reserve', type=int,
+                        help='requests kept for priority 0 keywords (0)')
+    parser.add_argument('-p', '--profile', metavar='DIR',
+                        help='write profile of every run to DIR')
+    parser.add_argument('--profiler', choices=profiling.KINDS,
+                        default='cprofile')
+    args = parser.parse_args(argv)
+    if args.profile:
+        profiling.configure(args.profile, args.profiler)
+
+    options, keywords = load_config(args.config) if args.config else ({}, [])
+    keywords.extend({'word': word} for word in args.words)
+    if not keywords:
+        parser.error('no keywords')
+
+    scheduler = Scheduler(
+        workers=args.workers or options.get('workers', 2),
+        reserve=args.reserve if args.reserve is not None else
+        options.get('reserve', 0))
+    for kwargs in keywords:
+        kwargs.setdefault('every', args.every)
+        scheduler.add(CollectionJob(**kwargs))
+
+    signal.signal(signal.SIGTERM, scheduler.stop)
+    signal.signal(signal.SIGINT, scheduler.stop)
+    log('collecting: {}'.format(', '.join(job.word for job in scheduler.jobs)))
+    scheduler.run()
+    log('stopped')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+'''
+Compact sets of seen tweet ids, persisted between runs (<word>.ids).
+
+IdSet - exact: sorted array of 64-bit ids (8 bytes per id) plus a small set
+        of recent ids. Ids older than the search depth can be pruned, as
+        search never returns them again, so memory stays flat.
+BloomFilter - approximate: fixed memory for capacity ids with error_rate
+              false positives (new tweets taken as seen), never misses a
+              seen id. Two generations: old ids are dropped by pruning too.
+Both support `id in ids` and `ids.add(id)`, like set (see fetcher.QueryPlan).
+'''
+from __future__ import division
+
+import hashlib
+import math
+import os
+import struct
+import sys
+import zlib
+
+from array import array
+from bisect import bisect_left
+
+try:
+    array('q')
+    ID_TYPE = 'q'
+except ValueError:    # Python 2: long is 64-bit on LP64 platforms
+    ID_TYPE = 'l'
+
+
+MAGIC = 'TWI1'
+PENDING = 65536    # Recent ids kept in set before sorted into array
+
+
+class IdSet(object):
+    '''
+    Exact set of tweet ids.
+
+    pending - ids kept in Python set before they are merged into the array
+    '''
+    KIND = 'i'
+
+    def __init__(self, ids=(), pending=PENDING):
+        self.pending = pending
+        self._ids = array(ID_TYPE)    # Sorted
+        self._recent = set()
+        for tweet_id in ids:
+            self.add(tweet_id)
+
+    def __contains__(self, tweet_id):
+        if tweet_id in self._recent:
+            return True
+        index = bisect_left(self._ids, tweet_id)
+        return (index < len(self._ids)) and (self._ids[index] == tweet_id)
+
+    def __len__(self):
+        self._flush()
+        return len(self._ids)
+
+    def add(self, tweet_id):
+        if tweet_id in self:
+            return
+        self._recent.add(tweet_id)
+        if len(self._recent) >= self.pending:
+            self._flush()
+
+    def prune(self, min_id):
+        '''
+        Drops ids lower than min_id
+        '''
+        self._flush()
+        del self._ids[:bisect_left(self._ids, min_id)]
+
+    def dumps(self):
+        self._flush()
+        ids = self._ids
+        if sys.byteorder != 'little':
+            ids = array(ID_TYPE, ids)
+            ids.byteswap()
+        return ids.tostring()
+
+    @classmethod
+    def loads(cls, raw):
+        ids = cls()
+        ids._ids.fromstring(raw)
+        if sys.byteorder != 'little':
+            ids._ids.byteswap()
+        return ids
+
+    def _flush(self):
+        '''
+        Merges recent ids into the array. New ids are mostly newer than
+        all the stored ones, then it is just an append.
+        '''
+        if not self._recent:
+            return
+        recent = sorted(self._recent)
+        self._recent = set()
+        if (not self._ids) or (recent[0] > self._ids[-1]):
+            self._ids.extend(recent)
+        else:
+            self._ids = array(ID_TYPE, sorted(self._ids.tolist() + recent))
+
+
+class _Generation(object):
+    '''
+    Bits of one Bloom filter generation and range of ids added to it
+    '''
+    __slots__ = ('bits', 'count', 'oldest', 'newest')
+
+    def __init__(self, nbytes, bits=None, count=0, oldest=None, newest=None):
+        self.bits = bytearray(nbytes) if bits is None else bytearray(bits)
+        self.count = count
+        self.oldest = oldest
+        self.newest = newest
+
+    def has(self, positions):
+        bits = self.bits
+        for bit in positions:
+            if not bits[bit >> 3] & (1 << (bit & 7)):
+                return False
+        return True
+
+    def add(self, tweet_id, positions):
+        bits = self.bits
+        new = False
+        for bit in positions:
+            mask = 1 << (bit & 7)
+            if not bits[bit >> 3] & mask:
+                bits[bit >> 3] |= mask
+                new = True
+        if new:
+            self.count += 1
+        if (self.oldest is None) or (tweet_id < self.oldest):
+            self.oldest = tweet_id
+        if (self.newest is None) or (tweet_id > self.newest):
+            self.newest = tweet_id
+        return new
+
+
+class BloomFilter(object):
+    '''
+    Bloom filter of tweet ids in two generations. Ids are added to the
+    current one; prune() drops the previous one once all its ids are older
+    than min_id, and the current one becomes previous once it holds such
+    ids. Memory stays fixed, false positives stay at error_rate while a
+    generation holds up to capacity ids (a warning is printed if it holds
+    more).
+
+    capacity - ids of one generation with error_rate: about the tweets of
+               the prune window (Stats.save: two search depths)
+    error_rate - probability that a new id is taken as seen
+    '''
+    KIND = 'g'
+
+    def __init__(self, capacity=1000000, error_rate=0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = int(math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2))    # Bits
+        self.hashes = max(int(round(self.size / capacity * math.log(2))), 1)
+        self._nbytes = (self.size + 7) // 8
+        self._current = _Generation(self._nbytes)
+        self._previous = None
+        self._warned = False
+
+    def __contains__(self, tweet_id):
+        positions = self._positions(tweet_id)
+        if self._current.has(positions):
+            return True
+        return (self._previous is not None) and self._previous.has(positions)
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def count(self):
+        '''
+        Ids in both generations
+        '''
+        previous = self._previous
+        return self._current.count + (previous.count if previous else 0)
+
+    def add(self, tweet_id):
+        current = self._current
+        if current.add(tweet_id, self._positions(tweet_id)) and \
+                (current.count > self.capacity) and not self._warned:
+            self._warned = True
+            print('WARNING: {} ids in Bloom filter of capacity {}, new tweets '
+                  'are taken as seen more often than {}'.format(
+                      current.count, self.capacity, self.error_rate))
+
+    def prune(self, min_id):
+        '''
+        Drops the previous generation if all its ids are lower than min_id,
+        then starts a new generation if the current one has such ids
+        '''
+        previous = self._previous
+        if (previous is not None) and \
+                ((previous.newest is None) or (previous.newest < min_id)):
+            self._previous = previous = None
+        current = self._current
+        if (previous is None) and (current.oldest is not None) and \
+                (current.oldest < min_id):
+            self._previous = current
+            self._current = _Generation(self._nbytes)
+            self._warned = False
+
+    def dumps(self):
+        generations = [self._current]
+        if self._previous is not None:
+            generations.append(self._previous)
+        parts = [struct.pack('<QdB', self.capacity, self.error_rate,
+                             len(generations))]
+        for generation in generations:
+            parts.append(struct.pack('<QQQ', generation.count,
+                                     generation.oldest or 0,
+                                     generation.newest or 0))
+        parts.extend(bytes(generation.bits) for generation in generations)
+        return ''.join(parts)
+
+    @classmethod
+    def loads(cls, raw):
+        capacity, error_rate, number = struct.unpack('<QdB', raw[:17])
+        bloom = cls(capacity, error_rate)
+        offset = 17 + number * 24
+        generations = []
+        for index in range(number):
+            count, oldest, newest = struct.unpack(
+                '<QQQ', raw[17 + index * 24:17 + (index + 1) * 24])
+            bits = raw[offset:offset + bloom._nbytes]
+            offset += bloom._nbytes
+            generations.append(_Generation(bloom._nbytes, bits, count,
+                                           oldest or None, newest or None))
+        bloom._current = generations[0]
+        bloom._previous = generations[1] if number > 1 else None
+        return bloom
+
+    def _positions(self, tweet_id):
+        '''
+        Bit numbers of id (double hashing of md5)
+        '''
+        h1, h2 = struct.unpack('<QQ', hashlib.md5(str(tweet_id)).digest())
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+
+KINDS = dict((cls.KIND, cls.loads) for cls in (IdSet, BloomFilter))
+
+
+def save_ids(ids, path):
+    '''
+    Writes ids (IdSet or BloomFilter) to path, atomically.
+    '''
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):    # Create FOLDER if not exist
+        os.makedirs(directory)
+    tmp_path = '{}.tmp'.format(path)
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC + ids.KIND + zlib.compress(ids.dumps(), 1))
+    os.rename(tmp_path, path)
+
+
+def load_ids(path, default=None):
+    '''
+    Ids saved to path, default if there is no file.
+    '''
+    try:
+        with open(path, 'rb') as f:
+            raw = f.read()
+    except IOError:
+        return default
+    if not raw.startswith(MAGIC):
+        raise ValueError('{} is not ids file'.format(path))
+    return KINDS[raw[len(MAGIC)]](zlib.decompress(raw[len(MAGIC) + 1:]))
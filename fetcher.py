@@ -0,0 +1,460 @@
+# -*- coding: utf-8 -*-
+'''
+Pipelined fetcher for Twitter REST search API.
+
+Every query is split into slices of tweet ids (by time, Snowflake ids) which
+are paged with max_id/since_id concurrently by a pool of worker threads.
+Requests are scheduled by x-rate-limit-* headers instead of a fixed idle.
+'''
+
+import threading
+import time
+import urllib2
+
+import metrics
+
+from collections import deque
+from Queue import Queue
+from Queue import Empty
+from Queue import Full
+from urllib import urlencode
+
+from parsing import parse_statuses
+from transport import RETRY_STATUSES
+
+
+SEARCH_URL = 'https://api.twitter.com/1.1/search/tweets.json'
+TWEETS_TO_GET = 100
+RESULT_TYPE = 'recent'    # max_id paging is consistent only for 'recent'
+TWEPOCH = 1288834974657    # Snowflake epoch (ms)
+SEARCH_DEPTH = 7 * 24 * 3600    # Search API covers ~7 days
+MAX_GAPS = 50    # Unwalked id ranges kept per keyword (see unwalked)
+
+ERROR_CODES = { '400':'Bad Request',
+                '401':'Unauthorized',
+                '403':'Forbidden',
+                '410':'Gone',
+                '429':'Too Many Requests',
+                '500':'Internal Server Error',
+                '502':'Bad Gateway',
+                '503':'Service Unavailable',
+                '504':'Gateway timeout'
+                }
+
+
+def id_from_time(timestamp):
+    '''
+    Lowest tweet id (Snowflake) that could be created at timestamp (sec).
+    '''
+    return max(int(timestamp * 1000) - TWEPOCH, 0) << 22
+
+
+def time_from_id(tweet_id):
+    '''
+    Creation timestamp (sec) of tweet id (Snowflake).
+    '''
+    return ((tweet_id >> 22) + TWEPOCH) / 1000.0
+
+
+def search_params(word, lang, count=TWEETS_TO_GET, result_type=RESULT_TYPE):
+    '''
+    Query parameters of search/tweets.json
+    '''
+    if not isinstance(word, str):    # unicode -> utf-8 for urlencode
+        word = word.encode('utf-8')
+    return {'q': word, 'count': count, 'result_type': result_type,
+            'lang': lang}
+
+
+class RateLimiter(object):
+    '''
+    Requests budget shared by all fetch workers.
+
+    limit, window - defaults of search endpoint (180 requests per 15 min).
+    Budget is corrected by x-rate-limit-remaining/reset of every response.
+    '''
+
+    def __init__(self, limit=180, window=900):
+        self.limit = limit
+        self.window = window
+        self.remaining = limit
+        self.reset = time.time() + window
+        self._pending = 0    # Requests sent, but not answered yet
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline=None):
+        '''
+        Takes one request from the budget. Sleeps till the window reset if
+        budget is empty. Returns False if reset comes after the deadline.
+        '''
+        while True:
+            with self._lock:
+                now = time.time()
+                if now >= self.reset:    # New window (until headers say otherwise)
+                    self.remaining = self.limit
+                    self.reset = now + self.window
+                if self.remaining > 0:
+                    self.remaining -= 1
+                    self._pending += 1
+                    return True
+                wait = self.reset - now
+            if (deadline is not None) and (now + wait > deadline):
+                return False
+            time.sleep(wait)
+
+    def release(self):
+        '''
+        Request was not answered (network error).
+        '''
+        with self._lock:
+            self._pending = max(self._pending - 1, 0)
+
+    def update(self, resp):
+        '''
+        Syncs budget with response headers (httplib2 style resp dict).
+        '''
+        try:
+            remaining = int(resp['x-rate-limit-remaining'])
+            reset = float(resp['x-rate-limit-reset'])
+        except (KeyError, ValueError):
+            remaining, reset = None, None
+
+        with self._lock:
+            self._pending = max(self._pending - 1, 0)
+            if resp.get('status') == '429':
+                self.remaining = 0
+                self.reset = reset or (time.time() + self.window)
+            elif remaining is None:
+                return
+            elif reset != self.reset:    # New window on server side
+                self.reset = reset
+                self.remaining = max(remaining - self._pending, 0)
+            else:
+                self.remaining = min(self.remaining,
+                                     max(remaining - self._pending, 0))
+
+
+# Search endpoint budget is per application: fetchers share it by default
+default_limiter = RateLimiter()
+
+
+class SearchCursor(object):
+    '''
+    Paging state of one slice of query: walks from max_id down to since_id
+    (exclusive) page by page.
+    '''
+
+    def __init__(self, plan, since_id=None, max_id=None):
+        self.plan = plan
+        self.since_id = since_id
+        self.max_id = max_id
+        self.top = max_id    # max_id of the first page
+        self.pages = 0
+        self.errors = 0
+        self.done = False
+
+    def url(self, search_url=SEARCH_URL):
+        params = dict(self.plan.params)
+        if self.since_id:
+            params['since_id'] = self.since_id
+        if self.max_id:
+            params['max_id'] = self.max_id
+        return '{}?{}'.format(search_url, urlencode(sorted(params.items())))
+
+    def advance(self, statuses):
+        '''
+        Moves max_id below the oldest tweet of the page.
+        '''
+        self.pages += 1
+        if not statuses:
+            self.done = True
+            return
+        self.max_id = min(tweet['id'] for tweet in statuses) - 1
+        if (self.since_id is not None) and (self.max_id <= self.since_id):
+            self.done = True
+
+
+class QueryPlan(object):
+    '''
+    Splits one query into id slices going back in time, so slices can be
+    paged concurrently. Slice becomes twice wider every time the previous one
+    fits into a single page (sparse query).
+
+    params - search_params() of query
+    since_id - do not go below this id (tweets already seen)
+    tag - anything to identify the query by (keyword, Stats instance)
+    seen - ids of tweets not to yield (set, dedup.IdSet, ...), updated
+    max_id - do not go above this id (gap left by a previous walk)
+    '''
+
+    def __init__(self, params, since_id=None, tag=None, slice_seconds=900,
+                 seen=None, max_id=None):
+        self.params = params
+        self.since_id = since_id
+        self.max_id = max_id
+        self.tag = tag
+        self.span = slice_seconds
+        self.exhausted = False    # No more slices
+        self.failed = False    # API refused the query
+        self.tweet_id = set() if seen is None else seen    # Ids yielded
+
+        now = time.time()
+        self._upper = None    # Upper edge (timestamp) of next slice
+        self._start = now if max_id is None else time_from_id(max_id)
+        self._top = max_id or id_from_time(now)
+        self._floor = max(id_from_time(now - SEARCH_DEPTH), since_id or 0)
+        self._cursors = []    # Slices opened, newest first
+
+    def next_slice(self):
+        '''
+        Next (older) slice cursor. None if since_id/search depth is reached.
+        '''
+        if self.exhausted:
+            return None
+        upper = self._upper or self._start
+        lower = upper - self.span
+        max_id = (id_from_time(upper) - 1) if self._upper else self.max_id
+        since_id = id_from_time(lower) - 1
+        if since_id <= self._floor:
+            since_id = self._floor or None
+            self.exhausted = True
+        self._upper = lower
+        cursor = SearchCursor(self, since_id, max_id)
+        self._cursors.append(cursor)
+        return cursor
+
+    def widen(self):
+        self.span *= 2
+
+    def remaining(self):
+        '''
+        [(since_id, max_id), ...] ranges of ids not walked yet: unfinished
+        slices (deadline, dropped after errors, failed query) and slices
+        never opened.
+        '''
+        ranges = [(cursor.since_id or 0, cursor.max_id or self._top)
+                  for cursor in self._cursors if not cursor.done]
+        if self.failed or not self.exhausted:
+            if self._upper is None:
+                ranges.append((self._floor, self._top))
+            else:
+                ranges.append((self._floor, id_from_time(self._upper) - 1))
+        return ranges
+
+
+def unwalked(plans, newest_id, since_id=None):
+    '''
+    Sorted [[since_id, max_id], ...] ranges of ids the plans did not walk,
+    joined if they overlap: gaps to fetch by the next run (QueryPlan max_id).
+    Ids above newest_id are fetched by the next since_id query, ids at or
+    below since_id were walked before, ids beyond the search depth are gone.
+    '''
+    if newest_id is None:    # Nothing counted: the next run walks it all
+        return []
+    floor = max(id_from_time(time.time() - SEARCH_DEPTH), since_id or 0)
+    ranges = []
+    for plan in plans:
+        for lower, upper in plan.remaining():
+            lower, upper = max(lower, floor), min(upper, newest_id)
+            if lower < upper:
+                ranges.append([lower, upper])
+    joined = []
+    for lower, upper in sorted(ranges):
+        if joined and (lower <= joined[-1][1]):
+            joined[-1][1] = max(joined[-1][1], upper)
+        else:
+            joined.append([lower, upper])
+    return joined[-MAX_GAPS:]
+
+
+class PlainClient(object):
+    '''
+    Unsigned client with oauth2.Client.request() interface.
+    Used against local stub servers.
+    '''
+
+    def __init__(self, timeout=30):
+        self.timeout = timeout
+
+    def request(self, url, method='GET', body=None, headers=None):
+        req = urllib2.Request(url, data=body, headers=headers or {})
+        try:
+            answer = urllib2.urlopen(req, timeout=self.timeout)
+            status = answer.getcode()
+        except urllib2.HTTPError as e:    # Error pages are answers too
+            answer = e
+            status = e.code
+        resp = dict((k.lower(), v) for k, v in answer.info().items())
+        resp['status'] = str(status)
+        return resp, answer.read()
+
+
+class Fetcher(object):
+    '''
+    Pool of workers fetching search pages concurrently.
+
+    client_factory - callable returning client with request(url) method,
+                     one client per worker (transport.Transport by
+                     Stats.set_client, connections are pooled anyway)
+    limiter - RateLimiter (default_limiter: one budget per process)
+    workers - requests kept in flight
+    '''
+    MAX_ERRORS = 3    # Network/5xx errors per slice before it is dropped
+
+    def __init__(self, client_factory, limiter=None, workers=4,
+                 count=TWEETS_TO_GET, slice_seconds=900,
+                 search_url=SEARCH_URL, verbose=True):
+        self.client_factory = client_factory
+        self.limiter = limiter or default_limiter
+        self.workers = workers
+        self.count = count
+        self.slice_seconds = slice_seconds
+        self.search_url = search_url
+        self.verbose = verbose
+
+    def tweets(self, word, lang, time_interval, since_id=None, seen=None):
+        '''
+        Generator of unique tweets by word during time_interval (sec).
+        since_id - only tweets newer than this id
+        seen - ids of tweets already got (see QueryPlan)
+        '''
+        for _, tweet in self.run([self.query(word, lang, since_id, seen=seen)],
+                                 time_interval):
+            yield tweet
+
+    def query(self, word, lang, since_id=None, max_id=None, seen=None,
+              tag=None):
+        '''
+        QueryPlan of word for run() (see QueryPlan)
+        '''
+        return QueryPlan(search_params(word, lang, self.count), since_id,
+                         tag=tag, slice_seconds=self.slice_seconds, seen=seen,
+                         max_id=max_id)
+
+    def run(self, plans, time_interval):
+        '''
+        Generator of (plan, tweet) for all plans during time_interval (sec).
+        '''
+        deadline = time.time() + time_interval
+        stop = threading.Event()
+        jobs = Queue()
+        results = Queue(maxsize=self.workers * 2)    # Backpressure on workers
+        for _ in range(self.workers):
+            worker = threading.Thread(target=self._work,
+                                      args=(jobs, results, deadline, stop))
+            worker.daemon = True
+            worker.start()
+
+        ready = deque()    # Cursors waiting for the next page
+        plans = list(plans)
+        unique = 0
+        in_flight = 0
+        try:
+            while time.time() < deadline:
+                while in_flight < self.workers:
+                    cursor = self._next_cursor(ready, plans)
+                    if cursor is None:
+                        break
+                    jobs.put(cursor)
+                    in_flight += 1
+                if not in_flight:    # All plans exhausted
+                    break
+                try:
+                    cursor, resp, content = \
+                        results.get(timeout=max(deadline - time.time(), 0))
+                except Empty:
+                    break
+                in_flight -= 1
+
+                status = resp.get('status')
+                registry = metrics.registry
+                registry.inc('http_responses_total', status=status)
+                if status == '200':
+                    registry.inc('http_response_bytes_total', len(content))
+                    with registry.timer('parse_seconds'):
+                        statuses = parse_statuses(content)
+                    tweet_id = cursor.plan.tweet_id
+                    before = unique
+                    for tweet in statuses:
+                        if not tweet['id'] in tweet_id:    # Excludes DUPLICATES
+                            tweet_id.add(tweet['id'])
+                            unique += 1
+                            yield cursor.plan, tweet
+                    registry.inc('tweets_fetched_total', unique - before)
+                    registry.inc('tweets_duplicate_total',
+                                 len(statuses) - (unique - before))
+                    cursor.advance(statuses)
+                    if not cursor.done:
+                        ready.appendleft(cursor)
+                    elif (cursor.pages == 1) and (len(statuses) < self.count):
+                        cursor.plan.widen()
+                    self._log(status, unique, deadline)
+                elif status == '429':
+                    ready.append(cursor)    # Limiter waits for the reset
+                elif status == 'deadline':
+                    break
+                elif (status == 'error') or (status in RETRY_STATUSES):
+                    # Transient: client retried it already, slice is retried
+                    # later (dropped after MAX_ERRORS)
+                    cursor.errors += 1
+                    if cursor.errors < self.MAX_ERRORS:
+                        ready.append(cursor)
+                    print('Network error: {}'.format(resp.get('error') or
+                        '{} {}'.format(status, ERROR_CODES.get(status, ''))))
+                else:
+                    print('Twitte API Error: [{code}]:{descr}'.format( \
+                        code=status, descr=ERROR_CODES.get(status, '')))
+                    cursor.plan.exhausted = cursor.plan.failed = True
+        finally:
+            stop.set()
+            for _ in range(self.workers):
+                jobs.put(None)
+
+    def _next_cursor(self, ready, plans):
+        '''
+        Continues started slices first, then opens new ones round robin.
+        '''
+        while ready:
+            cursor = ready.popleft()
+            if not cursor.plan.failed:
+                return cursor
+        for _ in range(len(plans)):
+            plan = plans.pop(0)
+            cursor = plan.next_slice()
+            if cursor is not None:
+                plans.append(plan)
+                return cursor
+        return None
+
+    def _work(self, jobs, results, deadline, stop):
+        client = self.client_factory()
+        while not stop.is_set():
+            cursor = jobs.get()
+            if cursor is None:
+                break
+            if not self.limiter.acquire(deadline):
+                answer = (cursor, {'status': 'deadline'}, '')
+            else:
+                try:
+                    with metrics.registry.timer('http_request_seconds'):
+                        resp, content = \
+                            client.request(cursor.url(self.search_url))
+                except Exception as e:    # Sockets, SSL, httplib errors
+                    self.limiter.release()
+                    answer = (cursor, {'status': 'error', 'error': e}, '')
+                else:
+                    self.limiter.update(resp)
+                    answer = (cursor, resp, content)
+            while not stop.is_set():
+                try:
+                    results.put(answer, timeout=1)
+                    break
+                except Full:
+                    continue
+
+    def _log(self, status, unique, deadline):
+        if self.verbose:
+            print('{} fetch status={} unique={} remaining={:.2f}s '
+                  'budget={}'.format(time.strftime('%H:%M:%S'), status, unique,
+                                     deadline - time.time(),
+                                     self.limiter.remaining))
@@ -1,17 +1,24 @@
 #!bin/python
 # -*- coding: utf-8 -*-
+import argparse
 import json
+import os
+import time
 
 from getpass import getpass
-from inspect import getmembers
-from inspect import ismethod
+from sys import argv
 from sys import exit
 
+import profiling
+from profiling import profiled
 from twitter_stats import User
 from twitter_stats import Stats
+from twitter_stats import WORK_DIR
+from collector import collect
 
 
 HELP_LANGUAGES_URL = 'https://api.twitter.com/1.1/help/languages.json'
+LANGUAGES_TTL = 7 * 24 * 3600    # Seconds the cached list of languages is used
 
 def login():
     login = raw_input('login: ')
@@ -43,14 +50,34 @@ def show_commands(options_list):
     for item in options_list:
         print('{} |'.format(item)),
 
-def get_lang_list():
-    client = Stats.set_client()
-    resp, content = \
-        client.request(HELP_LANGUAGES_URL)
-    if resp['status'] == '200':
-        return json.loads(content)
-    else:
-        return {}
+def get_lang_list(path=None, ttl=LANGUAGES_TTL):
+    '''
+    Languages available for search. Cached in WORK_DIR/languages.json for
+    ttl seconds; the stale copy is used if the request fails.
+    '''
+    path = path or '{}/languages.json'.format(WORK_DIR)
+    cached = None
+    try:
+        with open(path, 'r') as f:
+            cached = json.load(f)
+        if time.time() - os.path.getmtime(path) < ttl:
+            return cached
+    except (IOError, OSError, ValueError):    # No cache yet or broken
+        pass
+
+    try:
+        resp, content = Stats.set_client().request(HELP_LANGUAGES_URL)
+    except Exception as e:    # Network errors (httplib2 has its own types)
+        print('no list of languages: {!r}'.format(e))
+        return cached or {}
+    if resp['status'] != '200':
+        return cached or {}
+    languages = json.loads(content)
+    tmp_path = '{}.tmp'.format(path)
+    with open(tmp_path, 'w') as f:
+        json.dump(languages, f)
+    os.rename(tmp_path, path)
+    return languages
 
 def show_lang(lang_dict, carriage_return=True):
     if carriage_return:
@@ -68,6 +95,22 @@ def show_lang_list(lang_list):
         carr_ret = not carr_ret
 
 
+def profile_options(args):
+    '''
+    --profile DIR [--profiler cprofile|sample]: profile of every command
+    '''
+    parser = argparse.ArgumentParser(description='Twitter statistics')
+    parser.add_argument('-p', '--profile', metavar='DIR',
+                        help='write profile of every command to DIR')
+    parser.add_argument('--profiler', choices=profiling.KINDS,
+                        default='cprofile')
+    options = parser.parse_args(args)
+    if options.profile:
+        profiling.configure(options.profile, options.profiler)
+
+
+profile_options(argv[1:])
+
 print('### Twitter statistics ###\n')
 
 ### LOGIN ###
@@ -80,14 +123,18 @@ if word == '':
 else:
     stats = UserStats(word)
 
-# Generate actual list of languages available
-languages = get_lang_list()
 # Generate list of commands
 basic_commands = ['help', 'exit']
-extra_commands = ['new','time','set_user', 'del_user', 'change_lang']
-
-exclude = ['authorised', 'extract_words', 'tweets_count', 'client', 'set_client']
-command_list = [name for name, value in getmembers(stats) if (name[0] != '_') \
+extra_commands = ['new','time','set_user', 'del_user', 'change_lang', 'batch']
+
+exclude = ['authorised', 'extract_words', 'tweets_count', 'client', 'set_client',
+           'merge', 'workers', 'top_k', 'uniques_capacity',
+           'batch_size', 'add_corpus', 'archive',
+           'storage', 'windows', 'limiter', 'default_storage',
+           'dedup', 'compact', 'distinct',
+           'trending']    # No time windows in CLI (daemon.py "windows")
+# dir(), not getmembers(): properties (client, counters) stay unevaluated
+command_list = [name for name in dir(stats) if (name[0] != '_') \
                 and(name not in exclude)]
 
 # Print WELCOME message, add commad list
@@ -115,12 +162,12 @@ while True:
         word = raw_input('  keyword: ')
         print('keyword changed to: {}'.format(word))
         stats = UserStats(word)
-        stats.get()
+        stats.get()    # Profiled by Stats (profiled_method)
         continue
     # time
     elif (command == extra_commands[1])and(stats.authorised):
-        time = raw_input('  time interval (sec): ')
-        stats.time_interval = int(time)
+        interval = raw_input('  time interval (sec): ')
+        stats.time_interval = int(interval)
         continue
     # set_user
     elif command == extra_commands[2]:
@@ -132,6 +179,7 @@ while True:
         continue
     # lang
     elif command == extra_commands[4]:
+        languages = get_lang_list()
         show_lang_list(languages)
         print('current language: {}'.format(stats.lang))
         lang = raw_input('  choose language: ')
@@ -140,6 +188,18 @@ while True:
         else:
             print('wrong code!')
         continue
+    # batch
+    elif (command == extra_commands[5])and(stats.authorised):
+        words = raw_input('  keywords (comma separated): ')
+        batch = [UserStats(w.strip()) for w in words.split(',') if w.strip()]
+        if batch:
+            with profiled(stats.word, command):    # If --profile is given
+                collect(batch, stats.time_interval)
+            for item in batch:
+                print('{}: {}'.format(item.word.upper(), item.sentence))
+                if UserStats.access == 'admin':
+                    item.save()
+        continue
     # help
     elif command == basic_commands[0]:
         cmd = raw_input('   for command: ')
@@ -154,6 +214,8 @@ while True:
         exit()
 
     else:
-        execute(stats, command)
+        # Only the work is profiled (if --profile is given), not prompts
+        with profiled(stats.word, command):
+            execute(stats, command)
 
 ##################
\ No newline at end of file
@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+'''
+Counters and histograms of stats pipeline (fetch, tokenize, aggregate,
+save/load) with pluggable exporters.
+
+Disabled by default: `registry` is NullRegistry, which does nothing. Hot
+paths call it through the module (metrics.registry.inc(...)), so enabling
+takes effect everywhere:
+
+metrics.enable([LogExporter(), PrometheusExporter('stats.prom')], interval=60)
+
+or by environment variable (read on import):
+TWITTER_STATS_METRICS=log,prometheus:/var/lib/node_exporter/twitter.prom
+TWITTER_STATS_METRICS_INTERVAL=60
+'''
+from __future__ import division
+
+import atexit
+import os
+import sys
+import threading
+import time
+
+from bisect import bisect_left
+from timeit import default_timer as timer
+
+
+# Upper bounds of histogram buckets (seconds)
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1,
+           2.5, 5, 10, 30)
+
+
+class Counter(object):
+    TYPE = 'counter'
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, value=1):
+        with self._lock:
+            self.value += value
+
+
+class Histogram(object):
+    '''
+    Counts of observations by buckets (upper bounds), their sum and count
+    '''
+    TYPE = 'histogram'
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)    # Last: above all
+        self.sum = 0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def percentile(self, percent):
+        '''
+        Upper bound of bucket holding percent of observations (estimate)
+        '''
+        if not self.count:
+            return None
+        rank = percent / 100 * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class _Timer(object):
+    '''
+    Context manager observing seconds spent in with block
+    '''
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = timer()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(timer() - self.start)
+
+
+class _NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+NULL_TIMER = _NullTimer()
+
+
+class NullRegistry(object):
+    '''
+    Disabled metrics: every call is a no-op
+    '''
+    enabled = False
+
+    def inc(self, name, value=1, **labels):
+        pass
+
+    def observe(self, name, value, **labels):
+        pass
+
+    def timer(self, name, **labels):
+        return NULL_TIMER
+
+    def export(self):
+        pass
+
+
+class Registry(object):
+    '''
+    Metrics by (name, labels); created on the first use.
+
+    exporters - objects with export(registry) method
+    '''
+    enabled = True
+
+    def __init__(self, exporters=()):
+        self.exporters = list(exporters)
+        self.started = time.time()
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, **labels):
+        return self._get(Counter, name, labels)
+
+    def histogram(self, name, **labels):
+        return self._get(Histogram, name, labels)
+
+    def inc(self, name, value=1, **labels):
+        self._get(Counter, name, labels).inc(value)
+
+    def observe(self, name, value, **labels):
+        self._get(Histogram, name, labels).observe(value)
+
+    def timer(self, name, **labels):
+        '''
+        with registry.timer('save_seconds'): ...
+        '''
+        return _Timer(self._get(Histogram, name, labels))
+
+    def metrics(self):
+        '''
+        [(name, labels dict, metric), ...] sorted by name
+        '''
+        with self._lock:
+            items = list(self._metrics.items())
+        return [(name, dict(labels), metric)
+                for (name, labels), metric in sorted(items)]
+
+    def export(self):
+        for exporter in self.exporters:
+            exporter.export(self)
+
+    def _get(self, cls, name, labels):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.setdefault(key, cls())
+        return metric
+
+
+def _labels(labels, extra=()):
+    pairs = sorted(labels.items()) + list(extra)
+    if not pairs:
+        return ''
+    return '{{{}}}'.format(','.join('{}="{}"'.format(key, value)
+                                    for key, value in pairs))
+
+
+class LogExporter(object):
+    '''
+    One key=value line per metric: counters with rate per second since the
+    previous export, histograms with count, sum, average and percentiles.
+    '''
+
+    def __init__(self, stream=None):
+        self.stream = stream
+        self._last = {}    # Counter values of the previous export
+        self._last_time = None
+
+    def export(self, registry):
+        stream = self.stream or sys.stderr
+        now = time.time()
+        elapsed = now - (self._last_time or registry.started)
+        self._last_time = now
+        stamp = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(now))
+        for name, labels, metric in registry.metrics():
+            fields = ['metric={}'.format(name)]
+            fields.extend('{}={}'.format(key, value)
+                          for key, value in sorted(labels.items()))
+            if metric.TYPE == 'counter':
+                key = (name, tuple(sorted(labels.items())))
+                rate = (metric.value - self._last.get(key, 0)) / \
+                    max(elapsed, 1e-9)
+                self._last[key] = metric.value
+                fields.append('value={} rate={:.2f}/s'.format(metric.value,
+                                                            rate))
+            else:
+                if not metric.count:
+                    continue
+                fields.append('count={} sum={:.4f} avg={:.6f} p50={} p90={} '
+                              'p99={}'.format(
+                    metric.count, metric.sum, metric.sum / metric.count,
+                    metric.percentile(50), metric.percentile(90),
+                    metric.percentile(99)))
+            stream.write('{} {}\n'.format(stamp, ' '.join(fields)))
+        stream.flush()
+
+
+class PrometheusExporter(object):
+    '''
+    Prometheus text format file (e.g. for node_exporter textfile
+    collector), replaced atomically on every export.
+    '''
+
+    def __init__(self, path, prefix='twitter_stats_'):
+        self.path = path
+        self.prefix = prefix
+
+    def export(self, registry):
+        lines = []
+        typed = set()
+        for name, labels, metric in registry.metrics():
+            name = self.prefix + name
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE {} {}'.format(name, metric.TYPE))
+            if metric.TYPE == 'counter':
+                lines.append('{}{} {}'.format(name, _labels(labels),
+                                              metric.value))
+                continue
+            cumulative = 0
+            bounds = [repr(float(bound)) for bound in metric.buckets] + ['+Inf']
+            for bound, count in zip(bounds, metric.counts):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(
+                    name, _labels(labels, [('le', bound)]), cumulative))
+            lines.append('{}_sum{} {}'.format(name, _labels(labels),
+                                              repr(metric.sum)))
+            lines.append('{}_count{} {}'.format(name, _labels(labels),
+                                                metric.count))
+        tmp_path = '{}.tmp'.format(self.path)
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.rename(tmp_path, self.path)
+
+
+registry = NullRegistry()
+_exporting = None    # Stop event of the export thread
+atexit.register(lambda: export())    # Registry of the exit time
+
+
+def enable(exporters=(), interval=None):
+    '''
+    Starts collecting metrics. Exporters run every interval seconds (if
+    given) and at exit.
+    '''
+    global registry, _exporting
+    disable()
+    registry = Registry(exporters)
+    if interval:
+        _exporting = threading.Event()
+        thread = threading.Thread(target=_export_every,
+                                  args=(interval, _exporting))
+        thread.daemon = True
+        thread.start()
+    return registry
+
+
+def disable():
+    global registry, _exporting
+    if _exporting is not None:
+        _exporting.set()
+        _exporting = None
+    registry = NullRegistry()
+
+
+def export():
+    registry.export()
+
+
+def _export_every(interval, stop):
+    while not stop.wait(interval):
+        export()
+
+
+def configure(spec=None, interval=None):
+    '''
+    Enables metrics by spec: comma separated 'log', 'prometheus:<path>'
+    (TWITTER_STATS_METRICS environment variable by default)
+    '''
+    spec = os.environ.get('TWITTER_STATS_METRICS', '') if spec is None else spec
+    if interval is None:
+        interval = float(os.environ.get('TWITTER_STATS_METRICS_INTERVAL', 60))
+    exporters = []
+    for item in spec.split(','):
+        item = item.strip()
+        if item == 'log':
+            exporters.append(LogExporter())
+        elif item.startswith('prometheus:'):
+            exporters.append(PrometheusExporter(item[len('prometheus:'):]))
+        elif item:
+            raise ValueError('unknown metrics exporter: {}'.format(item))
+    if exporters:
+        enable(exporters, interval)
+
+
+try:
+    configure()
+except (ValueError, IOError, OSError) as e:    # Metrics never break imports
+    sys.stderr.write('metrics are disabled, wrong TWITTER_STATS_METRICS '
+                     'settings: {}\n'.format(e))
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+'''
+Parsing of API responses into slim tweet records.
+
+Stats need only id, text, retweet_count, created_at and user.time_zone of a
+tweet, but a full status (entities, user object, metadata) is tens of dicts.
+Statuses of a search page are decoded one at a time and projected to Tweet
+records at once, so a page never exists as one big tree of dicts.
+
+Tweet is read like the status dict (tweet[u'text'], tweet[u'user']
+[u'time_zone'], tweet.get(u'created_at')), so code written for dicts (and
+dicts of corpora and archives) works with both.
+
+Faster JSON backend is used if installed (orjson, ujson): it parses the
+whole page at once, which is still faster than the incremental parsing.
+'''
+
+import json
+import re
+
+try:
+    import orjson as fast_json
+except ImportError:
+    try:
+        import ujson as fast_json
+    except ImportError:    # Optional: several times faster parsing
+        fast_json = None
+
+loads = fast_json.loads if fast_json is not None else json.loads
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_users = {}    # Shared user dicts by time zone (a few hundred of them)
+
+
+class Tweet(object):
+    '''
+    Slim tweet: the fields stats use, read as attributes or dict items
+    '''
+    __slots__ = ('id', 'text', 'retweet_count', 'created_at', 'user')
+
+    def __init__(self, id, text, retweet_count=0, created_at=None,
+                 time_zone=None):
+        self.id = id
+        self.text = text
+        self.retweet_count = retweet_count
+        self.created_at = created_at
+        user = _users.get(time_zone)
+        if user is None:
+            user = _users.setdefault(time_zone, {u'time_zone': time_zone})
+        self.user = user
+
+    @classmethod
+    def from_dict(cls, status):
+        '''
+        Projection of status dict (API or JSON-lines file)
+        '''
+        user = status.get(u'user') or {}
+        return cls(status[u'id'], status[u'text'],
+                   status.get(u'retweet_count', 0),
+                   status.get(u'created_at'), user.get(u'time_zone'))
+
+    @property
+    def time_zone(self):
+        return self.user[u'time_zone']
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def to_dict(self):
+        '''
+        Status dict of the fields (JSON serializable, see archive)
+        '''
+        return {u'id': self.id, u'text': self.text,
+                u'retweet_count': self.retweet_count,
+                u'created_at': self.created_at, u'user': dict(self.user)}
+
+    def __repr__(self):
+        return 'Tweet({!r})'.format(self.to_dict())
+
+
+def iter_statuses(content):
+    '''
+    Generator of status dicts of search response ({"statuses": [...], ...}),
+    decoded one by one (other keys are skipped)
+    '''
+    decode = _decoder.raw_decode
+    space = _WHITESPACE.match
+    try:
+        index = space(content, 0).end()
+        if content[index] != '{':
+            raise ValueError('not a JSON object')
+        index = space(content, index + 1).end()
+        while content[index] != '}':
+            key, index = decode(content, index)
+            index = space(content, index).end()
+            if content[index] != ':':
+                raise ValueError('no ":" at {}'.format(index))
+            index = space(content, index + 1).end()
+            if key == u'statuses':
+                if content[index] != '[':
+                    raise ValueError('statuses are not a list')
+                index = space(content, index + 1).end()
+                while content[index] != ']':
+                    status, index = decode(content, index)
+                    yield status
+                    index = space(content, index).end()
+                    if content[index] == ',':
+                        index = space(content, index + 1).end()
+                index += 1
+            else:
+                _, index = decode(content, index)
+            index = space(content, index).end()
+            if content[index] == ',':
+                index = space(content, index + 1).end()
+    except IndexError:
+        raise ValueError('truncated JSON')
+
+
+def parse_statuses(content):
+    '''
+    Tweet records of search response body
+    '''
+    if fast_json is not None:
+        statuses = fast_json.loads(content).get(u'statuses', [])
+    else:
+        statuses = iter_statuses(content)
+    return [Tweet.from_dict(status) for status in statuses]
+
+
+def parse_tweet(line):
+    '''
+    Tweet record of JSON line (stream, corpus and archive files)
+    '''
+    return Tweet.from_dict(loads(line))
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+'''
+Optional profiling of runs (CLI commands, Stats.get/refresh/stream).
+
+Off unless a directory is set, by configure() or environment variables:
+TWITTER_STATS_PROFILE=<directory>
+TWITTER_STATS_PROFILER=cprofile|sample    (cprofile by default)
+
+Every profiled run writes a file tagged by keyword and command:
+<directory>/<word>.<command>.<time>.<pid>.pstats     - cProfile (pstats,
+    snakeviz, gprof2dot), thread of the run only
+<directory>/<word>.<command>.<time>.<pid>.collapsed  - sampled stacks of
+    all threads, one 'frame;frame;frame count' line per stack (flamegraph.pl,
+    speedscope)
+Nested runs (get inside a CLI command) are part of the outer profile.
+'''
+
+import cProfile
+import os
+import re
+import sys
+import threading
+import time
+
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+
+
+KINDS = ('cprofile', 'sample')
+INTERVAL = 0.005    # Seconds between samples
+
+directory = os.environ.get('TWITTER_STATS_PROFILE') or None
+kind = os.environ.get('TWITTER_STATS_PROFILER') or 'cprofile'
+
+_active = threading.local()    # Run of the thread is profiled already
+
+
+def configure(profile_dir, profiler='cprofile'):
+    '''
+    Profiles runs into profile_dir (None - off) by profiler (see KINDS)
+    '''
+    global directory, kind
+    if profiler not in KINDS:
+        raise ValueError('unknown profiler: {}'.format(profiler))
+    directory = profile_dir
+    kind = profiler
+
+
+def profile_path(word, command, ext):
+    '''
+    Path of the new profile of command run for word
+    '''
+    tag = '.'.join(re.sub(r'[^\w-]+', '_', part or '_')
+                   for part in (word, command))
+    return '{}/{}.{}.{}.{}'.format(directory, tag,
+                                   time.strftime('%Y%m%d-%H%M%S'),
+                                   os.getpid(), ext)
+
+
+@contextmanager
+def profiled(word, command):
+    '''
+    with profiled('python', 'refresh'): ... - profiles the block if
+    profiling is on
+    '''
+    if (directory is None) or getattr(_active, 'on', False):
+        yield
+        return
+    if not os.path.exists(directory):    # Create FOLDER if not exist
+        os.makedirs(directory)
+    _active.on = True
+    try:
+        if kind == 'sample':
+            sampler = StackSampler()
+            sampler.start()
+            try:
+                yield
+            finally:
+                sampler.stop()
+                sampler.save(profile_path(word, command, 'collapsed'))
+        else:
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+                profile.dump_stats(profile_path(word, command, 'pstats'))
+    finally:
+        _active.on = False
+
+
+def profiled_method(command):
+    '''
+    Decorator of Stats methods: profiles them tagged by self.word
+    '''
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with profiled(self.word, command):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class StackSampler(object):
+    '''
+    Samples stacks of all threads (but its own) every interval seconds
+    '''
+
+    def __init__(self, interval=INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write('{} {}\n'.format(stack, count))
+
+    def _run(self):
+        own = threading.current_thread().ident
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    self.stacks[self._stack(names.get(ident, ident), frame)] += 1
+
+    @staticmethod
+    def _stack(thread_name, frame):
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append('{} ({}:{})'.format(
+                code.co_name, os.path.basename(code.co_filename),
+                code.co_firstlineno))
+            frame = frame.f_back
+        frames.append(str(thread_name))
+        return ';'.join(reversed(frames))
@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+'''
+SQLite backend of stats (stdlib sqlite3) with cross-keyword queries.
+
+Word counts, length histograms, origins and scalar metrics of every keyword
+are kept in indexed tables of one database, so questions over many keywords
+are answered by SQL without loading them:
+
+storage = SQLiteStorage()
+stats = Stats('python', storage=storage)
+storage.top_words(limit=10)
+storage.shared_origins()
+storage.distinct(['python', 'java']).count()    # Stats(..., distinct=True)
+'''
+
+import json
+import os
+import sqlite3
+import time
+
+from storage import Storage
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS keywords (
+    id INTEGER PRIMARY KEY,
+    word TEXT UNIQUE NOT NULL,
+    tweets_count INTEGER NOT NULL DEFAULT 0,
+    global_retweets INTEGER NOT NULL DEFAULT 0,
+    global_length INTEGER NOT NULL DEFAULT 0,
+    global_words_count INTEGER NOT NULL DEFAULT 0,
+    global_sentences INTEGER NOT NULL DEFAULT 0,
+    since_id INTEGER,
+    extra TEXT,
+    updated REAL
+);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    keyword_id INTEGER NOT NULL,
+    saved REAL NOT NULL,
+    tweets_count INTEGER NOT NULL,
+    new_tweets INTEGER NOT NULL,
+    since_id INTEGER
+);
+CREATE TABLE IF NOT EXISTS words (
+    keyword_id INTEGER NOT NULL,
+    word TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (keyword_id, word)
+);
+CREATE TABLE IF NOT EXISTS lengths (
+    keyword_id INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (keyword_id, length)
+);
+CREATE TABLE IF NOT EXISTS origins (
+    keyword_id INTEGER NOT NULL,
+    time_zone TEXT,
+    count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS words_word ON words (word);
+CREATE INDEX IF NOT EXISTS origins_keyword ON origins (keyword_id);
+CREATE INDEX IF NOT EXISTS origins_time_zone ON origins (time_zone);
+CREATE INDEX IF NOT EXISTS runs_keyword ON runs (keyword_id, saved);
+'''
+
+SUMS = ('tweets_count', 'global_retweets', 'global_length',
+        'global_words_count', 'global_sentences')
+
+# Section name: (table, key column)
+SECTIONS = {'uniques': ('words', 'word'),
+            'letters_per_word': ('lengths', 'length'),
+            'origin': ('origins', 'time_zone')}
+
+
+def _text(word):
+    if isinstance(word, str):    # raw_input gives utf-8 bytes
+        return word.decode('utf-8')
+    return word
+
+
+class SQLiteStorage(Storage):
+    '''
+    All keywords in one database file (WORK_DIR/stats/stats.db by default).
+    Every save() is also recorded as a collection run.
+    '''
+
+    def __init__(self, directory=None, db_name='stats.db'):
+        super(SQLiteStorage, self).__init__(directory)
+        self.db_path = '{}/{}'.format(self.directory, db_name)
+        self._ready = False
+
+    def path(self, word):
+        return self.db_path
+
+    def exists(self, word):
+        if not os.path.isfile(self.db_path):
+            return False
+        with self._connect() as db:
+            return self._keyword_id(db, word) is not None
+
+    def save(self, word, data):
+        '''
+        Replaces stats of word with raw stats dict (StatsAccumulator.to_dict)
+        '''
+        now = time.time()
+        extra = dict((k, v) for k, v in data.items()
+                     if (k not in SUMS) and (k not in SECTIONS)
+                     and (k != 'since_id'))
+        with self._connect() as db:
+            keyword_id = self._keyword_id(db, word)
+            if keyword_id is None:
+                keyword_id = db.execute('INSERT INTO keywords (word) VALUES (?)',
+                                        (_text(word),)).lastrowid
+                previous = 0
+            else:
+                previous = db.execute(
+                    'SELECT tweets_count FROM keywords WHERE id = ?',
+                    (keyword_id,)).fetchone()[0]
+
+            db.execute('UPDATE keywords SET {}, since_id = ?, extra = ?, '
+                       'updated = ? WHERE id = ?'.format(
+                           ', '.join('{} = ?'.format(name) for name in SUMS)),
+                       [data.get(name, 0) for name in SUMS] +
+                       [data.get('since_id'), json.dumps(extra), now,
+                        keyword_id])
+
+            for name, (table, column) in SECTIONS.items():
+                if name not in data:
+                    continue
+                db.execute('DELETE FROM {} WHERE keyword_id = ?'.format(table),
+                           (keyword_id,))
+                db.executemany(
+                    'INSERT INTO {} (keyword_id, {}, count) '
+                    'VALUES (?, ?, ?)'.format(table, column),
+                    ((keyword_id, key, count)
+                     for key, count in data[name].items()))
+
+            tweets_count = data.get('tweets_count', 0)
+            db.execute('INSERT INTO runs (keyword_id, saved, tweets_count, '
+                       'new_tweets, since_id) VALUES (?, ?, ?, ?, ?)',
+                       (keyword_id, now, tweets_count,
+                        max(tweets_count - previous, 0), data.get('since_id')))
+
+    def load(self, word):
+        data, loader = self.open(word)
+        for name in SECTIONS:
+            data[name] = loader(name)
+        return data
+
+    def open(self, word):
+        '''
+        (data, loader) - scalars of word and loader(name) of its counters.
+        IOError if there are no stats of word.
+        '''
+        with self._connect() as db:
+            row = db.execute('SELECT id, {}, since_id, extra FROM keywords '
+                             'WHERE word = ?'.format(', '.join(SUMS)),
+                             (_text(word),)).fetchone()
+        if row is None:
+            raise IOError('no stats of {} in {}'.format(word, self.db_path))
+
+        keyword_id = row[0]
+        data = json.loads(row[-1] or '{}')
+        data.update(zip(SUMS, row[1:-2]))
+        data['since_id'] = row[-2]
+
+        def loader(name):
+            if name not in SECTIONS:    # Sketch (distinct) is kept in extra
+                return {}
+            table, column = SECTIONS[name]
+            with self._connect() as db:
+                return dict(db.execute(
+                    'SELECT {}, count FROM {} WHERE keyword_id = ?'.format(
+                        column, table), (keyword_id,)))
+
+        return data, loader
+
+    ### Queries over keywords ###
+
+    def keywords(self):
+        '''
+        [(word, tweets_count, updated), ...]
+        '''
+        with self._connect() as db:
+            return db.execute('SELECT word, tweets_count, updated '
+                              'FROM keywords ORDER BY word').fetchall()
+
+    def top_words(self, limit=30, words=None):
+        '''
+        [(word, count, keywords), ...] - most frequent words over keywords
+        (all by default)
+        '''
+        where, params = self._filter(words)
+        with self._connect() as db:
+            return db.execute(
+                'SELECT w.word, SUM(w.count) AS total, '
+                'COUNT(w.keyword_id) FROM words w '
+                'JOIN keywords k ON k.id = w.keyword_id {} '
+                'GROUP BY w.word ORDER BY total DESC LIMIT ?'.format(where),
+                params + [limit]).fetchall()
+
+    def word_keywords(self, word, limit=30):
+        '''
+        [(keyword, count), ...] - keywords using the word most
+        '''
+        with self._connect() as db:
+            return db.execute(
+                'SELECT k.word, w.count FROM words w '
+                'JOIN keywords k ON k.id = w.keyword_id WHERE w.word = ? '
+                'ORDER BY w.count DESC LIMIT ?',
+                (_text(word), limit)).fetchall()
+
+    def shared_origins(self, min_keywords=2, words=None):
+        '''
+        [(time_zone, keywords, tweets), ...] - time zones shared by at least
+        min_keywords keywords
+        '''
+        where, params = self._filter(words)
+        with self._connect() as db:
+            return db.execute(
+                'SELECT o.time_zone, COUNT(DISTINCT o.keyword_id) AS shared, '
+                'SUM(o.count) FROM origins o '
+                'JOIN keywords k ON k.id = o.keyword_id {} '
+                'GROUP BY o.time_zone HAVING shared >= ? '
+                'ORDER BY shared DESC, SUM(o.count) DESC'.format(where),
+                params + [min_keywords]).fetchall()
+
+    def origin_keywords(self, time_zone, limit=30):
+        '''
+        [(keyword, tweets), ...] - keywords tweeted from time_zone the most
+        '''
+        with self._connect() as db:
+            return db.execute(
+                'SELECT k.word, o.count FROM origins o '
+                'JOIN keywords k ON k.id = o.keyword_id '
+                'WHERE o.time_zone IS ? ORDER BY o.count DESC LIMIT ?',
+                (_text(time_zone), limit)).fetchall()
+
+    def runs(self, word=None, since=None):
+        '''
+        [(keyword, saved, tweets_count, new_tweets), ...] - collection runs
+        since timestamp (all by default)
+        '''
+        where, params = self._filter([word] if word is not None else None)
+        if since is not None:
+            where += ' AND ' if where else 'WHERE '
+            where += 'r.saved >= ?'
+            params.append(since)
+        with self._connect() as db:
+            return db.execute(
+                'SELECT k.word, r.saved, r.tweets_count, r.new_tweets '
+                'FROM runs r JOIN keywords k ON k.id = r.keyword_id {} '
+                'ORDER BY r.saved'.format(where), params).fetchall()
+
+    def collected(self, since=None):
+        '''
+        [(keyword, new_tweets), ...] - tweets collected since timestamp
+        '''
+        where, params = ('WHERE r.saved >= ?', [since]) if since else ('', [])
+        with self._connect() as db:
+            return db.execute(
+                'SELECT k.word, SUM(r.new_tweets) AS total FROM runs r '
+                'JOIN keywords k ON k.id = r.keyword_id {} '
+                'GROUP BY k.word ORDER BY total DESC'.format(where),
+                params).fetchall()
+
+    @staticmethod
+    def _filter(words):
+        if not words:
+            return '', []
+        return ('WHERE k.word IN ({})'.format(', '.join('?' * len(words))),
+                [_text(word) for word in words])
+
+    def _keyword_id(self, db, word):
+        row = db.execute('SELECT id FROM keywords WHERE word = ?',
+                         (_text(word),)).fetchone()
+        return row[0] if row else None
+
+    def _connect(self):
+        '''
+        New connection (usable from any thread); as context manager it
+        commits or rolls back the transaction.
+        '''
+        if not self._ready:
+            if not os.path.exists(self.directory):    # Create FOLDER if not exist
+                os.makedirs(self.directory)
+        db = sqlite3.connect(self.db_path, timeout=30)
+        if not self._ready:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.executescript(SCHEMA)
+            self._ready = True
+        return _Connection(db)
+
+
+class _Connection(object):
+    '''
+    sqlite3 connection closed (not only committed) at the end of with block
+    '''
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.db.commit()
+            else:
+                self.db.rollback()
+        finally:
+            self.db.close()
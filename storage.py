@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+'''
+Storage backends of stats files (<directory>/<word>.data).
+
+LegacyStorage - JSON + base64 + Caesar cipher (the original format).
+BinaryStorage - compressed binary format (msgpack if installed, JSON
+                otherwise) with optional authenticated encryption (Fernet).
+                Heavy sections (counters) are stored apart from the header,
+                so they can be loaded on demand (see Storage.open).
+Both read files of each other, so old .data files stay readable.
+'''
+
+import json
+import os
+import struct
+import threading
+import zlib
+
+from base64 import b64encode
+from base64 import b64decode
+
+from hll import HyperLogLog
+from hll import union
+
+try:
+    import msgpack
+except ImportError:    # Optional: faster and more compact than JSON
+    msgpack = None
+
+
+_CAESAR_TABLES = {}
+
+
+def _caesar_tables(code):
+    '''
+    (encode, decode) translate tables of Caesar cipher over all bytes
+    '''
+    if code not in _CAESAR_TABLES:
+        _CAESAR_TABLES[code] = (
+            ''.join(chr((((i - 48) + code) % 75) + 48) for i in range(256)),
+            ''.join(chr((((i - 48) - code) % 75) + 48) for i in range(256)))
+    return _CAESAR_TABLES[code]
+
+
+def caesar_encrypt(s, code=5):
+    '''
+    Encrypts s string with base64 alg + Caesar cipher (in bulk).
+    '''
+    return b64encode(s).translate(_caesar_tables(code)[0])
+
+
+def caesar_decrypt(s, code=5):
+    '''
+    Decryption. Opposite to Encryption :)
+    '''
+    if not isinstance(s, bytes):    # JSON keys (tokens) are unicode
+        s = s.encode('ascii')
+    return b64decode(s.translate(_caesar_tables(code)[1]))
+
+
+class Storage(object):
+    '''
+    Base of storage backends: one file per word in directory.
+    '''
+    EXT = '.data'
+
+    def __init__(self, directory=None):
+        self.directory = directory or '{}/stats'.format(os.getcwd())
+
+    def path(self, word):
+        return '{}/{}{}'.format(self.directory, word, self.EXT)
+
+    def exists(self, word):
+        return os.path.isfile(self.path(word))
+
+    def save(self, word, data):
+        '''
+        Saves raw stats dict (StatsAccumulator.to_dict) of word. The file is
+        replaced atomically (temp file + rename): readers (api) never see a
+        part of it, a killed writer (daemon) leaves the old one.
+        '''
+        if not os.path.exists(self.directory):    # Create FOLDER if not exist
+            os.makedirs(self.directory)
+        raw = self.dumps(data)
+        path = self.path(word)
+        # Own temp file of every writer (file mode as before: umask)
+        tmp_path = '{}.{}.{}.tmp'.format(path, os.getpid(),
+                                         threading.current_thread().ident)
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(raw)
+            os.rename(tmp_path, path)
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def load(self, word):
+        '''
+        Raw stats dict of word. IOError if there is no file.
+        '''
+        with open(self.path(word), 'rb') as f:
+            return self.loads(f.read())
+
+    def open(self, word):
+        '''
+        (data, loader) - raw stats dict of word without heavy sections (if
+        the format allows) and loader(name) of such section, or None.
+        IOError if there is no file.
+        '''
+        f = open(self.path(word), 'rb')
+        try:
+            head = f.read(BinaryStorage.HEAD)
+            if head.startswith(BinaryStorage.MAGIC):
+                # Sections are read from this file, kept open by the loader:
+                # a file saved meanwhile replaces the name only
+                return BinaryStorage.open_header(f, head,
+                                                 getattr(self, 'key', None))
+            raw = head + f.read()
+        except:
+            f.close()
+            raise
+        f.close()
+        return self.loads(raw), None
+
+    def sketch(self, word):
+        '''
+        HyperLogLog of distinct words of word (saved by Stats(...,
+        distinct=True)), None if there is none. Counters are not loaded.
+        '''
+        if not self.exists(word):
+            return None
+        data, loader = self.open(word)
+        sketch = data.get('distinct')
+        if (sketch is None) and (loader is not None):
+            sketch = loader('distinct')
+        return HyperLogLog.from_dict(sketch) if sketch else None
+
+    def distinct(self, words):
+        '''
+        HyperLogLog of distinct words over the union of keywords (count()
+        is the estimate), None if none of them has a sketch. Constant
+        memory: sketches are merged one by one.
+        '''
+        return union(sketch for sketch in (self.sketch(word) for word in words)
+                     if sketch is not None)
+
+    def dumps(self, data):
+        raise NotImplementedError
+
+    def loads(self, raw):
+        '''
+        Recognizes format by the file header.
+        '''
+        if raw.startswith(BinaryStorage.MAGIC):
+            return BinaryStorage.decode(raw, getattr(self, 'key', None))
+        return LegacyStorage.decode(raw)
+
+
+class LegacyStorage(Storage):
+    '''
+    JSON encrypted with base64 + Caesar cipher.
+    '''
+
+    def dumps(self, data):
+        return caesar_encrypt(json.dumps(data))
+
+    @staticmethod
+    def decode(raw):
+        return json.loads(caesar_decrypt(raw))
+
+
+class BinaryStorage(Storage):
+    '''
+    MAGIC + serializer (m - msgpack, j - JSON) + flags + header length +
+    header + sections. Header - everything but SECTIONS, with offsets of
+    sections. Header and each section are zlib compressed separately.
+    Flag 'e' - they are encrypted and authenticated by Fernet (requires
+    cryptography module).
+
+    key - Fernet key (Fernet.generate_key()), None - no encryption
+    level - zlib compression level
+    '''
+    MAGIC = 'TWS2'
+    HEAD = len(MAGIC) + 2 + 4
+    SECTIONS = ('uniques', 'letters_per_word', 'origin', 'distinct')
+
+    def __init__(self, directory=None, key=None, level=3):
+        super(BinaryStorage, self).__init__(directory)
+        self.key = key
+        self.level = level
+
+    def dumps(self, data):
+        serializer = 'm' if msgpack is not None else 'j'
+        flags = 'e' if self.key else '-'
+
+        header = dict((k, v) for k, v in data.items()
+                      if k not in self.SECTIONS)
+        header['sections'] = {}
+        blobs = []
+        offset = 0
+        for name in self.SECTIONS:
+            if name in data:
+                blob = self._encode(data[name], serializer, flags)
+                header['sections'][name] = [offset, len(blob)]
+                offset += len(blob)
+                blobs.append(blob)
+        header_blob = self._encode(header, serializer, flags)
+
+        return ''.join([self.MAGIC, serializer, flags,
+                        struct.pack('>I', len(header_blob)), header_blob]
+                       + blobs)
+
+    def _encode(self, obj, serializer, flags):
+        if serializer == 'm':
+            blob = msgpack.packb(obj, use_bin_type=True)
+        else:
+            blob = json.dumps(obj)
+        blob = zlib.compress(blob, self.level)
+        if flags == 'e':
+            blob = _fernet(self.key).encrypt(blob)
+        return blob
+
+    @classmethod
+    def decode(cls, raw, key=None):
+        '''
+        Whole raw stats dict from file contents.
+        '''
+        serializer, flags = raw[4], raw[5]
+        size = struct.unpack('>I', raw[6:cls.HEAD])[0]
+        base = cls.HEAD + size
+        data = cls._decode(raw[cls.HEAD:base], serializer, flags, key)
+        for name, (offset, length) in data.pop('sections').items():
+            data[name] = cls._decode(raw[base + offset:base + offset + length],
+                                     serializer, flags, key)
+        return data
+
+    @classmethod
+    def open_header(cls, f, head, key=None):
+        '''
+        (header, loader) of opened file f, positioned after head. The loader
+        owns f: sections come from the same file as the header even if the
+        word is saved again meanwhile (Storage.save renames a new file in).
+        f is closed when the loader is released (StatsAccumulator drops it
+        once its sections are loaded).
+        '''
+        serializer, flags = head[4], head[5]
+        size = struct.unpack('>I', head[6:cls.HEAD])[0]
+        header = cls._decode(f.read(size), serializer, flags, key)
+        sections = header.pop('sections')
+        base = cls.HEAD + size
+        lock = threading.Lock()
+
+        def loader(name):
+            if name not in sections:
+                return {}
+            offset, length = sections[name]
+            with lock:
+                f.seek(base + offset)
+                blob = f.read(length)
+            return cls._decode(blob, serializer, flags, key)
+
+        return header, loader
+
+    @staticmethod
+    def _decode(blob, serializer, flags, key=None):
+        if flags == 'e':
+            if not key:
+                raise ValueError('stats file is encrypted, key is required')
+            blob = _fernet(key).decrypt(blob)
+        blob = zlib.decompress(blob)
+
+        if serializer == 'm':
+            if msgpack is None:
+                raise ImportError('msgpack is required to read this file')
+            try:
+                return msgpack.unpackb(blob, raw=False, strict_map_key=False)
+            except TypeError:    # msgpack < 1.0
+                return msgpack.unpackb(blob, raw=False)
+        return json.loads(blob)
+
+
+def _fernet(key):
+    from cryptography.fernet import Fernet    # Optional dependency
+    return Fernet(key)
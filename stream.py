@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+'''
+Ingestion of the Twitter streaming API (statuses/filter).
+
+One long-lived HTTP response of newline delimited tweets is read by a thread
+and parsed incrementally as chunks arrive. Tweets go through a bounded queue:
+when stats are slower than the stream, the reader stops reading the socket
+(backpressure). Dropped connections are reopened with the backoff Twitter
+asks for (linear for network errors, exponential for HTTP errors).
+'''
+
+import httplib
+import socket
+import threading
+import time
+
+from Queue import Queue
+from Queue import Empty
+from Queue import Full
+from urllib import urlencode
+from urlparse import urlparse
+
+import metrics
+from parsing import Tweet
+from parsing import loads
+
+STREAM_URL = 'https://stream.twitter.com/1.1/statuses/filter.json'
+STALL_TIMEOUT = 90    # Keep-alive newlines come every 30 sec
+QUEUE_SIZE = 1000    # Tweets parsed, but not consumed yet
+
+# (first delay, growth, max delay) of reconnects
+NETWORK_BACKOFF = (0.25, 0.25, 16)    # Linear
+HTTP_BACKOFF = (5, 2, 320)    # Exponential
+RATE_BACKOFF = (60, 2, 960)    # 420 / 429
+
+
+def oauth_signer(client):
+    '''
+    signer(method, url, params) -> headers, by consumer and token of
+    oauth2.Client (see Stats.set_client)
+    '''
+    import oauth2
+
+    def signer(method, url, params):
+        request = oauth2.Request.from_consumer_and_token(
+            client.consumer, token=client.token, http_method=method,
+            http_url=url, parameters=params)
+        request.sign_request(oauth2.SignatureMethod_HMAC_SHA1(),
+                             client.consumer, client.token)
+        return request.to_header()
+
+    return signer
+
+
+class TweetStream(object):
+    '''
+    Tweets by word from the streaming endpoint.
+
+    signer - signer(method, url, params) -> auth headers (see oauth_signer),
+             None - no authorization (local test servers)
+    url - stream endpoint (POST, form parameters track and language)
+    queue_size - parsed tweets kept before the reader waits for consumer
+    stall_timeout - reconnect if nothing (not even keep-alive) comes that long
+    '''
+
+    def __init__(self, word, lang=None, signer=None, url=STREAM_URL,
+                 queue_size=QUEUE_SIZE, stall_timeout=STALL_TIMEOUT,
+                 verbose=True):
+        if not isinstance(word, str):    # unicode -> utf-8 for urlencode
+            word = word.encode('utf-8')
+        self.params = {'track': word}
+        if lang:
+            self.params['language'] = lang
+        self.signer = signer
+        self.url = url
+        self.queue_size = queue_size
+        self.stall_timeout = stall_timeout
+        self.verbose = verbose
+        self.reconnects = 0
+        self._sock = None    # Socket of the current connection
+
+    def tweets(self, duration=None):
+        '''
+        Generator of tweets as they arrive, during duration (sec) or forever.
+        Closing the generator stops the stream.
+        '''
+        deadline = (time.time() + duration) if duration else None
+        queue = Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        reader = threading.Thread(target=self._read, args=(queue, stop))
+        reader.daemon = True
+        reader.start()
+        try:
+            while (deadline is None) or (time.time() < deadline):
+                timeout = 1 if deadline is None else \
+                    min(max(deadline - time.time(), 0), 1)
+                try:
+                    tweet = queue.get(timeout=timeout)
+                except Empty:    # Wake up to check deadline/interrupt
+                    continue
+                yield tweet
+        finally:
+            stop.set()
+            self._disconnect()    # Reader may wait for data in recv
+
+    def _read(self, queue, stop):
+        '''
+        Reader thread: connects, parses and reconnects till stop.
+        '''
+        errors = {}    # Backoff: consecutive errors of the kind
+        while not stop.is_set():
+            conn = None
+            try:
+                conn, resp = self._connect()
+                if resp.status == 200:
+                    errors.clear()
+                    for line in self._lines(resp, stop):
+                        metrics.registry.inc('stream_bytes_total', len(line))
+                        tweet = self._parse(line)
+                        if tweet is not None:
+                            metrics.registry.inc('tweets_fetched_total')
+                            self._put(queue, tweet, stop)
+                    kind = NETWORK_BACKOFF    # Closed by server
+                else:
+                    kind = RATE_BACKOFF if resp.status in (420, 429) \
+                        else HTTP_BACKOFF
+                    self._log('stream error: {} {}'.format(resp.status,
+                                                           resp.reason))
+            except (socket.error, httplib.HTTPException, ValueError) as e:
+                self._log('stream connection lost: {!r}'.format(e))
+                kind = NETWORK_BACKOFF
+            finally:
+                if conn is not None:
+                    conn.close()
+
+            if stop.is_set():
+                break
+            first, growth, most = kind
+            count = errors.get(kind, 0)
+            errors[kind] = count + 1
+            if kind is NETWORK_BACKOFF:
+                delay = min(first + growth * count, most)
+            else:
+                delay = min(first * growth ** count, most)
+            self.reconnects += 1
+            metrics.registry.inc('stream_reconnects_total')
+            stop.wait(delay)
+
+    def _connect(self):
+        url = urlparse(self.url)
+        if url.scheme == 'https':
+            conn = httplib.HTTPSConnection(url.netloc,
+                                           timeout=self.stall_timeout)
+        else:
+            conn = httplib.HTTPConnection(url.netloc,
+                                          timeout=self.stall_timeout)
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        if self.signer is not None:
+            headers.update(self.signer('POST', self.url, self.params))
+        conn.request('POST', url.path or '/', urlencode(self.params), headers)
+        self._sock = conn.sock
+        return conn, conn.getresponse(buffering=True)    # Not byte by byte
+
+    def _disconnect(self):
+        sock, self._sock = self._sock, None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    @staticmethod
+    def _lines(resp, stop):
+        '''
+        Generator of lines of response, as soon as every line is complete
+        (chunks are decoded here: httplib reads chunked bodies whole).
+        '''
+        fp = resp.fp
+        if not resp.chunked:
+            while not stop.is_set():
+                line = fp.readline()
+                if not line:
+                    return
+                yield line
+            return
+
+        buf = ''
+        while not stop.is_set():
+            size = fp.readline()
+            if not size:
+                return
+            size = int(size.split(';', 1)[0], 16)
+            if size == 0:    # Last chunk
+                return
+            buf += fp.read(size)
+            fp.read(2)    # CRLF after chunk
+            lines = buf.split('\n')
+            buf = lines.pop()    # Incomplete line
+            for line in lines:
+                yield line
+
+    @staticmethod
+    def _parse(line):
+        '''
+        Tweet of line, None for keep-alive and control messages
+        (delete, limit, warning, ...) and messages without id
+        '''
+        line = line.strip()
+        if not line:
+            return None
+        try:
+            message = loads(line)
+        except ValueError:
+            return None
+        if (not isinstance(message, dict)) or (u'text' not in message) or \
+                (u'id' not in message):
+            return None
+        return Tweet.from_dict(message)
+
+    @staticmethod
+    def _put(queue, tweet, stop):
+        while not stop.is_set():
+            try:
+                queue.put(tweet, timeout=1)    # Blocks: backpressure
+                return
+            except Full:
+                continue
+
+    def _log(self, message):
+        if self.verbose:
+            print(message)
@@ -0,0 +1,433 @@
+# -*- coding: utf-8 -*-
+'''
+Local stub servers of the Twitter API and checks of the clients against
+them: no network, no keys needed.
+
+SearchStub answers search/tweets.json from tweets of the last hours (paging
+by since_id, max_id and count, OR queries, rate-limit headers) and can
+fail the first requests with given statuses, gzip responses, drop
+keep-alive connections silently and answer slowly. StreamStub answers
+statuses/filter.json with chunked newline delimited tweets, keep-alive
+newlines and control messages (some without id), then closes the
+connection.
+
+Usage:
+python stubs.py [check ...]    # All checks by default (see CHECKS)
+'''
+from __future__ import print_function
+
+import gzip
+import json
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+from BaseHTTPServer import BaseHTTPRequestHandler
+from BaseHTTPServer import HTTPServer
+from SocketServer import ThreadingMixIn
+from StringIO import StringIO
+from urlparse import parse_qsl
+from urlparse import urlparse
+
+from collector import BatchCollector
+from fetcher import Fetcher
+from fetcher import PlainClient
+from fetcher import id_from_time
+from stream import TweetStream
+from storage import BinaryStorage
+from synthetic import created_at
+from transport import ConnectionPool
+from transport import Transport
+from twitter_stats import Stats
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    '''
+    HTTP server on a free local port, serving in a daemon thread
+    '''
+    daemon_threads = True
+
+    def __init__(self, handler, path='/'):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), handler)
+        self.url = 'http://127.0.0.1:{}{}'.format(self.server_address[1],
+                                                  path)
+        self.requests = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'    # Keep-alive
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.count('connections')
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, status, body, headers=()):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def stub_tweets(words, count=720, every=10):
+    '''
+    count tweets, one every seconds back from now, words taking turns
+    '''
+    now = time.time()
+    tweets = []
+    for number in range(count):
+        timestamp = now - number * every
+        tweets.append({u'id': id_from_time(timestamp) + number,
+                       u'text': u'{} hello world number {}. http://t.co/x'.format(
+                           words[number % len(words)], number % 7),
+                       u'retweet_count': number % 5,
+                       u'created_at': created_at(timestamp),
+                       u'user': {u'time_zone': [u'Kyiv', u'London',
+                                                None][number % 3]}})
+    return tweets
+
+
+class SearchHandler(StubHandler):
+
+    def do_GET(self):
+        server = self.server
+        server.count('requests')
+        time.sleep(server.delay)
+        if server.failures:
+            status = server.failures.pop(0)
+            self.send_body(status, json.dumps({'errors': []}))
+            return
+        query = dict(parse_qsl(urlparse(self.path).query))
+        terms = [term.lower().decode('utf-8')
+                 for term in query['q'].split(' OR ')]
+        max_id = int(query.get('max_id', 1 << 63))
+        since_id = int(query.get('since_id', 0))
+        statuses = [tweet for tweet in server.tweets
+                    if (since_id < tweet[u'id'] <= max_id) and
+                    any(term in tweet[u'text'].lower() for term in terms)]
+        statuses = statuses[:int(query.get('count', 100))]
+        body = json.dumps({'statuses': statuses})
+        headers = [('x-rate-limit-remaining', '170'),
+                   ('x-rate-limit-reset', str(int(time.time()) + 900))]
+        if server.compress and \
+                ('gzip' in self.headers.get('Accept-Encoding', '')):
+            buf = StringIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+                f.write(body)
+            body = buf.getvalue()
+            headers.append(('Content-Encoding', 'gzip'))
+        self.send_body(200, body, headers)
+        if server.drop_idle:    # Closed as idle, the client is not told
+            self.close_connection = 1
+
+
+class SearchStub(StubServer):
+    '''
+    search/tweets.json of tweets (newest first, see stub_tweets)
+    failures - statuses of the first responses (e.g. [503])
+    compress - gzip responses if the client accepts it
+    drop_idle - close every connection after its response, without
+                Connection: close (stale keep-alive connections)
+    delay - seconds before every response
+    '''
+
+    def __init__(self, tweets, failures=(), compress=False, drop_idle=False,
+                 delay=0):
+        self.tweets = sorted(tweets, key=lambda tweet: -tweet[u'id'])
+        self.failures = list(failures)
+        self.compress = compress
+        self.drop_idle = drop_idle
+        self.delay = delay
+        StubServer.__init__(self, SearchHandler, '/1.1/search/tweets.json')
+
+
+class StreamHandler(StubHandler):
+
+    def do_POST(self):
+        server = self.server
+        server.count('requests')
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        lines = []
+        for _ in range(server.per_connection):
+            with server._lock:
+                server.sent += 1
+                number = server.sent
+            lines.append(json.dumps({u'id': number,
+                                     u'text': u'python tweet {} café'.format(
+                                         number),
+                                     u'retweet_count': 0,
+                                     u'user': {u'time_zone': u'Kyiv'}}))
+            if number % 7 == 0:    # Control messages and keep-alive
+                lines.append(json.dumps({u'delete': {u'status': {u'id': 1}}}))
+                lines.append(json.dumps({u'text': u'no id'}))
+                lines.append('')
+        data = '\r\n'.join(lines) + '\r\n'
+        step = 333    # Chunks split lines at odd places
+        for start in range(0, len(data), step):
+            part = data[start:start + step]
+            self.wfile.write('{:x}\r\n{}\r\n'.format(len(part), part))
+            self.wfile.flush()
+        self.wfile.write('0\r\n\r\n')    # Closed by server: reconnect
+        self.close_connection = 1
+
+
+class StreamStub(StubServer):
+    '''
+    statuses/filter.json: per_connection tweets (ids 1, 2, ...) a connection
+    '''
+
+    def __init__(self, per_connection=300):
+        self.per_connection = per_connection
+        self.sent = 0
+        StubServer.__init__(self, StreamHandler, '/1.1/statuses/filter.json')
+
+
+def expect(condition, message, *args):
+    if not condition:
+        raise AssertionError(message.format(*args))
+
+
+def check_fetcher():
+    '''
+    Fetcher: all tweets of a query once, none older than since_id
+    '''
+    tweets = stub_tweets([u'python', u'java'])
+    server = SearchStub(tweets)
+    try:
+        fetcher = Fetcher(PlainClient, search_url=server.url, verbose=False)
+        got = list(fetcher.tweets('python', 'en', 10))
+        ids = [tweet['id'] for tweet in got]
+        expect(len(ids) == len(set(ids)) == len(tweets) // 2,
+               '{} tweets ({} unique) of {}', len(ids), len(set(ids)),
+               len(tweets) // 2)
+
+        since_id = sorted(ids)[-50]
+        newer = list(fetcher.tweets('python', 'en', 10, since_id=since_id))
+        expect(len(newer) == 49, '{} tweets newer than since_id, 49 expected',
+               len(newer))
+    finally:
+        server.close()
+
+
+def check_fetcher_errors():
+    '''
+    Fetcher: slices failed by 5xx are fetched again, no tweets lost
+    '''
+    tweets = stub_tweets([u'python'], count=300)
+    server = SearchStub(tweets, failures=[503, 500])
+    try:
+        fetcher = Fetcher(PlainClient, search_url=server.url, verbose=False)
+        got = list(fetcher.tweets('python', 'en', 10))
+        expect(len(got) == len(tweets), '{} tweets of {}', len(got),
+               len(tweets))
+    finally:
+        server.close()
+
+
+def check_batch():
+    '''
+    BatchCollector: tweets are added to saved stats of every keyword, none
+    is counted twice (since_id, saved ids); "javascript" tweets the stub
+    gives for "java" go to no keyword
+    '''
+    tweets = stub_tweets([u'python', u'java', u'javascript'])
+    server = SearchStub(tweets[200:])
+    directory = tempfile.mkdtemp()
+    storage = BinaryStorage(directory)
+
+    def expected(part):
+        words = [tweet[u'text'].split()[0] for tweet in part]
+        return [words.count(word) for word in (u'python', u'java')]
+
+    def collect(since_ids=None):
+        stats_list = [Stats(word, storage=storage)
+                      for word in ('python', 'java')]
+        collector = BatchCollector(stats_list, combine=2,
+                                   client_factory=PlainClient,
+                                   search_url=server.url, verbose=False)
+        collector.collect(10, since_ids)
+        for stats in stats_list:
+            stats.save()
+        return ([stats.tweets_count for stats in stats_list],
+                [stats._acc.tweets_count for stats in stats_list],
+                collector.unmatched)
+
+    try:
+        first = expected(tweets[200:])
+        javascript = len(tweets[200:]) - sum(first)
+        counts = collect()
+        expect(counts == (first, first, javascript), 'first run: {}, {} '
+               'expected', counts, (first, first, javascript))
+        server.tweets = tweets[:300]    # Older tweets are out of search
+        second = expected(tweets[:200])
+        total = [a + b for a, b in zip(first, second)]
+        counts = collect()
+        expect(counts[:2] == (second, total), 'second run: {}, {} expected',
+               counts, (second, total))
+        counts = collect(since_ids={})    # Saved ids only
+        expect(counts[:2] == ([0, 0], total), 'third run: {}', counts)
+    finally:
+        server.close()
+        shutil.rmtree(directory)
+
+
+def check_gaps():
+    '''
+    BatchCollector: ranges a walk did not reach before the deadline are
+    fetched by the next run, since_id moves to the newest tweet meanwhile
+    (no dedup: ranges alone keep tweets from being counted twice)
+    '''
+    tweets = stub_tweets([u'python'])
+    server = SearchStub(tweets, delay=0.1)
+    directory = tempfile.mkdtemp()
+    storage = BinaryStorage(directory)
+
+    def collect(time_interval):
+        stats = Stats('python', storage=storage, dedup=False)
+        BatchCollector([stats], workers=1, client_factory=PlainClient,
+                       search_url=server.url, verbose=False).collect(
+                           time_interval)
+        stats.save()
+        return stats._acc
+
+    try:
+        acc = collect(0.35)
+        expect(0 < acc.tweets_count < len(tweets), 'first run: {} tweets',
+               acc.tweets_count)
+        expect(acc.since_id == tweets[0][u'id'], 'since_id {} of {}',
+               acc.since_id, tweets[0][u'id'])
+        expect(acc.gaps, 'no gaps after the deadline')
+        acc = collect(30)
+        expect(acc.tweets_count == len(tweets), 'second run: {} tweets of {}',
+               acc.tweets_count, len(tweets))
+        expect(not acc.gaps, 'gaps left: {}', acc.gaps)
+    finally:
+        server.close()
+        shutil.rmtree(directory)
+
+
+def check_stream():
+    '''
+    TweetStream: tweets of chunked responses in order, control messages and
+    messages without id skipped, reconnect after the server closes the
+    stream
+    '''
+    server = StreamStub()
+    try:
+        stream = TweetStream('python', 'en', url=server.url, verbose=False)
+        tweets = stream.tweets(duration=30)
+        got = [tweet for _, tweet in zip(range(500), tweets)]
+        tweets.close()
+        ids = [tweet['id'] for tweet in got]
+        expect(ids == range(1, 501), 'ids {}..{} ({} tweets)',
+               ids[:1], ids[-1:], len(ids))
+        expect(got[-1]['text'] == u'python tweet 500 café', 'text {!r}',
+               got[-1]['text'])
+        expect(stream.reconnects >= 1, 'no reconnect')
+    finally:
+        server.close()
+
+
+def check_transport():
+    '''
+    Transport: one keep-alive connection for sequential requests, gzip
+    decoded, 5xx retried, stale connections replaced, Fetcher over it
+    '''
+    tweets = stub_tweets([u'python'], count=300)
+    server = SearchStub(tweets, failures=[503, 502], compress=True)
+    pool = ConnectionPool()
+    try:
+        client = Transport(pool=pool)
+        resp, content = client.request(server.url + '?q=python&count=100')
+        expect(resp['status'] == '200', 'status {} after retries',
+               resp['status'])
+        expect(server.requests == 3, '{} requests, 3 expected',
+               server.requests)
+        expect(resp.get('-content-encoding') == 'gzip', 'not gzipped: {}',
+               resp)
+        statuses = json.loads(content)['statuses']
+        expect(len(statuses) == 100, '{} statuses decoded', len(statuses))
+
+        for _ in range(20):
+            client.request(server.url + '?q=python&count=1')
+        expect(server.connections == 1, '{} connections for 23 requests',
+               server.connections)
+
+        server.drop_idle = True
+        client.retries = 0    # Resent on a new connection, not retried
+        for _ in range(5):
+            resp, _ = client.request(server.url + '?q=python&count=1')
+            expect(resp['status'] == '200', 'status {} on stale connection',
+                   resp['status'])
+
+        server.drop_idle = False
+        pool.clear()
+        server.connections = 0
+        fetcher = Fetcher(lambda: Transport(pool=pool),
+                          search_url=server.url, verbose=False)
+        got = list(fetcher.tweets('python', 'en', 10))
+        expect(len(got) == len(tweets), '{} tweets of {}', len(got),
+               len(tweets))
+        expect(server.connections <= fetcher.workers,
+               '{} connections for {} workers', server.connections,
+               fetcher.workers)
+    finally:
+        pool.clear()    # Handler threads wait on idle connections
+        server.close()
+
+
+CHECKS = [('fetcher', check_fetcher),
+          ('fetcher_errors', check_fetcher_errors),
+          ('batch', check_batch),
+          ('gaps', check_gaps),
+          ('stream', check_stream),
+          ('transport', check_transport)]
+
+
+def main(argv=None, checks=CHECKS):
+    names = (argv if argv is not None else sys.argv[1:]) or \
+        [name for name, _ in checks]
+    checks = dict(checks)
+    failed = 0
+    for name in names:
+        if name not in checks:
+            print('{:<16} unknown check'.format(name))
+            failed += 1
+            continue
+        start = time.time()
+        try:
+            checks[name]()
+        except Exception:
+            failed += 1
+            print('{:<16} FAILED'.format(name))
+            traceback.print_exc()
+        else:
+            print('{:<16} ok ({:.2f} sec)'.format(name, time.time() - start))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+'''
+Deterministic synthetic tweets for benchmarks and offline runs.
+
+Tweets have the shape Stats._get_tweets yields (id, created_at, text,
+retweet_count, user.time_zone). Words are drawn from a vocabulary of given
+size with Zipf distributed frequencies, so counters grow like real ones.
+The same seed always gives the same tweets.
+
+Usage (JSON-lines to stdout, see corpus.py):
+python synthetic.py <tweets> [vocabulary] [skew] [seed]
+'''
+from __future__ import division
+
+import json
+import random
+import sys
+import time
+
+from bisect import bisect_right
+
+from fetcher import TWEPOCH
+
+
+SYLLABLES = [u'ka', u'lo', u'mi', u'ne', u'ru', u'sa', u'to', u'vi', u'da',
+             u'pe', u'gu', u'zo', u'ter', u'ing', u'an', u'es', u'or', u'th']
+DECOR = [u'', u'', u'', u'', u',', u'.', u'!', u'?', u'...', u'…', u'"']
+ZONES = [u'Kyiv', u'London', u'Pacific Time (US & Canada)', u'Berlin',
+         u'Tokyo', u'Eastern Time (US & Canada)', u'Moscow', u'Madrid', None]
+START = 1420070400    # created_at of the first tweet (2015-01-01)
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+          'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+DAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+
+
+def created_at(timestamp):
+    '''
+    Twitter date format: 'Wed Aug 27 13:08:45 +0000 2008'
+    '''
+    t = time.gmtime(timestamp)
+    return '{} {} {:02d} {:02d}:{:02d}:{:02d} +0000 {}'.format(
+        DAYS[t.tm_wday], MONTHS[t.tm_mon - 1], t.tm_mday, t.tm_hour,
+        t.tm_min, t.tm_sec, t.tm_year)
+
+
+class TweetGenerator(object):
+    '''
+    vocabulary - number of distinct words
+    skew - Zipf exponent (1 - natural language, higher - fewer hot words)
+    seed - random seed (same seed - same tweets)
+    words - (min, max) words per tweet
+    rate - tweets per second (created_at and Snowflake ids step)
+    '''
+
+    def __init__(self, vocabulary=10000, skew=1.1, seed=1, words=(5, 25),
+                 rate=10):
+        self.vocabulary = vocabulary
+        self.skew = skew
+        self.seed = seed
+        self.words = words
+        self.rate = rate
+
+        rnd = random.Random(seed)
+        self._words = self._make_words(vocabulary, rnd)
+        total = 0.0
+        self._cumulative = []    # Zipf weights 1/rank^skew, summed
+        for rank in range(1, vocabulary + 1):
+            total += 1.0 / rank ** skew
+            self._cumulative.append(total)
+
+    def tweets(self, count, start=0):
+        '''
+        Generator of count tweets, from number start
+        '''
+        rnd = random.Random(self.seed * 1000003 + start)
+        for number in range(start, start + count):
+            yield self._tweet(number, rnd)
+
+    def _tweet(self, number, rnd):
+        timestamp = START + number / self.rate
+        tweet_id = ((int(timestamp * 1000) - TWEPOCH) << 22) + number % 4096
+        total = self._cumulative[-1]
+        words = self._words
+        cumulative = self._cumulative
+        parts = []
+        for _ in range(rnd.randint(*self.words)):
+            roll = rnd.random()
+            if roll < 0.04:
+                parts.append(u'https://t.co/{:x}'.format(rnd.getrandbits(32)))
+            elif roll < 0.08:
+                parts.append(u'@user{}'.format(rnd.randint(0, 999)))
+            elif roll < 0.1:
+                parts.append(u'#{}'.format(
+                    words[bisect_right(cumulative, rnd.random() * total)]))
+            else:
+                word = words[bisect_right(cumulative, rnd.random() * total)]
+                if roll > 0.97:
+                    word = word.capitalize()
+                parts.append(word + rnd.choice(DECOR))
+        return {u'id': tweet_id,
+                u'created_at': created_at(timestamp),
+                u'text': u' '.join(parts),
+                u'retweet_count': int(rnd.paretovariate(1.5)) - 1,
+                u'user': {u'time_zone': rnd.choice(ZONES)}}
+
+    @staticmethod
+    def _make_words(vocabulary, rnd):
+        '''
+        vocabulary distinct pseudo words, short ones more frequent
+        '''
+        words = []
+        seen = set()
+        while len(words) < vocabulary:
+            syllables = 1 + min(int(rnd.expovariate(0.7)), 6)
+            word = u''.join(rnd.choice(SYLLABLES) for _ in range(syllables))
+            if word not in seen:
+                seen.add(word)
+                words.append(word)
+        return words
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    args = sys.argv[1:]
+    generator = TweetGenerator(
+        vocabulary=int(args[1]) if len(args) > 1 else 10000,
+        skew=float(args[2]) if len(args) > 2 else 1.1,
+        seed=int(args[3]) if len(args) > 3 else 1)
+    for tweet in generator.tweets(int(args[0])):
+        sys.stdout.write(json.dumps(tweet))
+        sys.stdout.write('\n')
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+'''
+Single pass tokenizer of tweets text.
+
+One precompiled regex splits text by any white space, skips URLs, keeps
+@mentions and #hashtags whole and strips Unicode punctuation and digits
+around words.
+'''
+
+import re
+
+from exclude import EXCLUDE_SET
+
+
+APOSTROPHES = u'\'’'
+
+# Word starts and ends with a letter, apostrophes/hyphens/digits inside
+WORD = r'[^\W\d_](?:[\w' + APOSTROPHES + r'-]*[^\W\d_])?'
+URL = r'(?:https?://|www\.)\S*'
+TAG = r'[@#]\w+'    # @mention or #hashtag
+
+# URLs match without group, so findall() gives '' for them
+TOKEN_RE = re.compile(u'{}|({}|{})'.format(URL, TAG, WORD), re.UNICODE)
+
+
+def tokenize(text, exclude=EXCLUDE_SET):
+    '''
+    List of lowercase words of text without URLs and excluded words.
+    '''
+    return [word for word in TOKEN_RE.findall(text.lower())
+            if word and not word in exclude]
+
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+'''
+Streaming top-k structures for word counters.
+
+TopK - exact k most frequent words, kept up to date as counts grow.
+SpaceSaving - bounded memory heavy-hitters counter (Metwally et al.),
+              used instead of Counter for huge vocabularies.
+'''
+
+import heapq
+
+from operator import itemgetter
+
+
+class TopK(object):
+    '''
+    k items with the biggest counts.
+
+    offer() has to be called with the new count every time the count of an
+    item grows. Items outside of top are never bigger (by (count, item)) than
+    the smallest one inside it, so the result is exact and does not depend on
+    the order of offers.
+    '''
+
+    def __init__(self, k=30):
+        self.k = k
+        self._top = {}
+        self._min = None    # (count, item) of smallest in top, None - unknown
+
+    def __len__(self):
+        return len(self._top)
+
+    def __contains__(self, item):
+        return item in self._top
+
+    def offer(self, item, count):
+        top = self._top
+        if item in top:
+            top[item] = count
+            if (self._min is not None) and (self._min[1] == item):
+                self._min = None
+        elif len(top) < self.k:
+            top[item] = count
+            self._min = None
+        elif (count, item) > self._lowest():
+            del top[self._min[1]]
+            top[item] = count
+            self._min = None
+
+    def discard(self, item):
+        if self._top.pop(item, None) is not None:
+            self._min = None
+
+    def rebuild(self, counter):
+        '''
+        Top of the whole counter (after loading or bulk changes).
+        '''
+        self._top = dict(heapq.nlargest(self.k, counter.items(),
+                                        key=lambda x: (x[1], x[0])))
+        self._min = None
+
+    def load(self, items):
+        '''
+        Restores top from items() result.
+        '''
+        self._top = dict((item, count) for item, count in items[:self.k])
+        self._min = None
+
+    def items(self):
+        '''
+        [(item, count), ...] from the most frequent
+        '''
+        return sorted(self._top.items(), key=lambda x: (x[1], x[0]),
+                      reverse=True)
+
+    def words(self):
+        return [item for item, _ in self.items()]
+
+    def _lowest(self):
+        if self._min is None:
+            self._min = min((count, item) for item, count in self._top.items())
+        return self._min
+
+
+class SpaceSaving(dict):
+    '''
+    Counter of at most capacity items.
+
+    When it is full, a new item replaces the least frequent one and inherits
+    its count (+ new occurrences), so counts of frequent items are never
+    underestimated. errors[item] - max overestimation of item count.
+
+    on_evict - callback(item) for evicted items
+    '''
+
+    def __init__(self, capacity, iterable=None, on_evict=None):
+        super(SpaceSaving, self).__init__()
+        self.capacity = capacity
+        self.errors = {}
+        self.on_evict = on_evict
+        self._heap = []    # (count, item), lazy: stale entries are skipped
+        if iterable is not None:
+            self.update(iterable)
+
+    def __missing__(self, item):
+        return 0
+
+    def update(self, iterable=None, **kwargs):
+        '''
+        Like Counter.update: iterable of items or mapping of item:count
+        '''
+        if iterable is None:
+            iterable = kwargs
+        if hasattr(iterable, 'items'):
+            pairs = iterable.items()
+        else:
+            pairs = ((item, 1) for item in iterable)
+
+        for item, count in pairs:
+            if item in self:
+                new = dict.__getitem__(self, item) + count
+            elif len(self) < self.capacity:
+                new = count
+                self.errors[item] = 0
+            else:
+                low_count, low_item = self._pop_min()
+                new = low_count + count
+                self.errors[item] = low_count
+                if self.on_evict is not None:
+                    self.on_evict(low_item)
+            dict.__setitem__(self, item, new)
+            heapq.heappush(self._heap, (new, item))
+
+        if len(self._heap) > 4 * self.capacity + 64:    # Drop stale entries
+            self._heap = [(count, item) for item, count in self.items()]
+            heapq.heapify(self._heap)
+
+    def most_common(self, n=None):
+        if n is None:
+            return sorted(self.items(), key=itemgetter(1), reverse=True)
+        return heapq.nlargest(n, self.items(), key=itemgetter(1))
+
+    def _pop_min(self):
+        heap = self._heap
+        while True:
+            count, item = heapq.heappop(heap)
+            if dict.get(self, item) == count:    # Entry is not stale
+                dict.__delitem__(self, item)
+                self.errors.pop(item, None)
+                return count, item
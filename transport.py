@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+'''
+HTTP transport of the API clients: keep-alive connections pooled by host and
+shared by all clients (one TLS handshake per connection, not per request),
+gzip transfer decoded as the body is read, timeouts and retries with
+jittered exponential backoff.
+
+Transport.request() has the interface of oauth2.Client.request():
+resp, content = client.request(url)
+resp - dict of lowercase headers and 'status' (string), content - body
+'''
+
+import httplib
+import random
+import socket
+import threading
+import time
+import zlib
+
+from urlparse import parse_qsl
+from urlparse import urlparse
+
+import metrics
+
+
+TIMEOUT = 30    # Seconds of connect and of every read
+RETRIES = 3    # Repeats of a failed request (network error, RETRY_STATUSES)
+BACKOFF = 0.5    # First retry delay (doubles, random part of it is slept)
+MAX_BACKOFF = 8
+RETRY_STATUSES = ('500', '502', '503', '504')
+IDEMPOTENT = ('GET', 'HEAD')    # Only these are repeated
+MAX_IDLE = 8    # Idle connections kept per host
+CHUNK = 16 * 1024    # Bytes read (and decompressed) at once
+
+CONNECTIONS = {'http': httplib.HTTPConnection,
+               'https': httplib.HTTPSConnection}
+
+
+class ConnectionPool(object):
+    '''
+    Idle keep-alive connections by (scheme, host, port). Thread safe: a
+    connection is used by one request at a time, then returned.
+    '''
+
+    def __init__(self, max_idle=MAX_IDLE):
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, timeout=TIMEOUT):
+        '''
+        (connection, reused) for key, a new one if none is idle
+        '''
+        with self._lock:
+            idle = self._idle.get(key)
+            conn = idle.pop() if idle else None
+        if conn is not None:
+            conn.timeout = timeout    # Timeout of the client taking it
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            return conn, True
+        scheme, host, port = key
+        metrics.registry.inc('http_connections_total', scheme=scheme)
+        return CONNECTIONS[scheme](host, port, timeout=timeout), False
+
+    def put(self, key, conn):
+        '''
+        Returns connection with the response read to the end
+        '''
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def clear(self, key=None):
+        '''
+        Closes idle connections to key (all if None)
+        '''
+        with self._lock:
+            if key is None:
+                closing, self._idle = self._idle.values(), {}
+            else:
+                closing = [self._idle.pop(key, [])]
+        for conns in closing:
+            for conn in conns:
+                conn.close()
+
+
+default_pool = ConnectionPool()    # Shared by all transports
+
+
+def backoff_delay(attempt, first=BACKOFF, most=MAX_BACKOFF):
+    '''
+    Seconds before retry number attempt (0 - the first): random part of
+    exponential delay ("full jitter"), so clients do not retry in step
+    '''
+    return random.uniform(0, min(first * 2 ** attempt, most))
+
+
+class Transport(object):
+    '''
+    Client with oauth2.Client.request() interface over pooled connections.
+
+    signer - signer(method, url, params) -> auth headers
+             (stream.oauth_signer), None - unsigned (local stub servers)
+    pool - ConnectionPool (the shared one by default)
+    compress - ask for gzip transfer
+    '''
+
+    def __init__(self, signer=None, pool=None, timeout=TIMEOUT,
+                 retries=RETRIES, compress=True):
+        self.signer = signer
+        self.pool = pool or default_pool
+        self.timeout = timeout
+        self.retries = retries
+        self.compress = compress
+
+    def request(self, url, method='GET', body=None, headers=None):
+        '''
+        (resp, content) of url. Network errors and RETRY_STATUSES of GET
+        requests are retried; the last error is raised / response returned.
+        '''
+        parts = urlparse(url)
+        key = (parts.scheme, parts.hostname,
+               parts.port or (443 if parts.scheme == 'https' else 80))
+        path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+        retries = self.retries if method in IDEMPOTENT else 0
+
+        attempt = 0
+        while True:
+            send_headers = self._headers(method, parts, body, headers)
+            try:
+                resp, content = self._send(key, method, path, body,
+                                           send_headers, method in IDEMPOTENT)
+            except (socket.error, httplib.HTTPException) as e:
+                if attempt >= retries:
+                    raise
+                reason = type(e).__name__
+            else:
+                if (resp['status'] not in RETRY_STATUSES) or \
+                        (attempt >= retries):
+                    return resp, content
+                reason = resp['status']
+            metrics.registry.inc('http_retries_total', reason=reason)
+            time.sleep(backoff_delay(attempt))
+            attempt += 1
+
+    def _headers(self, method, parts, body, headers):
+        '''
+        Headers of one attempt (signed anew: OAuth nonce and timestamp)
+        '''
+        headers = dict(headers or {})
+        if self.compress:
+            headers.setdefault('Accept-Encoding', 'gzip')
+        if self.signer is not None:
+            params = dict(parse_qsl(parts.query))
+            if body and (method == 'POST'):    # Form parameters are signed
+                params.update(parse_qsl(body))
+            base_url = '{}://{}{}'.format(parts.scheme, parts.netloc,
+                                          parts.path)
+            headers.update(self.signer(method, base_url, params))
+        return headers
+
+    def _send(self, key, method, path, body, headers, repeatable):
+        conn, reused = self.pool.get(key, self.timeout)
+        try:
+            conn.request(method, path, body, headers)
+            response = conn.getresponse()
+            content = self._read(response)
+        except (socket.error, httplib.HTTPException):
+            conn.close()
+            if reused and repeatable:    # Server closed idle connections
+                self.pool.clear(key)
+                return self._send(key, method, path, body, headers, False)
+            raise
+
+        if response.will_close:
+            conn.close()
+        else:
+            self.pool.put(key, conn)
+        resp = dict((k.lower(), v) for k, v in response.getheaders())
+        resp['status'] = str(response.status)
+        if 'content-encoding' in resp:    # Decoded already (like httplib2)
+            resp['-content-encoding'] = resp.pop('content-encoding')
+        return resp, content
+
+    @staticmethod
+    def _read(response):
+        '''
+        Whole body, gzip decompressed chunk by chunk as it arrives
+        '''
+        encoding = (response.getheader('content-encoding') or '').lower()
+        decoder = zlib.decompressobj(16 + zlib.MAX_WBITS) \
+            if encoding == 'gzip' else None
+        chunks = []
+        wire = 0
+        while True:
+            chunk = response.read(CHUNK)
+            if not chunk:
+                break
+            wire += len(chunk)
+            chunks.append(decoder.decompress(chunk) if decoder else chunk)
+        if decoder is not None:
+            chunks.append(decoder.flush())
+        metrics.registry.inc('http_wire_bytes_total', wire)
+        return ''.join(chunks)
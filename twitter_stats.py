@@ -12,23 +12,32 @@ import os
 import json
 import time
 import sys
+import threading
 
-from base64 import b64encode
-from base64 import b64decode
-from collections import Counter
 from getpass import getpass
-
-import oauth2
-
-from auth_info import *
-# File auth_info.py has to be in the same dir. Content:
-#CONSUMER_KEY = <key>
-#CONSUMER_SECRET = <secret>
-#ACCESS_TOKEN = <token>
-#ACCESS_TOKEN_SECRET = <token secret>
-
-from exclude import EXCLUDE_SET
-from languages import languages
+from itertools import chain
+from tempfile import mkstemp
+from timeit import default_timer as timer
+
+import metrics
+from accumulator import StatsAccumulator
+from accumulator import batches
+from archive import TweetArchive
+from dedup import IdSet
+from dedup import load_ids
+from dedup import save_ids
+from fetcher import Fetcher
+from fetcher import SEARCH_DEPTH
+from fetcher import id_from_time
+from fetcher import unwalked
+from profiling import profiled_method
+from storage import BinaryStorage
+from storage import caesar_decrypt
+from storage import caesar_encrypt
+from stream import TweetStream
+from stream import oauth_signer
+from tokenizer import tokenize
+from transport import Transport
 
 WORK_DIR = os.getcwd()
 
@@ -52,6 +61,7 @@ class User(object):
     It also applies DECORATOR user_stats to Stats on creation to change its 
     behavior according to users TOKEN (rights).
     '''
+    _rights_cache = None    # (user file (mtime, size), (rights, users))
 
     def __init__(self, user, pwd):
 
@@ -83,23 +93,71 @@ class User(object):
     def __rights(self):
         '''
         Returns dict of token:user_rights ({'user_token':'admin'})
+        Cached till the user file changes (mtime, size). Do not modify it.
+        '''
+        return self._load_rights()[0]
+
+    @property
+    def __users(self):
+        '''
+        Returns dict of name:(token, password, user_rights)
         '''
+        return self._load_rights()[1]
+
+    @classmethod
+    def _load_rights(cls):
+        '''
+        Reads and decrypts user file only if it changed since the last read
+        '''
+        path = '{}/user'.format(WORK_DIR)
         try:
-            with open('{}/user'.format(WORK_DIR), 'r') as f:
+            info = os.stat(path)
+            stamp = (info.st_mtime, info.st_size)
+        except OSError:
+            stamp = None
+        if (cls._rights_cache is not None) and (cls._rights_cache[0] == stamp):
+            return cls._rights_cache[1]
+
+        rights = {}
+        try:
+            with open(path, 'r') as f:
                 encrypted_str = f.read()
             decrypted_str = Stats._decrypt(encrypted_str)    # Decodes string
             reconst_dict = json.loads(decrypted_str)     # Reconstructs original DICT
 
             if isinstance(reconst_dict, dict):
-                return reconst_dict
+                rights = reconst_dict
 
         except IOError:
             print('No user file.\n')
-            return ''
+
+        users = {}
+        for token, access in rights.items():
+            name, pwd = Stats._decrypt(token).split(':', 1)
+            users[name] = (token, pwd, access)
+        cls._rights_cache = (stamp, (rights, users))
+        return rights, users
+
+    @classmethod
+    def _write_rights(cls, rights_dict):
+        '''
+        Encrypts rights and replaces user file atomically (temp file + rename)
+        '''
+        path = '{}/user'.format(WORK_DIR)
+        fd, tmp_path = mkstemp(dir=WORK_DIR, prefix='.user.')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                data_to_write = json.dumps(rights_dict)
+                f.write( Stats._encrypt(data_to_write) )
+            os.rename(tmp_path, path)
+        except:
+            os.remove(tmp_path)
+            raise
+        finally:
+            cls._rights_cache = None    # Invalidate cache
 
     def _get_access(self):
-        if self._token in self.__rights:
-            return self.__rights[self._token]
+        return self.__rights.get(self._token)
 
     @only_for_admin
     def set_user(self):
@@ -111,33 +169,26 @@ class User(object):
         access = self.choose(self.__def_rights)
         print('new user credentials: {}:{}'.format(token, access))
 
-        rights_dict = self.__rights
+        rights_dict = dict(self.__rights)
+        if user_name in self.__users:    # Old password of the user
+            rights_dict.pop(self.__users[user_name][0], None)
         rights_dict.update({token:access})
         if len(rights_dict) > 0:
-            with open('{}/user'.format(WORK_DIR), 'w+') as f:        
-                data_to_write = json.dumps(rights_dict)
-                f.write( Stats._encrypt(data_to_write) )
+            self._write_rights(rights_dict)
 
     @only_for_admin
     def del_user(self):
-        name_lst, pwd_lst = self.show_users()
-        rights_dict = self.__rights
+        self.show_users()
+        rights_dict = dict(self.__rights)
         try:
             user_name = raw_input('user name: ')
-            if user_name in name_lst:                
-                user_token = self._gen_token( \
-                    user_name, pwd_lst[ name_lst.index(user_name) ] )
-                if user_token in rights_dict:
-                    rights_dict.pop(user_token)            
-                else:
-                    raise KeyError
+            user_token = self.__users[user_name][0]
+            rights_dict.pop(user_token)
         except KeyError:
             print('no such user')
         else:
-            print(self.__rights)
-            with open('{}/user'.format(WORK_DIR), 'w+') as f:        
-                data_to_write = json.dumps(rights_dict)
-                f.write( Stats._encrypt(data_to_write) )           
+            print(rights_dict)
+            self._write_rights(rights_dict)
 
 
     @only_for_admin
@@ -150,10 +201,8 @@ class User(object):
         pwd_lst = []
         print('existing users:\n'
               'ACCESS : NAME : PASSWORD')
-        for token, access in self.__rights.items():
-            name = Stats._decrypt(token).split(':')[0]
+        for name, (token, pwd, access) in sorted(self.__users.items()):
             name_lst.append(name)
-            pwd = Stats._decrypt(token).split(':')[1]
             pwd_lst.append(pwd)
             print('{} : {} : {}'.format(access, name, pwd))
         return name_lst, pwd_lst
@@ -182,9 +231,10 @@ def user_stats(cls, access):
 
     '''
     # User can NOT save stats
-    NOT_USER_ATTRS = {'refresh', 'save'}
+    NOT_USER_ATTRS = {'refresh', 'save', 'stream'}
     # Guest can do almost nothing, only view =)
-    NOT_GUEST_ATTRS = {'refresh', '_decrypt', '_encrypt', 'get', 'save'}
+    NOT_GUEST_ATTRS = {'refresh', '_decrypt', '_encrypt', 'get', 'save',
+                       'stream'}
 
     
     class UserStats(cls):
@@ -223,69 +273,163 @@ class Stats(object):
     word - word for query
     time - period to get as much tweets as it can.
     tweet_language - language of tweets
+    workers - search requests kept in flight
+    top_k - number of the most frequent words (sentence)
+    uniques_capacity - bound uniques size (heavy-hitters), None - exact
+    batch_size - tweets aggregated at once (1 - tweet by tweet)
+    archive - keep raw fetched tweets in WORK_DIR/archive (see replay)
+    storage - stats files backend (storage.BinaryStorage by default,
+              encrypted if TWITTER_STATS_KEY environment variable is set)
+    windows - windows.BucketedStats to keep time-bucketed stats in (trending)
+    limiter - fetcher.RateLimiter shared with other instances (daemon)
+    dedup - keep ids of counted tweets next to stats file (<word>.ids), so
+            no tweet is counted twice across runs: True - exact
+            (dedup.IdSet), dedup.BloomFilter instance - approximate with
+            fixed memory, False - within one run only
+    compact - keep uniques and origin as vocab.CompactCounter (tokens
+              interned once per process): more keywords fit in memory
+    distinct - keep HyperLogLog sketch of words, saved with stats: distinct
+               words over keywords in constant memory (storage.distinct)
     '''
+    _client = None    # API client shared by all instances (see client)
+    _client_lock = threading.Lock()
 
-    def __init__(self, word, time_interval=30, tweet_language='en'):
+    def __init__(self, word, time_interval=30, tweet_language='en', workers=4,
+                 top_k=30, uniques_capacity=None, batch_size=100,
+                 archive=False, storage=None, windows=None, limiter=None,
+                 dedup=True, compact=False, distinct=False):
         self.word = word
+        self.limiter = limiter
+        self.dedup = dedup
+        self._seen = None    # Ids of counted tweets (loaded on first fetch)
+        self.windows = windows
+        self.storage = storage or self.default_storage()
+        self.batch_size = batch_size
+        self.archive = archive
+        self.workers = workers
+        self.top_k = top_k
+        self.uniques_capacity = uniques_capacity
+        self.compact = compact
+        self.distinct = distinct
 
         self.tweets_count = 0
-        # Create Twitter API client instance
-        self.client = self.set_client()
 
         self.time_interval = time_interval
         self.lang = tweet_language
-        self._stats = { 'uniques': Counter(), 'letters_per_word': Counter(),
-                        'origin': Counter(), 'global_retweets':0, 
-                        'global_length':0, 'global_words_count':1, 
-                        'global_sentences':0, 'unique_30_most':[] }
+        # Raw sums and counters (mergeable) and derived stats
+        self._acc = StatsAccumulator(top_k, uniques_capacity, compact,
+                                     distinct)
+        self._stats = self._acc.views()
 
     @property
     def sentence(self):
         '''
-        Generates human readable sentence of 30 words (generalization of tweets)
+        Generates human readable sentence of top_k words (generalization of tweets)
         '''
-        return ' '.join(self._stats['unique_30_most'])
+        return ' '.join(self._stats['unique_most'])
 
     @property
     def uniques(self):
         '''
         Property to make class interface user friendly
         '''
-        return self._stats['uniques']
+        return self._acc.uniques
 
     @property
     def letters_per_word(self):
         '''
         Property to make class interface user friendly
         '''
-        return self._stats['letters_per_word']
+        return self._acc.letters_view()
 
     @property
     def origin(self):
         '''
         Where are tweets from (time zone)
         '''
-        return self._stats['origin']
+        return self._acc.origin
+
+    @property
+    def since_id(self):
+        '''
+        Id of the newest tweet in stats
+        '''
+        return self._acc.since_id
 
+    @profiled_method('get')
     def get(self):
         '''
         Load tweets from file if it exists or runs get NEW stats otherwise. 
         DIDN'T SAVE THE RESULTS! (self.save() - required)
         '''
-        path = '{}/stats/{}.data'.format(WORK_DIR, self.word) 
-        if not os.path.isfile(path):    # Check if FILE exist
+        if not self.storage.exists(self.word):    # Check if FILE exist
             self._gen_stats(self._get_tweets())
         else:
             self.load()
 
+    @profiled_method('refresh')
     def refresh(self):
         '''
-        Get new Tweets and generate new stats for current word. 
-        Saves this to file.
+        Get Tweets newer than the ones already counted and add them to stats
+        of current word. Saves this to file.
         '''
-        self._gen_stats(self._get_tweets())
+        self._load_saved()
+        self._gen_stats(self._get_tweets(since_id=self._acc.since_id,
+                                         gaps=self._acc.gaps))
         self.save()
 
+    @profiled_method('stream')
+    def stream(self, duration=None):
+        '''
+        Adds tweets of current word from the streaming API as they come,
+        during duration seconds or till Ctrl+C. Saves this to file.
+        '''
+        self._load_saved()
+        self._gen_stats(self._stream_tweets(duration))
+        self.save()
+
+    def merge(self, other):
+        '''
+        Adds stats of other Stats instance (e.g. loaded from another file)
+        '''
+        self._acc.merge(other._acc)
+        self._finalize()
+
+    def trending(self, seconds=3600, k=10):
+        '''
+        Prints words which frequency grew the most in the last seconds
+        compared to the previous seconds (Stats(word, windows=...) required)
+        '''
+        if self.windows is None:
+            print('no time windows for {}'.format(self.word))
+            return
+        print('Trending by word: {}'.format(self.word.upper()))
+        for word, count, before in self.windows.trending(seconds, k):
+            print(u'{}: {} (was {})'.format(word, count, before))
+
+    def replay(self):
+        '''
+        Generates stats of current word from scratch from archived tweets
+        (Stats(word, archive=True) keeps them). No API requests.
+        DIDN'T SAVE THE RESULTS! (self.save() - required)
+        '''
+        archive = TweetArchive(self.word, '{}/archive'.format(WORK_DIR))
+        self._acc = StatsAccumulator(self.top_k, self.uniques_capacity,
+                                     self.compact, self.distinct)
+        self._gen_stats(archive.replay())
+
+    def add_corpus(self, paths, processes=None):
+        '''
+        Adds stats of offline JSON-lines tweet files (by a pool of processes)
+        processes - number of processes, number of CPUs by default
+        '''
+        from corpus import corpus_stats    # Imported on use (process pool)
+        self._acc.merge(corpus_stats(paths, processes, top=self.top_k,
+                                     capacity=self.uniques_capacity,
+                                     compact=self.compact,
+                                     distinct=self.distinct))
+        self._finalize()
+
     def view(self, print_dicts=0):
         '''
         Prints statistics in legible way
@@ -294,15 +438,20 @@ class Stats(object):
         print('Statistics by word: {}'.format(self.word.upper()) )
         get_key = lambda x: x[1]    # Second element of tuple as sort key
 
-        for key ,value in sorted(self._stats.items()):
-            if isinstance(value, dict):
-                if print_dicts:
-                    print(u'\n[{key}]:\n'.format(key=key))
+        items = self._stats.items()
+        if print_dicts:
+            items.extend([('uniques', self.uniques),
+                          ('letters_per_word', self.letters_per_word),
+                          ('origin', self.origin)])
 
-                    for key2, value2 in sorted(value.items(), \
-                                               reverse=True, key=get_key):
-                        if value2 > 1:
-                            print(u'{key}: {value}'.format(key=key2, value=value2))
+        for key ,value in sorted(items):
+            if hasattr(value, 'items'):    # dict, Counter or CompactCounter
+                print(u'\n[{key}]:\n'.format(key=key))
+
+                for key2, value2 in sorted(value.items(), \
+                                           reverse=True, key=get_key):
+                    if value2 > 1:
+                        print(u'{key}: {value}'.format(key=key2, value=value2))
             elif isinstance(value, list):
                 print(u'\n[{}]:\n\n'
                         '{}'.format(key, ' '.join(value)))
@@ -314,197 +463,262 @@ class Stats(object):
 
     def load(self):
         '''
-        Loads data from file and decrypts it.
+        Loads data from file and decrypts it (see storage).
+        Large dictionaries (uniques, letters_per_word, origin) are loaded
+        on the first access.
         '''
         try:
-            with open('{}/stats/{}.data'.format(WORK_DIR, self.word), 'r') as f:
-                encrypted_str = f.read()
-            decrypted_str = Stats._decrypt(encrypted_str)    # Decodes string
-            reconst_dict = json.loads(decrypted_str)     # Reconstructs original DICT
-
-            if isinstance(reconst_dict, dict):
-                self._stats.update(reconst_dict)
-
+            self._load_file()
         except IOError:
             print('No such file.\nCreating new statistics.\n')
             self.refresh()
 
+    def _load_file(self):
+        '''
+        Loads saved stats (see load). IOError if there is no file, no
+        fetching then (read only users: api)
+        '''
+        with metrics.registry.timer('load_seconds'):
+            reconst_dict, loader = self.storage.open(self.word)
+
+        if isinstance(reconst_dict, dict):
+            self._acc = StatsAccumulator.from_dict(reconst_dict, loader,
+                top=self.top_k, capacity=self.uniques_capacity,
+                compact=self.compact, distinct=self.distinct)
+            self._finalize()
+
 
     def save(self):
         '''
-        Encrypts data and saves it to file
+        Encrypts data and saves it to file (see storage)
         '''
-        path = '{}/stats/'.format(WORK_DIR)
-        if not os.path.exists(path):    # Create FOLDER if not exist
-            os.makedirs(path)
-
-        with open('{}{}.data'.format(path, self.word), 'w+') as f:
-            data_to_write = json.dumps(self._stats)
-            f.write( Stats._encrypt(data_to_write) )
+        with metrics.registry.timer('save_seconds'):
+            self.storage.save(self.word, self._acc.to_dict())
+        if self._seen is not None:
+            # Search never returns older tweets again
+            self._seen.prune(id_from_time(time.time() - 2 * SEARCH_DEPTH))
+            save_ids(self._seen, self._ids_path())
     
+    def _load_saved(self):
+        '''
+        Loads saved stats before new tweets are added to them (not again if
+        stats have tweets already)
+        '''
+        if (not self._acc.tweets_count) and self.storage.exists(self.word):
+            self.load()
+
     def _gen_stats(self, tweet_gen):
         '''
         Generate stats from the GENERATOR by query
 
         tweet_gen - generator or iterable of tweets 
         '''
-        BIAS = 20    # Max word len bias
-
-        stats = self._stats
-        
-        for tweet in tweet_gen:
-
-            words = self.extract_words( tweet[u'text'].lower() )
-            # Unique words
-            stats['uniques'].update( Counter(words) )
-            # words count by length (letters per word)
-            stats['letters_per_word'].update( Counter([len(word) for word in words]) )
-            # time zones - origin of tweet
-            stats['origin'].update( Counter({tweet[u'user'][u'time_zone']:1}) )
-            # Global sum of all retweets
-            stats['global_retweets'] += int(tweet[u'retweet_count'])
-            # Global tweets length
-            stats['global_length']    +=  len(tweet)    
-            # Global words count
-            stats['global_words_count'] += len(words)
-            # Global sentences count
-            stats['global_sentences'] += tweet[u'text'].count('.')
-
-        start_time = time.time()
-        if self.tweets_count <= 0:
-            self.tweets_count = 1
-        # Remove too big words
-        stats['letters_per_word'] = \
-            {k:v for k,v in stats['letters_per_word'].items() if k < BIAS}
-        # avg retweets per tweet
-        stats['avg_retweets'] = stats['global_retweets'] / self.tweets_count
-        # avg length (chars per tweet)
-        stats['avg_length'] = stats['global_length'] / self.tweets_count
-        # avg words per tweet
-        stats['avg_words_count'] = stats['global_words_count'] / self.tweets_count
-        # avg sentences per tweet
-        stats['avg_sentences'] = stats['global_sentences'] / self.tweets_count
-        # unique words count
-        stats['unique_words_count'] = len(stats['uniques'].keys())
-        # unique words count % of all words
-        stats['unique_words_count_per'] = \
-            stats['unique_words_count'] / stats['global_words_count']
-        #stats['avg_word_len'] = IMPLEMENT (like: 4.56 letters per word)
-        if self.tweets_count == 1:
-            stats['avg_sentences'] = 1
-        stats['avg_words_per_sentence'] = stats['avg_words_count'] /\
-            stats['avg_sentences']
-
-        get_key = lambda x: stats['uniques'][x]
-        stats['unique_30_most'] = sorted(stats['uniques'].keys(), reverse=True, \
-                key=get_key)[0:30]
-        print('stats generated in {:.5f} seconds\n'.format(time.time() - start_time))
-
-    def _get_tweets(self):
-        '''
-        Get tweets from Twitter REST API
-        '''
-        # Create query
-        TWEETS_TO_GET = 100
-        RESULT_TYPE = 'mixed' #'recent'
-        IDLE = 6    #seconds (< 180 requests in 15 mins window)
-        ERROR_CODES = { '400':'Bad Request',
-                        '401':'Unauthorized',
-                        '403':'Forbidden',
-                        '410':'Gone',
-                        '429':'Too Many Requests',
-                        '504':'Gateway timeout'
-                        }
-
-        query = (
-            'https://api.twitter.com/1.1/search/tweets.json?'
-            'q={}&count={}&result_type={}&lang={}'
-            ''.format(self.word, TWEETS_TO_GET, RESULT_TYPE, self.lang) 
-            )
+        registry = metrics.registry
+        spent = 0    # Aggregation only, not waiting for tweets
+        if self.batch_size > 1:
+            for batch in batches(tweet_gen, self.batch_size):
+                start_time = timer()
+                if self.windows is None:
+                    self._acc.add_batch(batch)
+                else:    # Words of every tweet: a batch may span buckets
+                    with registry.timer('tokenize_seconds'):
+                        words = [tokenize(tweet[u'text']) for tweet in batch]
+                    self._acc.add_batch(batch,
+                                        list(chain.from_iterable(words)))
+                    self.windows.add_batch(batch, words)
+                batch_time = timer() - start_time
+                spent += batch_time
+                registry.observe('aggregate_seconds', batch_time)
+                registry.inc('tweets_aggregated_total', len(batch))
+        else:
+            for tweet in tweet_gen:
+                start_time = timer()
+                self._add_tweet(tweet)
+                spent += timer() - start_time
+                registry.inc('tweets_aggregated_total')
+            registry.observe('aggregate_seconds', spent)
+        spent += self._finalize()
+        print('stats generated in {:.5f} seconds\n'.format(spent))
+
+    def _add_tweet(self, tweet):
+        '''
+        Adds single tweet to stats (without averages, see _finalize)
+        '''
+        with metrics.registry.timer('tokenize_seconds'):
+            words = tokenize( tweet[u'text'] )
+        self._acc.add(tweet, words)
+        if self.windows is not None:
+            self.windows.add(tweet, words)
+
+    def _finalize(self):
+        '''
+        Calculates averages and top words after tweets are added.
+        Returns seconds spent.
+        '''
+        start_time = timer()
+        self._stats = self._acc.views()
+        spent = timer() - start_time
+        metrics.registry.observe('finalize_seconds', spent)
+        return spent
+
+    def _get_tweets(self, since_id=None, gaps=()):
+        '''
+        Get tweets from Twitter REST API (see fetcher.Fetcher)
+
+        since_id - get only tweets newer than this id
+        gaps - [(since_id, max_id), ...] older ranges left by previous runs
+        '''
+        fetcher = Fetcher(self.set_client, limiter=self.limiter,
+                          workers=self.workers)
+        seen = self._seen_ids()
+        if seen is None:    # Within this run only
+            seen = set()
+        plans = [fetcher.query(self.word, self.lang, since_id, seen=seen)]
+        plans.extend(fetcher.query(self.word, self.lang, lower, upper,
+                                   seen=seen)
+                     for lower, upper in gaps)
 
         # Get as much tweets as possible during the time_interval
-        start_time = time.time()
-        tweet_id = set()
+        return self._downloaded(self._walk(fetcher, plans, since_id))
+
+    def _walk(self, fetcher, plans, since_id):
+        '''
+        Tweets of plans. Ranges the walk did not reach before the deadline
+        become gaps of stats, so since_id can move to the newest tweet
+        without losing older ones: the next run fetches them.
+        '''
+        newest_id = since_id
+        for _, tweet in fetcher.run(plans, self.time_interval):
+            newest_id = max(newest_id, tweet[u'id'])
+            yield tweet
+        self._acc.gaps = unwalked(plans, newest_id)
+
+    def _stream_tweets(self, duration=None):
+        '''
+        Get tweets from Twitter streaming API as they come (see stream)
+
+        duration - seconds to listen, None - till Ctrl+C
+        '''
+        tweets = TweetStream(self.word, self.lang,
+                             self.client.signer).tweets(duration)
+        try:
+            # Duplicates are neither archived nor counted as downloaded
+            for tweet in self._downloaded(self._unseen(tweets)):
+                yield tweet
+        except KeyboardInterrupt:    # Stats of tweets got so far are kept
+            print('\nstream stopped')
+
+    def _unseen(self, tweets):
+        '''
+        Tweets not counted yet (the stream repeats some after reconnects)
+        '''
+        seen = self._seen_ids()
+        if seen is None:
+            seen = set()
+        for tweet in tweets:
+            if tweet[u'id'] in seen:    # Excludes DUPLICATES
+                metrics.registry.inc('tweets_duplicate_total')
+                continue
+            seen.add(tweet[u'id'])
+            yield tweet
+
+    def _downloaded(self, tweets):
+        '''
+        Counts (and archives) tweets while passing them through
+        '''
         self.tweets_count = 0
+        if self.archive:
+            archive = TweetArchive(self.word, '{}/archive'.format(WORK_DIR))
+            tweets = archive.tee(tweets)
+        try:
+            for tweet in tweets:
+                yield tweet
+                self.tweets_count += 1
+        finally:
+            print('{} unique tweets downloaded.'.format(self.tweets_count))
+
+    def _seen_ids(self):
+        '''
+        Ids of counted tweets kept across runs, None if dedup is off
+        '''
+        if (self._seen is None) and (self.dedup not in (None, False)):
+            ids = IdSet() if self.dedup is True else self.dedup
+            if self.storage.exists(self.word):    # Ids without stats are stale
+                ids = load_ids(self._ids_path(), ids)
+            self._seen = ids
+        return self._seen
 
-        while (time.time() - start_time) <= self.time_interval:
-
-            resp, content = self.client.request(query)
-
-            print( '{}:\nserver answer: {}'.format( \
-                time.ctime().split(' ')[3], resp['status']) )
-            print('{} sec. remaining.'.format(round( \
-                self.time_interval-(time.time() - start_time), 2)) )
-
-            response = json.loads(content)
-
-            if resp['status'] == '200':
-                if 'statuses' in response.keys():
-                    for tweet in response['statuses']:
-                        if not tweet['id'] in tweet_id:    # Excludes DUPLICATES
-                            tweet_id.add(tweet['id'])
-                            yield tweet
-                            self.tweets_count += 1
-                    print('{} unique tweets downloaded.'.format(self.tweets_count))
-                    self._idle(IDLE)
-                elif (resp['status'] == '429')and(self.time_interval > 910):
-                    self._idle(900)    # 15 minutes
-            else :
-                print('Twitte API Error: [{code}]:{descr}'.format( \
-                    code=resp['status'], descr=ERROR_CODES[resp['status']]))
-                break
+    def _ids_path(self):
+        return '{}/{}.ids'.format(self.storage.directory, self.word)
 
-    @staticmethod
-    def set_client(key=CONSUMER_KEY, secret=CONSUMER_SECRET, \
-                   acc_key=ACCESS_TOKEN, acc_secret=ACCESS_TOKEN_SECRET):
+    @property
+    def client(self):
         '''
-        Creates Twitter API Client as self.client
+        Twitter API client shared by all instances, created on the first use
         '''
+        if Stats._client is None:
+            with Stats._client_lock:
+                if Stats._client is None:
+                    Stats._client = self.set_client()
+        return Stats._client
+
+    @staticmethod
+    def set_client(key=None, secret=None, acc_key=None, acc_secret=None):
+        '''
+        Creates new Twitter API client (keys from auth_info by default):
+        transport.Transport signed with OAuth, connections are pooled and
+        shared by all clients
+        '''
+        # Imported on the first client: no oauth2 import at start
+        import oauth2
+        import auth_info
+        # File auth_info.py has to be in the same dir. Content:
+        #CONSUMER_KEY = <key>
+        #CONSUMER_SECRET = <secret>
+        #ACCESS_TOKEN = <token>
+        #ACCESS_TOKEN_SECRET = <token secret>
+        key = key or auth_info.CONSUMER_KEY
+        secret = secret or auth_info.CONSUMER_SECRET
+        acc_key = acc_key or auth_info.ACCESS_TOKEN
+        acc_secret = acc_secret or auth_info.ACCESS_TOKEN_SECRET
+
         consumer = oauth2.Consumer(key=key, secret=secret)
         token = oauth2.Token(key=acc_key, secret=acc_secret)
 
-        return oauth2.Client(consumer, token)
+        return Transport(signer=oauth_signer(oauth2.Client(consumer, token)))
+
+    @staticmethod
+    def default_storage():
+        '''
+        Stats files backend: WORK_DIR/stats, encrypted if TWITTER_STATS_KEY
+        environment variable is set
+        '''
+        return BinaryStorage('{}/stats'.format(WORK_DIR),
+                             key=os.environ.get('TWITTER_STATS_KEY'))
 
     @staticmethod
     def _encrypt(s, code=5):
         '''
         Encrypts s string with base64 alg + Caesar cipher.
         '''
-        def c_encode(c, code):
-            # Ceasar encode for single CHR
-            return chr( (((ord(c)-48) + code) % 75) + 48)
-
-        result = b64encode(s)
- 
-        return ''.join([c_encode(c, code) for c in result])
+        return caesar_encrypt(s, code)
 
     @staticmethod
     def _decrypt(s, code=5):
         '''
         Decryption. Opposite to Encryption :)
         '''
-        def c_decode(c, code):
-            # Ceasar decode for single CHR
-            return chr( (((ord(c)-48) - code) % 75) + 48)
-
-        result = ''.join([c_decode(c, code) for c in s])
-
-        return b64decode(result)
+        return caesar_decrypt(s, code)
 
     @staticmethod
     def extract_words(s):
         '''
-        Split string by white_space and Strips all the punctuation marks.
+        Splits string by white space, skips URLs and strips all the
+        punctuation marks (see tokenizer.tokenize).
         TODO:
         Use word Stemming to generalize stats (requires external module).
         '''
-        #EXCLUDE_SET - imported from exclude.py
-        EXCLUDE_CHR = '1234567890!%^&*$()_+=-[]{}|,:;\'\"?'
-        # Excludes CHR's, 'http' from 
-        result = filter( lambda x: not x.count('http'),\
-            map( lambda x: x.strip(EXCLUDE_CHR), s.split(' ') ))
-
-        return [word for word in result if not word in EXCLUDE_SET]
+        return tokenize(s)
 
     @staticmethod
     def _idle(interval=10):
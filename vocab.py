@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+'''
+Compact counters of tokens (uniques, origin) for many keywords in one
+process.
+
+Counter keeps a str, an int and a dict slot for every key of every
+keyword. Here tokens are interned once per process (Vocabulary: token <->
+integer id) and a counter keeps only two array columns: sorted token ids
+and their counts (4 bytes each). New ids wait in a small dict and are
+merged into the columns in bulk.
+
+CompactCounter is a Counter-compatible mapping (missing keys count 0,
+update by tokens or by mapping, most_common), so code using Counter
+works with it unchanged. Counts are non-negative; 0 means no key.
+'''
+
+import heapq
+import threading
+
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from collections import MutableMapping
+from itertools import chain
+from itertools import izip
+from operator import itemgetter
+
+
+ID_TYPE = 'I'    # Token ids: unsigned 32 bit
+COUNT_TYPE = 'I'    # Counts, widened to WIDE_TYPE on overflow
+try:
+    WIDE_TYPE = array('q').typecode
+except ValueError:    # No 'q' in Python 2 array
+    WIDE_TYPE = 'l'
+COUNT_MAX = 2 ** (8 * array(COUNT_TYPE).itemsize) - 1
+PENDING = 4096    # Min new ids kept out of the columns (merged in bulk)
+
+
+class Vocabulary(object):
+    '''
+    Interning table: token <-> integer id. Ids are never reused, the table
+    only grows (tokens of all counters sharing it). Thread safe.
+    '''
+
+    def __init__(self):
+        self._ids = {}
+        self._tokens = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def id(self, token):
+        '''
+        Id of token, None if it was never interned
+        '''
+        return self._ids.get(token)
+
+    def intern(self, token):
+        '''
+        Id of token (new id for a new token)
+        '''
+        token_id = self._ids.get(token)
+        if token_id is None:
+            with self._lock:
+                token_id = self._ids.get(token)
+                if token_id is None:
+                    token_id = len(self._tokens)
+                    self._tokens.append(token)    # Before id is visible
+                    self._ids[token] = token_id
+        return token_id
+
+    def token(self, token_id):
+        return self._tokens[token_id]
+
+
+vocabulary = Vocabulary()    # Shared by all counters by default
+
+
+class CompactCounter(MutableMapping):
+    '''
+    Counter of tokens as array columns of interned ids and counts.
+
+    iterable - tokens or mapping of token:count to count (like Counter)
+    vocab - Vocabulary (the shared one by default)
+    '''
+
+    def __init__(self, iterable=None, vocab=None):
+        self.vocab = vocab or vocabulary
+        self._ids = array(ID_TYPE)    # Sorted
+        self._counts = array(COUNT_TYPE)    # 0 - deleted, dropped by _flush
+        self._pending = {}    # {id: count} of ids not in columns yet
+        self._size = 0    # Keys with count > 0
+        if iterable is not None:
+            self.update(iterable)
+
+    def __getitem__(self, token):
+        token_id = self.vocab.id(token)
+        if token_id is None:
+            return 0
+        count = self._pending.get(token_id)
+        if count is not None:
+            return count
+        ids = self._ids    # _find inlined: called for every word of batch
+        index = bisect_left(ids, token_id)
+        if (index < len(ids)) and (ids[index] == token_id):
+            return self._counts[index]
+        return 0
+
+    def __setitem__(self, token, count):
+        if count < 0:
+            raise ValueError('negative count: {}'.format(count))
+        if not count:
+            del self[token]
+            return
+        token_id = self.vocab.intern(token)
+        if token_id in self._pending:
+            self._pending[token_id] = count
+            return
+        index = self._find(token_id)
+        if index < 0:
+            self._add_new(token_id, count)
+            return
+        if not self._counts[index]:
+            self._size += 1
+        self._store(index, count)
+
+    def __delitem__(self, token):
+        '''
+        Like Counter: missing token is ignored
+        '''
+        token_id = self.vocab.id(token)
+        if token_id is None:
+            return
+        if self._pending.pop(token_id, None) is not None:
+            self._size -= 1
+            return
+        index = self._find(token_id)
+        if (index >= 0) and self._counts[index]:
+            self._counts[index] = 0
+            self._size -= 1
+
+    def __contains__(self, token):
+        return self[token] > 0
+
+    def __iter__(self):
+        for token, _ in self.iteritems():
+            yield token
+
+    def __len__(self):
+        return self._size
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, dict(self.items()))
+
+    def get(self, token, default=None):
+        count = self[token]
+        return count if count else default
+
+    def iteritems(self):
+        token = self.vocab.token
+        for token_id, count in self._iter_ids():
+            yield token(token_id), count
+
+    def items(self):
+        self._flush()    # Counters are listed when saved: leave them compact
+        return list(self.iteritems())
+
+    def update(self, iterable=None, **kwargs):
+        '''
+        Like Counter.update: iterable of tokens or mapping of token:count
+        '''
+        if iterable is None:
+            iterable = kwargs
+        if isinstance(iterable, CompactCounter) and \
+                (iterable.vocab is self.vocab):
+            pairs = iterable._iter_ids()    # Ids are the same: no interning
+        else:
+            if not hasattr(iterable, 'items'):
+                iterable = Counter(iterable)    # Every token interned once
+            intern = self.vocab.intern
+            pairs = ((intern(token), count) for token, count in
+                     iterable.items())
+
+        self._add_all(pairs)
+
+    def most_common(self, n=None):
+        '''
+        [(token, count), ...] sorted by count, the n most common only if
+        n is given
+        '''
+        if n is None:
+            return sorted(self.iteritems(), key=itemgetter(1), reverse=True)
+        return heapq.nlargest(n, self.iteritems(), key=itemgetter(1))
+
+    def nbytes(self):
+        '''
+        Memory of columns (without pending ids and shared vocabulary)
+        '''
+        return (len(self._ids) * self._ids.itemsize +
+                len(self._counts) * self._counts.itemsize)
+
+    def _iter_ids(self):
+        for token_id, count in izip(self._ids, self._counts):
+            if count:
+                yield token_id, count
+        for token_id, count in list(self._pending.items()):
+            yield token_id, count
+
+    def _find(self, token_id):
+        '''
+        Index of token_id in columns, -1 if it isn't there
+        '''
+        ids = self._ids
+        index = bisect_left(ids, token_id)
+        if (index < len(ids)) and (ids[index] == token_id):
+            return index
+        return -1
+
+    def _add_all(self, pairs):
+        '''
+        Adds counts of (id, count) pairs (hot loop: _find inlined)
+        '''
+        pending = self._pending
+        ids, counts = self._ids, self._counts
+        size = len(ids)
+        for token_id, count in pairs:
+            if not count:
+                continue
+            old = pending.get(token_id)
+            if old is not None:
+                pending[token_id] = old + count
+                continue
+            index = bisect_left(ids, token_id)
+            if (index < size) and (ids[index] == token_id):
+                old = counts[index]
+                if not old:
+                    self._size += 1
+                try:
+                    counts[index] = old + count
+                except OverflowError:
+                    self._store(index, old + count)
+                    counts = self._counts
+            else:
+                self._add_new(token_id, count)
+                if pending is not self._pending:    # Flushed
+                    pending = self._pending
+                    ids, counts = self._ids, self._counts
+                    size = len(ids)
+
+    def _add_new(self, token_id, count):
+        self._pending[token_id] = count
+        self._size += 1
+        if len(self._pending) > max(PENDING, len(self._ids) >> 2):
+            self._flush()
+
+    def _store(self, index, count):
+        try:
+            self._counts[index] = count
+        except OverflowError:
+            self._counts = array(WIDE_TYPE, self._counts)
+            self._counts[index] = count
+
+    def _flush(self):
+        '''
+        Merges pending ids into columns, drops deleted ones
+        '''
+        pending = self._pending
+        if (not pending) and (self._size == len(self._ids)):
+            return
+        ids, counts = self._ids, self._counts
+        if self._size != len(ids) + len(pending):    # Deleted ids
+            live = [index for index, count in enumerate(counts) if count]
+            ids = array(ID_TYPE, [ids[index] for index in live])
+            counts = array(counts.typecode, [counts[index] for index in live])
+        if not pending:    # Deleted ids only
+            self._ids, self._counts = ids, counts
+            return
+        new_ids = sorted(pending)
+
+        if (not ids) or (new_ids[0] > ids[-1]):    # Newer ids: append
+            ids.extend(new_ids)
+            new_counts = [pending[token_id] for token_id in new_ids]
+        else:
+            # Two sorted runs: timsort merges them in C. Counts of old ids
+            # follow in the same order.
+            ids = sorted(chain(ids, new_ids))
+            old = iter(counts)
+            new_counts = [pending.get(token_id) or next(old)
+                          for token_id in ids]
+            counts = array(counts.typecode)
+            ids = array(ID_TYPE, ids)
+        if new_counts and (max(new_counts) > COUNT_MAX):
+            counts = array(WIDE_TYPE, counts)
+        counts.extend(new_counts)
+        self._ids, self._counts = ids, counts
+        self._pending = {}
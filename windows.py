@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+'''
+Time-bucketed statistics with sliding windows.
+
+Tweets are put into per-minute/hour/day buckets by created_at. Buckets live
+in a ring buffer, so the oldest ones are dropped as new ones come, and
+window queries merge only the buckets they need:
+
+windows = BucketedStats('minute', 120)
+current, previous = windows.compare(3600)    # last hour vs previous hour
+windows.trending(3600)
+'''
+from __future__ import division
+
+import calendar
+
+from accumulator import StatsAccumulator
+from fetcher import TWEPOCH
+from tokenizer import tokenize
+
+
+RESOLUTIONS = {'minute': 60, 'hour': 3600, 'day': 86400}
+MONTHS = {'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+          'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12}
+
+
+def tweet_time(tweet):
+    '''
+    Timestamp of tweet by created_at ('Wed Aug 27 13:08:45 +0000 2008'),
+    by its Snowflake id if there is no created_at.
+    '''
+    created_at = tweet.get(u'created_at')
+    if not created_at:
+        return ((tweet[u'id'] >> 22) + TWEPOCH) / 1000
+    _, month, day, clock, zone, year = created_at.split()
+    hour, minute, second = clock.split(':')
+    offset = int(zone[1:3]) * 3600 + int(zone[3:5]) * 60
+    if zone[0] == '-':
+        offset = -offset
+    return calendar.timegm((int(year), MONTHS[month], int(day), int(hour),
+                            int(minute), int(second))) - offset
+
+
+class BucketedStats(object):
+    '''
+    Ring buffer of StatsAccumulator per time bucket.
+
+    resolution - bucket length: 'minute', 'hour', 'day' or seconds
+    buckets - number of buckets kept (window depth)
+    kwargs - see StatsAccumulator (top, capacity)
+    '''
+
+    def __init__(self, resolution='hour', buckets=48, **kwargs):
+        self.span = RESOLUTIONS.get(resolution, resolution)
+        self.size = buckets
+        self.kwargs = kwargs
+        self.newest = None    # Number of the newest bucket
+        self._slots = [None] * buckets    # (bucket number, accumulator)
+
+    def add(self, tweet, words=None):
+        '''
+        Adds tweet to its bucket. False if the bucket is already dropped.
+        '''
+        acc = self._bucket(int(tweet_time(tweet) // self.span))
+        if acc is None:
+            return False
+        acc.add(tweet, tokenize(tweet[u'text']) if words is None else words)
+        return True
+
+    def add_batch(self, tweets, words=None):
+        '''
+        Adds tweets to their buckets in one batch per bucket.
+        words - [words of tweet, ...] in order of tweets, if tokenized
+                already
+        '''
+        tweets = list(tweets)
+        if words is None:
+            words = [tokenize(tweet[u'text']) for tweet in tweets]
+        by_bucket = {}
+        for tweet, tweet_words in zip(tweets, words):
+            number = int(tweet_time(tweet) // self.span)
+            bucket = by_bucket.setdefault(number, ([], []))
+            bucket[0].append(tweet)
+            bucket[1].extend(tweet_words)
+        for number, (bucket_tweets, bucket_words) in sorted(by_bucket.items()):
+            acc = self._bucket(number)
+            if acc is not None:
+                acc.add_batch(bucket_tweets, bucket_words)
+
+    def buckets(self):
+        '''
+        [(start timestamp, accumulator), ...] of live buckets, the oldest
+        first
+        '''
+        if self.newest is None:
+            return []
+        return sorted((number * self.span, acc)
+                      for number, acc in filter(None, self._slots)
+                      if number > self.newest - self.size)
+
+    def window(self, start, end):
+        '''
+        StatsAccumulator of buckets starting in [start, end) (timestamps)
+        '''
+        merged = StatsAccumulator(**self.kwargs)
+        for bucket_start, acc in self.buckets():
+            if start <= bucket_start < end:
+                merged.merge(acc)
+        return merged
+
+    def last(self, seconds, now=None):
+        '''
+        StatsAccumulator of last seconds (bucket aligned).
+        now - end of window, the end of the newest bucket by default
+        '''
+        end = self._end(now)
+        return self.window(end - seconds, end)
+
+    def compare(self, seconds, now=None):
+        '''
+        (last seconds, previous seconds) accumulators
+        '''
+        end = self._end(now)
+        return (self.window(end - seconds, end),
+                self.window(end - 2 * seconds, end - seconds))
+
+    def trending(self, seconds, k=10, now=None):
+        '''
+        [(word, count now, count before), ...] - k words which frequency
+        grew the most in the last seconds compared to previous seconds
+        '''
+        current, previous = self.compare(seconds, now)
+        scale = max(current.global_words_count, 1) / \
+            max(previous.global_words_count, 1)
+        growth = []
+        for word, count in current.uniques.most_common(k * 10):
+            before = previous.uniques[word]
+            growth.append(((count + 1) / (before * scale + 1), word, count,
+                           before))
+        growth.sort(reverse=True)
+        return [(word, count, before) for _, word, count, before in growth[:k]]
+
+    def _end(self, now):
+        if now is not None:
+            return (int(now // self.span) + 1) * self.span
+        return ((self.newest or 0) + 1) * self.span
+
+    def _bucket(self, number):
+        '''
+        Accumulator of bucket, None if it is older than the ring buffer.
+        '''
+        if (self.newest is not None) and (number <= self.newest - self.size):
+            return None
+        if (self.newest is None) or (number > self.newest):
+            self.newest = number
+        slot = number % self.size
+        if (self._slots[slot] is None) or (self._slots[slot][0] != number):
+            self._slots[slot] = (number, StatsAccumulator(**self.kwargs))
+        return self._slots[slot][1]